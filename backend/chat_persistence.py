@@ -0,0 +1,272 @@
+"""
+NexRyde Chat Persistence
+Write-behind micro-batching for trip chat messages and per-user read markers
+"""
+
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+# MongoDB duplicate key error (a retried batch that partly landed)
+DUPLICATE_KEY_ERROR = 11000
+
+
+def message_time(message: Dict[str, Any]) -> Optional[datetime]:
+    """When a message was sent: `created_at`, or the ISO `timestamp` string
+    that messages stored by the original WebSocket chat carry instead"""
+    created_at = message.get("created_at")
+    if isinstance(created_at, datetime):
+        return created_at
+    timestamp = message.get("timestamp")
+    if isinstance(timestamp, datetime):
+        return timestamp
+    if isinstance(timestamp, str):
+        try:
+            return datetime.fromisoformat(timestamp.replace("Z", "+00:00")).replace(tzinfo=None)
+        except ValueError:
+            return None
+    return None
+
+
+class ChatPersistConfig:
+    """Batch sizing and flush cadence"""
+
+    # Flush at least this often while anything is pending
+    FLUSH_INTERVAL_SECONDS = 0.05
+    # Flush early once this many messages are waiting
+    FLUSH_BATCH_SIZE = 200
+    # Above this, submit() waits for a flush instead of growing the queue
+    MAX_PENDING_MESSAGES = 20000
+    # A sequence number still missing this long after later ones were allocated is
+    # treated as lost (e.g. a worker crashed mid-flush) and readers step over it
+    SEQUENCE_GAP_TIMEOUT_SECONDS = 30
+    # Trips whose sequence counter is known to exist, remembered per worker
+    MAX_SEQUENCED_TRIPS_CACHED = 10000
+
+
+class ChatPersister:
+    """
+    Chat messages are broadcast from memory first and persisted here.
+
+    Messages queue up and are written with insert_many every few
+    milliseconds or every FLUSH_BATCH_SIZE messages, whichever comes first.
+    Read receipts are per-user high-water marks in `trip_read_markers`
+    ({trip_id, user_id, last_read_at}); repeated "read" events between
+    flushes collapse into one upsert. close() drains everything, so a
+    graceful shutdown loses nothing.
+
+    Just before insertion each message gets `seq`, the next number from
+    its trip's `chat_sequences` counter ($inc, one per trip per flush).
+    Readers page on seq and stop at a gap, so a batch that lands late on
+    any worker is still returned instead of falling behind a cursor that
+    already moved past its created_at. A retried batch keeps its numbers.
+    """
+
+    def __init__(
+        self,
+        db,
+        flush_interval: float = ChatPersistConfig.FLUSH_INTERVAL_SECONDS,
+        batch_size: int = ChatPersistConfig.FLUSH_BATCH_SIZE,
+        max_pending: int = ChatPersistConfig.MAX_PENDING_MESSAGES
+    ):
+        self.db = db
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self.pending_messages: List[Dict[str, Any]] = []
+        # (trip_id, user_id) -> newest read timestamp
+        self.pending_reads: Dict[Tuple[str, str], datetime] = {}
+        self._sequenced_trips: set = set()
+        self._flush_lock = asyncio.Lock()
+        self._wake = asyncio.Event()
+        self.counters = {
+            "messages_submitted": 0,
+            "messages_flushed": 0,
+            "reads_submitted": 0,
+            "reads_flushed": 0,
+            "flushes": 0,
+            "flush_errors": 0
+        }
+
+    async def submit(self, message: Dict[str, Any]):
+        """Queue a message document for insertion"""
+        if len(self.pending_messages) >= self.max_pending:
+            # Backpressure: persist what is queued rather than grow without bound
+            await self.flush()
+        self.pending_messages.append(dict(message))
+        self.counters["messages_submitted"] += 1
+        if len(self.pending_messages) >= self.batch_size:
+            self._wake.set()
+
+    def mark_read(self, trip_id: str, user_id: str, read_at: Optional[datetime] = None):
+        """Advance a user's read marker for a trip"""
+        read_at = read_at or datetime.utcnow()
+        key = (trip_id, user_id)
+        if key not in self.pending_reads or read_at > self.pending_reads[key]:
+            self.pending_reads[key] = read_at
+        self.counters["reads_submitted"] += 1
+
+    def pending_for_trip(self, trip_id: str) -> List[Dict[str, Any]]:
+        """Queued (not yet written) messages for a trip, oldest first"""
+        return [m for m in self.pending_messages if m["trip_id"] == trip_id]
+
+    async def read_marker(self, trip_id: str, user_id: str) -> Optional[datetime]:
+        """A user's last-read timestamp for a trip, including unflushed reads"""
+        marker = await self.db.trip_read_markers.find_one(
+            {"trip_id": trip_id, "user_id": user_id}, {"_id": 0, "last_read_at": 1}
+        )
+        stored = marker.get("last_read_at") if marker else None
+        pending = self.pending_reads.get((trip_id, user_id))
+        if pending and (stored is None or pending > stored):
+            return pending
+        return stored
+
+    async def ensure_sequence(self, trip_id: str):
+        """
+        Make sure the trip has a `chat_sequences` counter. Messages stored
+        before sequencing existed are numbered first, in send time (see
+        message_time) then id order; concurrent callers assign the same
+        numbers, so racing workers agree.
+        """
+        if trip_id in self._sequenced_trips:
+            return
+        if await self.db.chat_sequences.find_one({"_id": trip_id}, {"_id": 1}) is None:
+            # No counter means every stored message is legacy; racing workers write identical numbers
+            legacy = await self.db.trip_messages.find(
+                {"trip_id": trip_id}, {"_id": 0, "id": 1, "created_at": 1, "timestamp": 1}
+            ).to_list(None)
+            legacy.sort(key=lambda m: (message_time(m) or datetime.min, m["id"]))
+            if legacy:
+                now = datetime.utcnow()
+                await self.db.trip_messages.bulk_write([
+                    UpdateOne({"id": message["id"]}, {"$set": {"seq": seq, "sequenced_at": now}})
+                    for seq, message in enumerate(legacy, 1)
+                ], ordered=False)
+            try:
+                await self.db.chat_sequences.insert_one({"_id": trip_id, "seq": len(legacy)})
+            except DuplicateKeyError:
+                pass
+        if len(self._sequenced_trips) >= ChatPersistConfig.MAX_SEQUENCED_TRIPS_CACHED:
+            self._sequenced_trips.clear()
+        self._sequenced_trips.add(trip_id)
+
+    async def _assign_sequence(self, trip_id: str, messages: List[Dict[str, Any]]):
+        await self.ensure_sequence(trip_id)
+        counter = await self.db.chat_sequences.find_one_and_update(
+            {"_id": trip_id}, {"$inc": {"seq": len(messages)}}, return_document=ReturnDocument.AFTER
+        )
+        first = counter["seq"] - len(messages) + 1
+        now = datetime.utcnow()
+        for offset, message in enumerate(sorted(messages, key=lambda m: (m["created_at"], m["id"]))):
+            message["seq"] = first + offset
+            message["sequenced_at"] = now
+
+    async def _sequence(self, messages: List[Dict[str, Any]]):
+        """Number the messages that have no seq yet (in place), one counter bump per trip"""
+        by_trip: Dict[str, List[Dict[str, Any]]] = {}
+        for message in messages:
+            if "seq" not in message:
+                by_trip.setdefault(message["trip_id"], []).append(message)
+        await asyncio.gather(*(self._assign_sequence(trip_id, batch) for trip_id, batch in by_trip.items()))
+
+    async def persist_now(self, message: Dict[str, Any]) -> Dict[str, Any]:
+        """Number and insert one message immediately (REST send path)"""
+        message = dict(message)
+        await self._sequence([message])
+        await self.db.trip_messages.insert_one(message)
+        return message
+
+    async def flush(self) -> int:
+        """Write pending messages and read markers; returns messages written"""
+        async with self._flush_lock:
+            messages, self.pending_messages = self.pending_messages, []
+            reads, self.pending_reads = self.pending_reads, {}
+            written = 0
+
+            try:
+                await self._sequence(messages)
+            except Exception as e:
+                # Numbers already assigned stay on the messages, so the retry reuses them
+                self.counters["flush_errors"] += 1
+                logger.error(f"Chat sequencing failed ({len(messages)} messages): {e}")
+                self.pending_messages[:0] = messages
+                messages = []
+
+            for start in range(0, len(messages), self.batch_size):
+                chunk = messages[start:start + self.batch_size]
+                try:
+                    await self.db.trip_messages.insert_many(chunk, ordered=False)
+                    written += len(chunk)
+                except BulkWriteError as e:
+                    # Duplicates are documents a previous failed attempt already stored
+                    failed = [err["index"] for err in e.details.get("writeErrors", [])
+                              if err.get("code") != DUPLICATE_KEY_ERROR]
+                    written += len(chunk) - len(failed)
+                    if failed:
+                        self.counters["flush_errors"] += 1
+                        logger.error(f"Chat flush: {len(failed)} of {len(chunk)} messages failed")
+                        self.pending_messages[:0] = [chunk[i] for i in failed]
+                except Exception as e:
+                    self.counters["flush_errors"] += 1
+                    logger.error(f"Chat flush failed ({len(chunk)} messages): {e}")
+                    self.pending_messages[:0] = chunk
+
+            if reads:
+                now = datetime.utcnow()
+                operations = [
+                    UpdateOne(
+                        {"trip_id": trip_id, "user_id": user_id},
+                        {"$max": {"last_read_at": read_at}, "$set": {"updated_at": now}},
+                        upsert=True
+                    )
+                    for (trip_id, user_id), read_at in reads.items()
+                ]
+                try:
+                    await self.db.trip_read_markers.bulk_write(operations, ordered=False)
+                    self.counters["reads_flushed"] += len(operations)
+                except Exception as e:
+                    self.counters["flush_errors"] += 1
+                    logger.error(f"Read marker flush failed ({len(operations)} markers): {e}")
+                    for key, read_at in reads.items():
+                        if key not in self.pending_reads or read_at > self.pending_reads[key]:
+                            self.pending_reads[key] = read_at
+
+            if messages or reads:
+                self.counters["flushes"] += 1
+            self.counters["messages_flushed"] += written
+            return written
+
+    async def run_forever(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Chat persister loop error: {e}")
+
+    async def close(self):
+        """Drain everything (called on shutdown)"""
+        await self.flush()
+        if self.pending_messages or self.pending_reads:
+            logger.error(
+                f"Chat persister closed with {len(self.pending_messages)} messages "
+                f"and {len(self.pending_reads)} read markers unwritten"
+            )
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self.counters,
+            "pending_messages": len(self.pending_messages),
+            "pending_reads": len(self.pending_reads),
+            "flush_interval_seconds": self.flush_interval,
+            "batch_size": self.batch_size
+        }
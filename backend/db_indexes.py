@@ -0,0 +1,182 @@
+"""
+NexRyde Database Indexes
+Declarative index registry, applied idempotently at startup, plus a missing/unused index report
+"""
+
+from typing import Any, Dict, List, Optional, Tuple
+from pymongo import ASCENDING, DESCENDING, IndexModel
+import logging
+
+logger = logging.getLogger(__name__)
+
+ASC = ASCENDING
+DESC = DESCENDING
+GEO = "2dsphere"
+
+
+class IndexSpec:
+    """
+    One index on one collection. Names are MongoDB's defaults derived from
+    the keys (e.g. `driver_id_1_status_1`), so indexes created earlier by
+    plain create_index calls are recognised and re-runs are no-ops.
+    """
+
+    def __init__(self, collection: str, keys: List[Tuple[str, Any]], purpose: str = "", **options):
+        self.collection = collection
+        self.keys = keys
+        self.purpose = purpose
+        self.options = options
+        self.name = self.model().document["name"]
+
+    def model(self) -> IndexModel:
+        return IndexModel(self.keys, **self.options)
+
+
+# Every index the application relies on, grouped by collection.
+# `purpose` names the hot query each one serves.
+INDEX_REGISTRY: List[IndexSpec] = [
+    # users
+    IndexSpec("users", [("id", ASC)], "lookup by id everywhere", unique=True),
+    IndexSpec("users", [("phone", ASC)], "OTP login / account lookup"),
+    IndexSpec("users", [("email", ASC)], "email login", sparse=True),
+    IndexSpec("users", [("google_id", ASC)], "Google sign-in", sparse=True),
+    IndexSpec("users", [("role", ASC), ("created_at", DESC), ("id", DESC)], "admin rider/driver lists by cursor"),
+    IndexSpec("users", [("role", ASC), ("rating", DESC), ("total_trips", DESC)], "top-rated driver leaderboard"),
+
+    # trips
+    IndexSpec("trips", [("id", ASC)], "lookup by id everywhere", unique=True),
+    IndexSpec("trips", [("status", ASC), ("created_at", ASC)], "pending trips, dispatcher windows"),
+    IndexSpec("trips", [("driver_id", ASC), ("status", ASC), ("completed_at", DESC)],
+              "driver stats, earnings, busy-driver checks"),
+    IndexSpec("trips", [("driver_id", ASC), ("created_at", DESC)], "driver trip history"),
+    IndexSpec("trips", [("rider_id", ASC), ("created_at", DESC)], "rider trip history"),
+    IndexSpec("trips", [("offered_to", ASC), ("status", ASC)], "driver offer polling", sparse=True),
+    IndexSpec("trips", [("pickup_point", GEO)], "$geoNear for pending trips"),
+    IndexSpec("trips", [("created_at", DESC), ("id", DESC)], "admin trip list by cursor"),
+    IndexSpec("trips", [("city", ASC), ("created_at", ASC)], "per-city trip exports"),
+
+    # drivers
+    IndexSpec("driver_profiles", [("user_id", ASC)], "profile by driver", unique=True),
+    IndexSpec("driver_profiles", [("is_online", ASC), ("location_updated_at", DESC)],
+              "online driver set, grid warm-up"),
+    IndexSpec("driver_profiles", [("location", GEO)], "$geoNear for nearby drivers"),
+    IndexSpec("driver_tiers", [("driver_id", ASC)], "tier by driver"),
+    IndexSpec("driver_verifications", [("user_id", ASC)], "verification by driver"),
+    IndexSpec("driver_verifications", [("status", ASC), ("submitted_at", DESC)],
+              "admin verification queue and counts"),
+    IndexSpec("driver_verifications", [("submitted_at", DESC), ("id", DESC)], "admin verification list by cursor"),
+    IndexSpec("subscriptions", [("driver_id", ASC), ("status", ASC)], "active subscription checks"),
+    IndexSpec("subscriptions", [("created_at", DESC), ("id", DESC)], "admin payment list by cursor"),
+    IndexSpec("driver_reports", [("created_at", DESC), ("report_id", DESC)], "admin report list by cursor"),
+    IndexSpec("driver_daily_stats", [("day", ASC)], "leaderboard builds and rollup pruning"),
+
+    # messaging and notifications
+    IndexSpec("trip_messages", [("trip_id", ASC), ("created_at", ASC), ("id", ASC)],
+              "resume from a timestamp cursor, legacy numbering"),
+    IndexSpec("trip_messages", [("trip_id", ASC), ("seq", ASC)], "trip chat pages by sequence number",
+              unique=True, partialFilterExpression={"seq": {"$exists": True}}),
+    IndexSpec("trip_read_markers", [("trip_id", ASC), ("user_id", ASC)], "per-user chat read high-water marks",
+              unique=True),
+    IndexSpec("notifications", [("user_id", ASC), ("created_at", DESC)], "notification feed"),
+    IndexSpec("notifications", [("user_id", ASC), ("read", ASC)], "unread counts, mark-all-read"),
+    IndexSpec("unread_counters", [("user_id", ASC), ("scope", ASC)], "unread badges per user", unique=True),
+    IndexSpec("unread_counters", [("scope", ASC)], "clear a finished trip's chat counters"),
+
+    # auth
+    IndexSpec("otp_records", [("phone", ASC)], "OTP lookup", unique=True),
+    # A record is only useful for the OTP lifetime and the daily send limit
+    IndexSpec("otp_records", [("last_sent_at", ASC)], "expire a day after the last send",
+              expireAfterSeconds=24 * 3600),
+    IndexSpec("user_sessions", [("session_token", ASC)], "session lookup"),
+
+    # sharing and bidding
+    IndexSpec("trip_shares", [("token", ASC)], "shared trip tracking"),
+    IndexSpec("trip_shares", [("expires_at", ASC)], "drop expired share links", expireAfterSeconds=0),
+    IndexSpec("ride_bids", [("id", ASC)], "bid by id", unique=True),
+    IndexSpec("ride_bids", [("status", ASC), ("expires_at", ASC)], "open bids for drivers"),
+    # Bids are kept a day past expiry for dispute lookups
+    IndexSpec("ride_bids", [("expires_at", ASC)], "drop stale bids", expireAfterSeconds=24 * 3600),
+
+    # short-lived stores
+    IndexSpec("fare_estimates", [("id", ASC)], "price-locked quote lookup", unique=True),
+    IndexSpec("fare_estimates", [("expires_at", ASC)], "drop quotes once the lock lapses",
+              expireAfterSeconds=0),
+    IndexSpec("trip_telemetry", [("trip_id", ASC), ("bucket_start", ASC)],
+              "breadcrumb upserts and ordered reads", unique=True),
+    IndexSpec("realtime_events", [("created_at", ASC)], "drop relayed WebSocket events",
+              expireAfterSeconds=300),
+
+    # safety and misc lookups
+    IndexSpec("trip_tracking", [("trip_id", ASC)], "speed tracking by trip"),
+    IndexSpec("sos_alerts", [("trip_id", ASC)], "SOS by trip"),
+    IndexSpec("safety_checks", [("trip_id", ASC)], "safety checks by trip"),
+    IndexSpec("call_logs", [("ride_id", ASC)], "calls by ride"),
+    IndexSpec("families", [("id", ASC)], "family by id"),
+    IndexSpec("promo_codes", [("code", ASC)], "promo redemption"),
+    IndexSpec("system_config", [("key", ASC)], "config lookup"),
+    IndexSpec("rider_preferences", [("user_id", ASC)], "preferences by rider"),
+    IndexSpec("loyalty_programs", [("user_id", ASC)], "loyalty by user"),
+]
+
+
+def specs_by_collection(registry: List[IndexSpec] = INDEX_REGISTRY) -> Dict[str, List[IndexSpec]]:
+    grouped: Dict[str, List[IndexSpec]] = {}
+    for spec in registry:
+        grouped.setdefault(spec.collection, []).append(spec)
+    return grouped
+
+
+async def apply_indexes(db, registry: List[IndexSpec] = INDEX_REGISTRY) -> Dict[str, Any]:
+    """
+    Create every registered index. Existing indexes with the same name and
+    options are left alone; a conflicting index is logged and skipped, so one
+    bad definition never blocks startup.
+    """
+    applied, failed = 0, []
+    for collection, specs in specs_by_collection(registry).items():
+        for spec in specs:
+            try:
+                await db[collection].create_indexes([spec.model()])
+                applied += 1
+            except Exception as e:
+                failed.append({"collection": collection, "name": spec.name, "error": str(e)})
+                logger.error(f"Index {collection}.{spec.name} not applied: {e}")
+    logger.info(f"Index registry applied: {applied} ok, {len(failed)} failed")
+    return {"applied": applied, "failed": failed}
+
+
+async def index_report(db, registry: List[IndexSpec] = INDEX_REGISTRY, collections: Optional[List[str]] = None) -> Dict[str, Any]:
+    """
+    Compare the registry with what exists. Lists registered indexes that are
+    missing, and existing indexes with no recorded use ($indexStats counts
+    since the last mongod restart) or no entry in the registry.
+    """
+    grouped = specs_by_collection(registry)
+    report: Dict[str, Any] = {"collections": {}, "missing": [], "unused": [], "unregistered": []}
+    for collection in collections or sorted(grouped):
+        declared = {spec.name: spec for spec in grouped.get(collection, [])}
+        existing = {index["name"]: index async for index in db[collection].list_indexes()}
+        usage = {}
+        try:
+            async for stat in db[collection].aggregate([{"$indexStats": {}}]):
+                usage[stat["name"]] = {"ops": stat["accesses"]["ops"], "since": stat["accesses"]["since"]}
+        except Exception as e:
+            logger.error(f"$indexStats failed for {collection}: {e}")
+
+        for name, spec in declared.items():
+            if name not in existing:
+                report["missing"].append({"collection": collection, "name": name, "keys": spec.keys, "purpose": spec.purpose})
+        for name in existing:
+            if name == "_id_":
+                continue
+            if name not in declared:
+                report["unregistered"].append({"collection": collection, "name": name})
+            if name in usage and usage[name]["ops"] == 0:
+                report["unused"].append({"collection": collection, "name": name, "since": usage[name]["since"]})
+
+        report["collections"][collection] = {
+            "declared": len(declared),
+            "existing": len(existing),
+            "usage": {name: stats["ops"] for name, stats in usage.items()}
+        }
+    return report
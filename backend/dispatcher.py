@@ -0,0 +1,321 @@
+"""
+NexRyde Trip Dispatcher
+Assigns pending trips to idle drivers in batched matching windows
+"""
+
+from datetime import datetime, timedelta
+from typing import List, Dict, Any, Optional, Set, Tuple, Callable, Awaitable
+from pymongo.errors import DuplicateKeyError
+import asyncio
+import logging
+import os
+import socket
+import uuid
+
+logger = logging.getLogger(__name__)
+
+
+class DispatchConfig:
+    """Matching window and offer settings"""
+
+    # How often pending trips and idle drivers are collected
+    WINDOW_SECONDS = 3
+    # How long a driver has to accept an offer before the trip is re-dispatched
+    OFFER_TTL_SECONDS = 20
+    # Candidate graph: each trip is linked to its nearest idle drivers only
+    CANDIDATE_RADIUS_KM = 10.0
+    CANDIDATES_PER_TRIP = 8
+    # Upper bound on trips considered in one window
+    MAX_TRIPS_PER_WINDOW = 500
+    # One worker dispatches at a time; another takes over once the leader's
+    # lease has not been renewed for this long
+    LEASE_SECONDS = WINDOW_SECONDS * 3
+
+
+# dispatch_leases document held by the worker currently running the windows
+DISPATCH_LEASE_ID = "trip_dispatcher"
+
+
+# Cost assigned to trip/driver pairs that are not in the candidate graph
+NO_EDGE_COST = 1e9
+
+
+def solve_min_cost_assignment(costs: List[List[float]]) -> List[int]:
+    """
+    Hungarian algorithm for an n x m cost matrix with n <= m.
+    Returns, for each row, the column assigned to it.
+    """
+    n = len(costs)
+    m = len(costs[0]) if n else 0
+    INF = float('inf')
+    # 1-indexed potentials and matching, as in the classic O(n^2 m) formulation
+    u = [0.0] * (n + 1)
+    v = [0.0] * (m + 1)
+    match_col = [0] * (m + 1)   # match_col[j] = row matched to column j
+    way = [0] * (m + 1)
+
+    for i in range(1, n + 1):
+        match_col[0] = i
+        j0 = 0
+        min_v = [INF] * (m + 1)
+        used = [False] * (m + 1)
+        while True:
+            used[j0] = True
+            i0 = match_col[j0]
+            delta = INF
+            j1 = 0
+            for j in range(1, m + 1):
+                if used[j]:
+                    continue
+                cur = costs[i0 - 1][j - 1] - u[i0] - v[j]
+                if cur < min_v[j]:
+                    min_v[j] = cur
+                    way[j] = j0
+                if min_v[j] < delta:
+                    delta = min_v[j]
+                    j1 = j
+            for j in range(m + 1):
+                if used[j]:
+                    u[match_col[j]] += delta
+                    v[j] -= delta
+                else:
+                    min_v[j] -= delta
+            j0 = j1
+            if match_col[j0] == 0:
+                break
+        while True:
+            j1 = way[j0]
+            match_col[j0] = match_col[j1]
+            j0 = j1
+            if j0 == 0:
+                break
+
+    assignment = [-1] * n
+    for j in range(1, m + 1):
+        if match_col[j]:
+            assignment[match_col[j] - 1] = j - 1
+    return assignment
+
+
+def assign_sparse(edges: Dict[Tuple[str, str], float]) -> List[Tuple[str, str, float]]:
+    """
+    Min-cost assignment over a sparse trip/driver candidate graph.
+
+    The graph is split into connected components so each Hungarian solve
+    only sees trips and drivers that actually compete with each other.
+    Returns (trip_id, driver_id, cost) for every matched pair.
+    """
+    # Union-find over trip and driver nodes
+    parent: Dict[Tuple[str, str], Tuple[str, str]] = {}
+
+    def find(node):
+        while parent.setdefault(node, node) != node:
+            parent[node] = parent[parent[node]]
+            node = parent[node]
+        return node
+
+    for trip_id, driver_id in edges:
+        parent[find(("trip", trip_id))] = find(("driver", driver_id))
+
+    components: Dict[Tuple[str, str], Dict[Tuple[str, str], float]] = {}
+    for (trip_id, driver_id), cost in edges.items():
+        components.setdefault(find(("trip", trip_id)), {})[(trip_id, driver_id)] = cost
+
+    matches = []
+    for component in components.values():
+        trips = sorted({t for t, _ in component})
+        drivers = sorted({d for _, d in component})
+        transpose = len(trips) > len(drivers)
+        rows, cols = (drivers, trips) if transpose else (trips, drivers)
+        matrix = []
+        for r in rows:
+            row = []
+            for c in cols:
+                key = (c, r) if transpose else (r, c)
+                row.append(component.get(key, NO_EDGE_COST))
+            matrix.append(row)
+
+        for row_index, col_index in enumerate(solve_min_cost_assignment(matrix)):
+            if col_index < 0:
+                continue
+            r, c = rows[row_index], cols[col_index]
+            trip_id, driver_id = (c, r) if transpose else (r, c)
+            cost = component.get((trip_id, driver_id))
+            if cost is not None:
+                matches.append((trip_id, driver_id, cost))
+    return matches
+
+
+class TripDispatcher:
+    """
+    Background dispatcher for pending trips.
+
+    Every window it collects unoffered pending trips, links each to its
+    nearest idle drivers from the live driver grid, solves a min-cost
+    assignment over that sparse graph (total pickup distance) and offers
+    each trip to exactly one driver. An offer locks the trip to that driver
+    until it is accepted, declined or expires, so drivers no longer race
+    each other through accept_trip.
+
+    Offers live only on the trip documents (offered_to, offer_expires_at),
+    so every worker and matching path sees the same reservations. Workers
+    elect a single dispatcher through a lease in `dispatch_leases`, and
+    the assignment is solved in a thread so a large component does not
+    stall the event loop.
+    """
+
+    def __init__(
+        self,
+        db,
+        driver_grid,
+        on_offer: Optional[Callable[[str, Dict[str, Any], float], Awaitable[None]]] = None
+    ):
+        self.db = db
+        self.driver_grid = driver_grid
+        self.on_offer = on_offer
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.is_leader = False
+        self.stats = {
+            "windows": 0,
+            "trips_considered": 0,
+            "offers_made": 0,
+            "total_pickup_km": 0.0,
+            "lease_acquisitions": 0
+        }
+
+    async def reserved_drivers(self, driver_ids) -> Set[str]:
+        """Drivers among `driver_ids` holding an unexpired offer, made by any worker"""
+        driver_ids = [d for d in driver_ids if d]
+        if not driver_ids:
+            return set()
+        return set(await self.db.trips.distinct("offered_to", {
+            "offered_to": {"$in": driver_ids},
+            "status": "pending",
+            "offer_expires_at": {"$gt": datetime.utcnow()}
+        }))
+
+    async def acquire_lease(self) -> bool:
+        """Take or renew the dispatcher lease; False while another worker holds it"""
+        now = datetime.utcnow()
+        try:
+            await self.db.dispatch_leases.find_one_and_update(
+                {"_id": DISPATCH_LEASE_ID, "$or": [{"holder": self.worker_id}, {"expires_at": {"$lte": now}}]},
+                {"$set": {"holder": self.worker_id, "expires_at": now + timedelta(seconds=DispatchConfig.LEASE_SECONDS)}},
+                upsert=True
+            )
+            leader = True
+        except DuplicateKeyError:
+            # The lease exists, is unexpired and belongs to someone else
+            leader = False
+        if leader and not self.is_leader:
+            self.stats["lease_acquisitions"] += 1
+            logger.info(f"Dispatcher lease acquired by {self.worker_id}")
+        self.is_leader = leader
+        return leader
+
+    async def release_lease(self):
+        """Hand the lease over at shutdown instead of letting it expire"""
+        if self.is_leader:
+            await self.db.dispatch_leases.delete_one({"_id": DISPATCH_LEASE_ID, "holder": self.worker_id})
+            self.is_leader = False
+
+    async def run_forever(self):
+        while True:
+            await asyncio.sleep(DispatchConfig.WINDOW_SECONDS)
+            try:
+                if await self.acquire_lease():
+                    await self.dispatch_once()
+            except Exception as e:
+                logger.error(f"Dispatch window failed: {e}")
+
+    async def dispatch_once(self) -> Dict[str, Any]:
+        """Run one matching window; returns what was offered"""
+        now = datetime.utcnow()
+
+        trips = await self.db.trips.find({
+            "status": "pending",
+            "$or": [{"offer_expires_at": None}, {"offer_expires_at": {"$lte": now}}]
+        }).sort("created_at", 1).to_list(DispatchConfig.MAX_TRIPS_PER_WINDOW)
+        if not trips:
+            return {"trips": 0, "offers": 0}
+
+        # Candidate graph from the live grid
+        candidates: Dict[str, List[Tuple[str, float]]] = {}
+        for trip in trips:
+            pickup = trip.get("pickup_location") or trip.get("pickup") or {}
+            if pickup.get("lat") is None or pickup.get("lng") is None:
+                continue
+            nearby = self.driver_grid.nearest(
+                pickup["lat"], pickup["lng"],
+                k=DispatchConfig.CANDIDATES_PER_TRIP,
+                radius_km=DispatchConfig.CANDIDATE_RADIUS_KM
+            )
+            declined = set(trip.get("declined_by", []))
+            candidates[trip["id"]] = [
+                (driver_id, distance) for driver_id, distance in nearby if driver_id not in declined
+            ]
+
+        driver_ids = list({d for pairs in candidates.values() for d, _ in pairs})
+        if not driver_ids:
+            return {"trips": len(trips), "offers": 0}
+
+        busy = set(await self.db.trips.distinct(
+            "driver_id", {"driver_id": {"$in": driver_ids}, "status": {"$in": ["accepted", "ongoing"]}}
+        ))
+        busy |= await self.reserved_drivers(driver_ids)
+        riders = await self.db.users.find(
+            {"id": {"$in": list({t["rider_id"] for t in trips})}},
+            {"id": 1, "blocked_drivers": 1}
+        ).to_list(len(trips))
+        blocked = {r["id"]: set(r.get("blocked_drivers", [])) for r in riders}
+        female_drivers = set()
+        if any(t.get("female_driver_only") for t in trips):
+            female_drivers = set(await self.db.users.distinct(
+                "id", {"id": {"$in": driver_ids}, "gender": "female"}
+            ))
+
+        edges: Dict[Tuple[str, str], float] = {}
+        trips_by_id = {t["id"]: t for t in trips}
+        for trip_id, pairs in candidates.items():
+            trip = trips_by_id[trip_id]
+            for driver_id, distance in pairs:
+                if driver_id in busy or driver_id in blocked.get(trip["rider_id"], ()):
+                    continue
+                if trip.get("female_driver_only") and driver_id not in female_drivers:
+                    continue
+                edges[(trip_id, driver_id)] = distance
+
+        offers = 0
+        expires_at = now + timedelta(seconds=DispatchConfig.OFFER_TTL_SECONDS)
+        # Pure-Python O(n^2 m) per component: keep it off the event loop
+        matches = await asyncio.to_thread(assign_sparse, edges)
+        for trip_id, driver_id, distance in matches:
+            result = await self.db.trips.update_one(
+                {
+                    "id": trip_id,
+                    "status": "pending",
+                    "$or": [{"offer_expires_at": None}, {"offer_expires_at": {"$lte": now}}]
+                },
+                {"$set": {
+                    "offered_to": driver_id,
+                    "offered_at": now,
+                    "offer_expires_at": expires_at,
+                    "offer_distance_km": round(distance, 2)
+                }}
+            )
+            if result.modified_count == 0:
+                continue
+            offers += 1
+            self.stats["total_pickup_km"] += distance
+            if self.on_offer:
+                try:
+                    await self.on_offer(driver_id, trips_by_id[trip_id], distance)
+                except Exception as e:
+                    logger.error(f"Offer notification failed for trip {trip_id}: {e}")
+
+        self.stats["windows"] += 1
+        self.stats["trips_considered"] += len(trips)
+        self.stats["offers_made"] += offers
+        if offers:
+            logger.info(f"Dispatch window: {len(trips)} pending trips, {offers} offers")
+        return {"trips": len(trips), "offers": offers}
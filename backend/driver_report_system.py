@@ -76,8 +76,15 @@ SEVERITY_POINTS = {
 class DriverReportSystem:
     """Manages driver reports and safety enforcement"""
     
-    def __init__(self, db):
+    def __init__(self, db, unread_counters=None):
         self.db = db
+        # Optional UnreadCounters, kept in step with notifications inserted here
+        self.unread_counters = unread_counters
+    
+    async def _insert_notification(self, notification: Dict[str, Any]):
+        await self.db.notifications.insert_one(notification)
+        if self.unread_counters:
+            self.unread_counters.incr_notifications(notification["user_id"])
     
     async def submit_report(
         self,
@@ -287,7 +294,7 @@ class DriverReportSystem:
                   f"At 10 points, your account will be temporarily suspended. " \
                   f"Please maintain professional behavior with all riders."
         
-        await self.db.notifications.insert_one({
+        await self._insert_notification({
             "user_id": driver_id,
             "type": "safety_warning",
             "title": "Safety Warning",
@@ -303,7 +310,7 @@ class DriverReportSystem:
                   f"Category: {category.replace('_', ' ').title()}. " \
                   f"Our team will review this report. Please ensure you maintain professional conduct."
         
-        await self.db.notifications.insert_one({
+        await self._insert_notification({
             "user_id": driver_id,
             "type": "report_notification",
             "title": "Rider Report",
@@ -327,7 +334,7 @@ class DriverReportSystem:
             message = f"Your account has been permanently suspended. Reason: {reason}. " \
                       f"Contact support for more information."
         
-        await self.db.notifications.insert_one({
+        await self._insert_notification({
             "user_id": driver_id,
             "type": "suspension",
             "title": "Account Suspended",
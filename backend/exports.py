@@ -0,0 +1,107 @@
+"""
+NexRyde Exports
+Constant-memory CSV/NDJSON streaming of large admin datasets straight from a MongoDB cursor
+"""
+
+from datetime import datetime
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+import csv
+import io
+import json
+
+# Documents fetched per cursor round trip, and rows per yielded chunk
+EXPORT_BATCH_SIZE = 1000
+
+EXPORT_FORMATS = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson"
+}
+
+# Columns per export; dotted names reach into nested documents
+EXPORT_COLUMNS: Dict[str, List[str]] = {
+    "trips": [
+        "id", "created_at", "status", "city", "service_type", "rider_id", "driver_id",
+        "pickup_location.address", "dropoff_location.address", "distance_km", "duration_mins",
+        "fare", "surge_multiplier", "payment_method", "payment_status",
+        "accepted_at", "started_at", "completed_at", "cancelled_at", "cancelled_by"
+    ],
+    "payments": [
+        "id", "created_at", "driver_id", "driver_name", "status", "amount", "payment_reference",
+        "transaction_id", "payment_submitted_at", "payment_verified_at", "start_date", "end_date"
+    ],
+    "drivers": [
+        "id", "created_at", "name", "phone", "email", "blocked", "total_trips", "rating",
+        "vehicle_type", "vehicle_model", "vehicle_plate", "is_online", "subscription_status"
+    ]
+}
+
+Enricher = Callable[[List[Dict[str, Any]]], Awaitable[None]]
+
+
+def field_value(doc: Dict[str, Any], column: str) -> Any:
+    value: Any = doc
+    for part in column.split("."):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value
+
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+def _csv_cell(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, default=_json_default)
+    return "" if value is None else value
+
+
+async def iter_batches(cursor, batch_size: int = EXPORT_BATCH_SIZE) -> AsyncIterator[List[Dict[str, Any]]]:
+    """Group a cursor's documents into lists of at most batch_size"""
+    batch: List[Dict[str, Any]] = []
+    async for doc in cursor:
+        batch.append(doc)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+async def stream_rows(
+    cursor,
+    columns: List[str],
+    fmt: str,
+    enrich: Optional[Enricher] = None,
+    batch_size: int = EXPORT_BATCH_SIZE
+) -> AsyncIterator[str]:
+    """
+    Yield an export chunk per batch of documents. Only one batch is held
+    in memory at a time, so the export size is bounded by the client,
+    not the server. `enrich` may add joined fields to a batch in place
+    (e.g. with batch_lookup), which keeps joins at one query per batch.
+    """
+    if fmt == "csv":
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(columns)
+        yield buffer.getvalue()
+    async for batch in iter_batches(cursor.batch_size(batch_size), batch_size):
+        if enrich:
+            await enrich(batch)
+        if fmt == "csv":
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            for doc in batch:
+                writer.writerow([_csv_cell(field_value(doc, column)) for column in columns])
+            yield buffer.getvalue()
+        else:
+            yield "".join(
+                json.dumps({column: field_value(doc, column) for column in columns}, default=_json_default) + "\n"
+                for doc in batch
+            )
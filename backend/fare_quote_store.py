@@ -0,0 +1,59 @@
+"""
+NexRyde Fare Quote Store
+Price-locked fare estimates shared across workers, with a bounded local cache in front
+"""
+
+from datetime import datetime
+from typing import Any, Dict, Optional
+import logging
+
+from route_cache import LRUTTLCache
+
+logger = logging.getLogger(__name__)
+
+# Max quotes kept in each worker's local cache
+LOCAL_QUOTE_CACHE_MAX_ENTRIES = 5000
+
+
+class FareQuoteStore:
+    """
+    Fare estimates keyed by estimate_id.
+
+    Quotes are written to the `fare_estimates` collection, whose TTL index on
+    `expires_at` lets MongoDB delete them once the price lock lapses, so any
+    worker can honour an estimate_id issued by another. Each worker keeps a
+    size-capped LRU+TTL cache in front, so the worker that issued a quote
+    (the common case) never reads it back from MongoDB.
+    """
+
+    def __init__(self, db, local_max_entries: int = LOCAL_QUOTE_CACHE_MAX_ENTRIES):
+        self.db = db
+        self.local = LRUTTLCache(local_max_entries, default_ttl_seconds=0)
+
+    async def put(self, estimate_id: str, quote: Dict[str, Any]):
+        """Store a quote; `quote["expires_at"]` sets both TTLs"""
+        await self.db.fare_estimates.insert_one({"id": estimate_id, **quote})
+        self._cache_locally(estimate_id, quote)
+
+    async def get(self, estimate_id: str) -> Optional[Dict[str, Any]]:
+        """Return a still-valid quote, or None if unknown or expired"""
+        quote = self.local.get(estimate_id)
+        if quote is not None:
+            return quote
+
+        # The TTL monitor runs about once a minute, so filter on expiry as well
+        doc = await self.db.fare_estimates.find_one(
+            {"id": estimate_id, "expires_at": {"$gt": datetime.utcnow()}},
+            {"_id": 0, "id": 0}
+        )
+        if doc:
+            self._cache_locally(estimate_id, doc)
+        return doc
+
+    def _cache_locally(self, estimate_id: str, quote: Dict[str, Any]):
+        remaining = (quote["expires_at"] - datetime.utcnow()).total_seconds()
+        if remaining > 0:
+            self.local.set(estimate_id, quote, ttl_seconds=remaining)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"local_cache": self.local.stats()}
@@ -0,0 +1,230 @@
+"""
+NexRyde Geo Service
+Nearest-driver and nearest-trip lookups backed by MongoDB 2dsphere indexes
+"""
+
+from datetime import datetime, timedelta
+from typing import List, Dict, Any, Optional, Tuple, Set
+import logging
+import math
+import time
+
+logger = logging.getLogger(__name__)
+
+# Drivers whose last GPS ping is older than this are not offered to riders
+DRIVER_LOCATION_MAX_AGE_MINUTES = 10
+
+# Default search radius and candidate count for matching
+DEFAULT_SEARCH_RADIUS_KM = 10.0
+DEFAULT_CANDIDATE_LIMIT = 20
+
+# Spatial grid cell size (~1.1 km of latitude per cell)
+GRID_CELL_DEGREES = 0.01
+KM_PER_DEGREE_LAT = 111.32
+
+
+def to_geojson_point(lat: float, lng: float) -> Dict[str, Any]:
+    """Build a GeoJSON point (MongoDB expects [lng, lat] order)"""
+    return {"type": "Point", "coordinates": [lng, lat]}
+
+
+def haversine_km(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    """Great-circle distance in km"""
+    lat1_rad = math.radians(lat1)
+    lat2_rad = math.radians(lat2)
+    delta_lat = math.radians(lat2 - lat1)
+    delta_lng = math.radians(lng2 - lng1)
+    a = math.sin(delta_lat / 2) ** 2 + math.cos(lat1_rad) * math.cos(lat2_rad) * math.sin(delta_lng / 2) ** 2
+    return 6371 * 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+
+
+class SpatialGrid:
+    """
+    In-process grid of live positions keyed by cell.
+
+    Positions are bucketed into fixed lat/lng cells; radius and k-nearest
+    queries only visit the rings of cells around the query point, so cost
+    depends on local density rather than fleet size. Entries that have not
+    been refreshed within `max_age_seconds` are ignored by queries and
+    dropped by `evict_stale`. MongoDB stays the durable copy; this grid is
+    per-process and rebuilt from it on startup.
+    """
+
+    def __init__(self, max_age_seconds: float, cell_degrees: float = GRID_CELL_DEGREES):
+        self.max_age_seconds = max_age_seconds
+        self.cell_degrees = cell_degrees
+        self.cells: Dict[Tuple[int, int], Set[str]] = {}
+        # entity_id -> (lat, lng, cell, updated_at monotonic)
+        self.positions: Dict[str, Tuple[float, float, Tuple[int, int], float]] = {}
+
+    def __len__(self) -> int:
+        return len(self.positions)
+
+    def __contains__(self, entity_id: str) -> bool:
+        return entity_id in self.positions
+
+    def _cell(self, lat: float, lng: float) -> Tuple[int, int]:
+        return (math.floor(lat / self.cell_degrees), math.floor(lng / self.cell_degrees))
+
+    def upsert(self, entity_id: str, lat: float, lng: float, updated_at: Optional[float] = None):
+        """Insert or move an entity"""
+        cell = self._cell(lat, lng)
+        previous = self.positions.get(entity_id)
+        if previous and previous[2] != cell:
+            self._remove_from_cell(entity_id, previous[2])
+        self.cells.setdefault(cell, set()).add(entity_id)
+        self.positions[entity_id] = (lat, lng, cell, updated_at if updated_at is not None else time.monotonic())
+
+    def remove(self, entity_id: str):
+        previous = self.positions.pop(entity_id, None)
+        if previous:
+            self._remove_from_cell(entity_id, previous[2])
+
+    def _remove_from_cell(self, entity_id: str, cell: Tuple[int, int]):
+        members = self.cells.get(cell)
+        if members is not None:
+            members.discard(entity_id)
+            if not members:
+                del self.cells[cell]
+
+    def get(self, entity_id: str) -> Optional[Tuple[float, float]]:
+        position = self.positions.get(entity_id)
+        return (position[0], position[1]) if position else None
+
+    def evict_stale(self) -> int:
+        """Drop entries that stopped reporting; returns how many were evicted"""
+        cutoff = time.monotonic() - self.max_age_seconds
+        stale = [entity_id for entity_id, p in self.positions.items() if p[3] < cutoff]
+        for entity_id in stale:
+            self.remove(entity_id)
+        return len(stale)
+
+    def nearest(
+        self,
+        lat: float,
+        lng: float,
+        k: int = DEFAULT_CANDIDATE_LIMIT,
+        radius_km: float = DEFAULT_SEARCH_RADIUS_KM
+    ) -> List[Tuple[str, float]]:
+        """
+        Return up to `k` (entity_id, distance_km) pairs within `radius_km`,
+        nearest first. Rings are visited outward and the search stops once
+        the next ring cannot contain anything closer than the k-th result.
+        """
+        if not self.positions or k <= 0:
+            return []
+
+        cutoff = time.monotonic() - self.max_age_seconds
+        # Narrowest cell edge around this latitude bounds how far one ring reaches
+        cell_km = self.cell_degrees * KM_PER_DEGREE_LAT * max(math.cos(math.radians(abs(lat) + self.cell_degrees)), 0.01)
+        max_ring = int(math.ceil(radius_km / cell_km)) + 1
+        center_x, center_y = self._cell(lat, lng)
+
+        found: List[Tuple[str, float]] = []
+        for ring in range(max_ring + 1):
+            # Anything in this ring or beyond is at least (ring - 1) cells away
+            if len(found) >= k and (ring - 1) * cell_km > found[k - 1][1]:
+                break
+            for cell in self._ring_cells(center_x, center_y, ring):
+                for entity_id in self.cells.get(cell, ()):
+                    e_lat, e_lng, _, updated_at = self.positions[entity_id]
+                    if updated_at < cutoff:
+                        continue
+                    distance = haversine_km(lat, lng, e_lat, e_lng)
+                    if distance <= radius_km:
+                        found.append((entity_id, distance))
+            found.sort(key=lambda item: item[1])
+        return found[:k]
+
+    def within_radius(self, lat: float, lng: float, radius_km: float) -> List[Tuple[str, float]]:
+        """All live entities within `radius_km`, nearest first"""
+        return self.nearest(lat, lng, k=len(self.positions), radius_km=radius_km)
+
+    @staticmethod
+    def _ring_cells(center_x: int, center_y: int, ring: int):
+        if ring == 0:
+            yield (center_x, center_y)
+            return
+        for dx in range(-ring, ring + 1):
+            yield (center_x + dx, center_y - ring)
+            yield (center_x + dx, center_y + ring)
+        for dy in range(-ring + 1, ring):
+            yield (center_x - ring, center_y + dy)
+            yield (center_x + ring, center_y + dy)
+
+
+class GeoIndex:
+    """
+    k-nearest lookups over driver positions and pending trip pickups.
+
+    driver_profiles.location and trips.pickup_point hold GeoJSON points and
+    are covered by 2dsphere indexes, so $geoNear walks drivers outward from
+    the pickup instead of scanning every online profile.
+    """
+
+    def __init__(self, db):
+        self.db = db
+
+    async def nearest_online_drivers(
+        self,
+        lat: float,
+        lng: float,
+        radius_km: float = DEFAULT_SEARCH_RADIUS_KM,
+        limit: int = DEFAULT_CANDIDATE_LIMIT,
+        query: Optional[Dict[str, Any]] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Return up to `limit` online driver profiles within `radius_km`,
+        nearest first. Each profile gets a `distance_km` field.
+        """
+        fresh_since = datetime.utcnow() - timedelta(minutes=DRIVER_LOCATION_MAX_AGE_MINUTES)
+        match = {
+            "is_online": True,
+            "location_updated_at": {"$gte": fresh_since},
+            **(query or {})
+        }
+        return await self._geo_near(
+            self.db.driver_profiles, "location", lat, lng, radius_km, limit, match
+        )
+
+    async def nearest_pending_trips(
+        self,
+        lat: float,
+        lng: float,
+        radius_km: float = DEFAULT_SEARCH_RADIUS_KM,
+        limit: int = 10,
+        query: Optional[Dict[str, Any]] = None
+    ) -> List[Dict[str, Any]]:
+        """Return pending trips whose pickup is within `radius_km`, nearest first"""
+        match = {"status": "pending", **(query or {})}
+        return await self._geo_near(
+            self.db.trips, "pickup_point", lat, lng, radius_km, limit, match
+        )
+
+    async def _geo_near(
+        self,
+        collection,
+        key: str,
+        lat: float,
+        lng: float,
+        radius_km: float,
+        limit: int,
+        match: Dict[str, Any]
+    ) -> List[Dict[str, Any]]:
+        pipeline = [
+            {
+                "$geoNear": {
+                    "near": to_geojson_point(lat, lng),
+                    "key": key,
+                    "distanceField": "distance_m",
+                    "maxDistance": radius_km * 1000,
+                    "spherical": True,
+                    "query": match
+                }
+            },
+            {"$limit": limit}
+        ]
+        results = await collection.aggregate(pipeline).to_list(limit)
+        for doc in results:
+            doc["distance_km"] = doc.pop("distance_m") / 1000
+        return results
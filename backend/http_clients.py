@@ -0,0 +1,135 @@
+"""
+NexRyde Outbound HTTP
+App-lifetime pooled httpx clients per upstream, with per-upstream latency histograms
+"""
+
+from typing import Any, Dict, List, Optional
+import logging
+import time
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# Per-upstream pool limits and timeouts
+UPSTREAMS: Dict[str, Dict[str, Any]] = {
+    "google_routes": {"timeout": 10.0, "connect_timeout": 3.0, "max_connections": 50, "max_keepalive": 20},
+    "google_maps": {"timeout": 10.0, "connect_timeout": 3.0, "max_connections": 20, "max_keepalive": 10},
+    "termii": {"timeout": 30.0, "connect_timeout": 5.0, "max_connections": 20, "max_keepalive": 10},
+    "emergent_auth": {"timeout": 30.0, "connect_timeout": 5.0, "max_connections": 10, "max_keepalive": 5},
+}
+
+# Idle keep-alive connections are recycled after this long
+KEEPALIVE_EXPIRY_SECONDS = 60.0
+
+# Histogram bucket upper bounds in milliseconds
+LATENCY_BUCKETS_MS = [10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+
+
+class LatencyHistogram:
+    """Fixed-bucket latency histogram (cumulative counts are derived on read)"""
+
+    def __init__(self, buckets_ms: List[float] = LATENCY_BUCKETS_MS):
+        self.buckets_ms = buckets_ms
+        self.counts = [0] * (len(buckets_ms) + 1)  # last slot is +Inf
+        self.count = 0
+        self.errors = 0
+        self.total_ms = 0.0
+
+    def observe(self, elapsed_ms: float, error: bool = False):
+        self.count += 1
+        self.total_ms += elapsed_ms
+        if error:
+            self.errors += 1
+        for index, bound in enumerate(self.buckets_ms):
+            if elapsed_ms <= bound:
+                self.counts[index] += 1
+                return
+        self.counts[-1] += 1
+
+    def percentile(self, q: float) -> Optional[float]:
+        """Upper bound of the bucket containing the q-th percentile"""
+        if not self.count:
+            return None
+        target = q * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= target:
+                return self.buckets_ms[index] if index < len(self.buckets_ms) else float(self.buckets_ms[-1])
+        return float(self.buckets_ms[-1])
+
+    def snapshot(self) -> Dict[str, Any]:
+        labels = [f"le_{bound}ms" for bound in self.buckets_ms] + ["le_inf"]
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "avg_ms": round(self.total_ms / self.count, 2) if self.count else None,
+            "p50_ms": self.percentile(0.50),
+            "p95_ms": self.percentile(0.95),
+            "p99_ms": self.percentile(0.99),
+            "buckets": dict(zip(labels, self.counts))
+        }
+
+
+class UpstreamClients:
+    """
+    One pooled httpx.AsyncClient per upstream, opened at startup and closed
+    on shutdown, so requests reuse warm TCP/TLS connections instead of
+    paying a fresh handshake per call.
+    """
+
+    def __init__(self, upstreams: Dict[str, Dict[str, Any]] = UPSTREAMS):
+        self.upstreams = upstreams
+        self.clients: Dict[str, httpx.AsyncClient] = {}
+        self.histograms = {name: LatencyHistogram() for name in upstreams}
+
+    def _build_client(self, name: str) -> httpx.AsyncClient:
+        config = self.upstreams[name]
+        return httpx.AsyncClient(
+            timeout=httpx.Timeout(config["timeout"], connect=config["connect_timeout"]),
+            limits=httpx.Limits(
+                max_connections=config["max_connections"],
+                max_keepalive_connections=config["max_keepalive"],
+                keepalive_expiry=KEEPALIVE_EXPIRY_SECONDS
+            )
+        )
+
+    async def start(self):
+        for name in self.upstreams:
+            if name not in self.clients:
+                self.clients[name] = self._build_client(name)
+        logger.info(f"Upstream HTTP clients opened: {', '.join(self.clients)}")
+
+    async def close(self):
+        for name, http_client in list(self.clients.items()):
+            try:
+                await http_client.aclose()
+            except Exception as e:
+                logger.error(f"Error closing {name} client: {e}")
+        self.clients.clear()
+
+    def client(self, name: str) -> httpx.AsyncClient:
+        """Pooled client for an upstream (created lazily if startup has not run)"""
+        if name not in self.clients:
+            self.clients[name] = self._build_client(name)
+        return self.clients[name]
+
+    async def request(self, name: str, method: str, url: str, **kwargs) -> httpx.Response:
+        started = time.perf_counter()
+        try:
+            response = await self.client(name).request(method, url, **kwargs)
+        except Exception:
+            self.histograms[name].observe((time.perf_counter() - started) * 1000, error=True)
+            raise
+        self.histograms[name].observe((time.perf_counter() - started) * 1000, error=response.status_code >= 500)
+        return response
+
+    async def get(self, name: str, url: str, **kwargs) -> httpx.Response:
+        return await self.request(name, "GET", url, **kwargs)
+
+    async def post(self, name: str, url: str, **kwargs) -> httpx.Response:
+        return await self.request(name, "POST", url, **kwargs)
+
+    def stats(self) -> Dict[str, Any]:
+        return {name: histogram.snapshot() for name, histogram in self.histograms.items()}
@@ -0,0 +1,242 @@
+"""
+NexRyde Leaderboards
+Per-driver daily rollups, and ranked driver leaderboards rebuilt from them on a schedule
+"""
+
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+import asyncio
+import logging
+
+from pymongo import UpdateOne
+
+from query_utils import batch_lookup
+
+logger = logging.getLogger(__name__)
+
+# How often the cached leaderboards are rebuilt from the rollups
+LEADERBOARD_REFRESH_SECONDS = 300
+# Rows kept per cached leaderboard
+LEADERBOARD_SIZE = 100
+# Trips created before cities were recorded count towards this city
+DEFAULT_CITY = "lagos"
+# Board key covering every city
+ALL_CITIES = "all"
+# Days of rollups each period reads (UTC days, today included)
+PERIOD_DAYS = {"daily": 1, "weekly": 7, "monthly": 30}
+# Rollups older than the longest period plus this are never read again
+ROLLUP_RETENTION_DAYS = 60
+
+
+def day_start(at: Optional[datetime] = None) -> datetime:
+    return (at or datetime.utcnow()).replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def rollup_id(driver_id: str, city: str, day: datetime) -> str:
+    return f"{driver_id}:{city}:{day.strftime('%Y-%m-%d')}"
+
+
+def display_name(name: Optional[str]) -> str:
+    return name[:10] + "..." if name else "Anonymous"
+
+
+class DriverLeaderboards:
+    """
+    Driver rankings served from memory.
+
+    complete_trip and rate_trip fold each trip into `driver_daily_stats`,
+    one document per (driver, city, UTC day) holding earnings, trips and
+    a rating sum/count, with single $inc upserts. Every
+    LEADERBOARD_REFRESH_SECONDS the rollups of the last 30 days are
+    grouped per period and city, ranked, and swapped into `boards`, so a
+    leaderboard request is a dict lookup and a slice. Names and comfort
+    scores are fetched with one $in query per rebuild.
+    """
+
+    def __init__(self, db, refresh_interval: float = LEADERBOARD_REFRESH_SECONDS):
+        self.db = db
+        self.refresh_interval = refresh_interval
+        # (period, city) -> rows sorted by earnings, best first
+        self.boards: Dict[Tuple[str, str], List[Dict[str, Any]]] = {}
+        self.top_rated: List[Dict[str, Any]] = []
+        self.built_at: Optional[datetime] = None
+        self._build_lock = asyncio.Lock()
+        self.counters = {"rollup_updates": 0, "rollup_errors": 0, "builds": 0, "backfills": 0}
+
+    async def _inc(self, trip: Dict[str, Any], fields: Dict[str, float]):
+        driver_id = trip.get("driver_id")
+        completed_at = trip.get("completed_at")
+        if not driver_id or not completed_at:
+            return
+        day = day_start(completed_at)
+        city = (trip.get("city") or DEFAULT_CITY).lower()
+        try:
+            await self.db.driver_daily_stats.update_one(
+                {"_id": rollup_id(driver_id, city, day)},
+                {
+                    "$inc": fields,
+                    "$setOnInsert": {"driver_id": driver_id, "city": city, "day": day}
+                },
+                upsert=True
+            )
+            self.counters["rollup_updates"] += 1
+        except Exception as e:
+            self.counters["rollup_errors"] += 1
+            logger.error(f"Driver rollup update failed (trip {trip.get('id')}): {e}")
+
+    async def record_trip_completed(self, trip: Dict[str, Any]):
+        """Count a completed trip towards its driver's day"""
+        await self._inc(trip, {"trips": 1, "earnings": trip.get("fare") or 0})
+
+    async def record_rating(self, trip: Dict[str, Any], rating: float):
+        """
+        Count a rider's rating of the driver towards the day the trip was
+        completed. `trip` is the document before the rating was saved, so
+        a re-rating replaces the old value instead of adding a second one.
+        """
+        previous = trip.get("driver_rating")
+        if previous is None:
+            await self._inc(trip, {"rating_sum": rating, "rating_count": 1})
+        else:
+            await self._inc(trip, {"rating_sum": rating - previous})
+
+    async def backfill(self, days: int = max(PERIOD_DAYS.values())) -> int:
+        """Rebuild the rollups of the last `days` days from completed trips"""
+        since = day_start() - timedelta(days=days - 1)
+        groups = self.db.trips.aggregate([
+            {"$match": {"status": "completed", "completed_at": {"$gte": since}, "driver_id": {"$ne": None}}},
+            {"$group": {
+                "_id": {
+                    "driver_id": "$driver_id",
+                    "city": {"$toLower": {"$ifNull": ["$city", DEFAULT_CITY]}},
+                    "day": {"$dateToString": {"format": "%Y-%m-%d", "date": "$completed_at"}}
+                },
+                "trips": {"$sum": 1},
+                "earnings": {"$sum": {"$ifNull": ["$fare", 0]}},
+                "rating_sum": {"$sum": {"$ifNull": ["$driver_rating", 0]}},
+                "rating_count": {"$sum": {"$cond": [{"$gt": ["$driver_rating", None]}, 1, 0]}}
+            }}
+        ])
+        operations = []
+        async for group in groups:
+            key = group.pop("_id")
+            day = datetime.strptime(key["day"], "%Y-%m-%d")
+            operations.append(UpdateOne(
+                {"_id": rollup_id(key["driver_id"], key["city"], day)},
+                {"$set": {"driver_id": key["driver_id"], "city": key["city"], "day": day, **group}},
+                upsert=True
+            ))
+        if operations:
+            await self.db.driver_daily_stats.bulk_write(operations, ordered=False)
+        self.counters["backfills"] += 1
+        return len(operations)
+
+    async def build(self):
+        """Recompute every board from the rollups and swap the cache in"""
+        async with self._build_lock:
+            await self._build()
+
+    async def _build(self):
+        if await self.db.driver_daily_stats.find_one({}, {"_id": 1}) is None:
+            await self.backfill()
+
+        today = day_start()
+        oldest = today - timedelta(days=max(PERIOD_DAYS.values()) - 1)
+        # (period, city) -> driver_id -> totals
+        totals: Dict[Tuple[str, str], Dict[str, Dict[str, float]]] = {}
+        async for rollup in self.db.driver_daily_stats.find({"day": {"$gte": oldest}}, {"_id": 0}):
+            age_days = (today - rollup["day"]).days
+            for period, days in PERIOD_DAYS.items():
+                if age_days >= days:
+                    continue
+                for city in (rollup["city"], ALL_CITIES):
+                    row = totals.setdefault((period, city), {}).setdefault(
+                        rollup["driver_id"], {"earnings": 0, "trips": 0, "rating_sum": 0, "rating_count": 0}
+                    )
+                    for field in row:
+                        row[field] += rollup.get(field, 0)
+
+        boards: Dict[Tuple[str, str], List[Dict[str, Any]]] = {}
+        for key, drivers in totals.items():
+            ranked = sorted(drivers.items(), key=lambda item: (-item[1]["earnings"], -item[1]["trips"], item[0]))
+            boards[key] = [
+                {
+                    "driver_id": driver_id,
+                    "earnings": row["earnings"],
+                    "trips": row["trips"],
+                    "rating": round(row["rating_sum"] / row["rating_count"], 1) if row["rating_count"] else 5.0
+                }
+                for driver_id, row in ranked[:LEADERBOARD_SIZE]
+            ]
+
+        top_rated = await self.db.users.find(
+            {"role": "driver", "rating": {"$exists": True}},
+            {"_id": 0, "id": 1, "name": 1, "rating": 1, "total_trips": 1}
+        ).sort([("rating", -1), ("total_trips", -1)]).to_list(LEADERBOARD_SIZE)
+
+        driver_ids = {row["driver_id"] for rows in boards.values() for row in rows}
+        users = await batch_lookup(self.db.users, driver_ids, projection={"_id": 0, "name": 1})
+        for rows in boards.values():
+            for rank, row in enumerate(rows, 1):
+                row["rank"] = rank
+                row["name"] = display_name((users.get(row["driver_id"]) or {}).get("name"))
+
+        profiles = await batch_lookup(
+            self.db.driver_profiles, [driver["id"] for driver in top_rated], key="user_id",
+            projection={"_id": 0, "smoothness_rating": 1, "politeness_rating": 1,
+                        "cleanliness_rating": 1, "safety_rating": 1}
+        )
+        self.top_rated = [
+            {
+                "rank": rank,
+                "driver_id": driver["id"],
+                "name": display_name(driver.get("name")),
+                "rating": driver.get("rating", 5.0),
+                "total_trips": driver.get("total_trips", 0),
+                "comfort_scores": {
+                    score: (profiles.get(driver["id"]) or {}).get(f"{score}_rating", 5.0)
+                    for score in ("smoothness", "politeness", "cleanliness", "safety")
+                }
+            }
+            for rank, driver in enumerate(top_rated, 1)
+        ]
+        self.boards = boards
+        self.built_at = datetime.utcnow()
+        self.counters["builds"] += 1
+
+    async def _ensure_built(self):
+        async with self._build_lock:
+            if self.built_at is None:
+                await self._build()
+
+    async def leaderboard(self, period: str, city: str, limit: int) -> List[Dict[str, Any]]:
+        """Top `limit` drivers by earnings for a period and city (or "all")"""
+        await self._ensure_built()
+        return self.boards.get((period, city.lower()), [])[:limit]
+
+    async def top_rated_drivers(self, limit: int) -> List[Dict[str, Any]]:
+        await self._ensure_built()
+        return self.top_rated[:limit]
+
+    async def prune(self) -> int:
+        """Delete rollups no period reads any more"""
+        cutoff = day_start() - timedelta(days=ROLLUP_RETENTION_DAYS)
+        result = await self.db.driver_daily_stats.delete_many({"day": {"$lt": cutoff}})
+        return result.deleted_count
+
+    async def run_forever(self):
+        while True:
+            try:
+                await self.build()
+                await self.prune()
+            except Exception as e:
+                logger.error(f"Leaderboard build failed: {e}")
+            await asyncio.sleep(self.refresh_interval)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self.counters,
+            "boards": len(self.boards),
+            "built_at": self.built_at,
+            "refresh_interval_seconds": self.refresh_interval
+        }
@@ -0,0 +1,162 @@
+"""
+NexRyde Location Ingestion
+Write-behind buffer for driver GPS pings: acknowledge immediately, flush coalesced positions in bulk
+"""
+
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Tuple
+from pymongo import UpdateOne
+import asyncio
+import logging
+
+from geo_service import to_geojson_point
+
+logger = logging.getLogger(__name__)
+
+# Realtime bus channel carrying each flushed batch of positions to every worker
+DRIVER_POSITIONS_CHANNEL = "driver_positions"
+
+
+class LocationIngestConfig:
+    """Buffer sizing and flush cadence"""
+
+    # Flush the latest-position table this often
+    FLUSH_INTERVAL_SECONDS = 1.0
+    # Max operations per bulk_write call
+    FLUSH_BATCH_SIZE = 1000
+    # Max distinct drivers waiting to be flushed; new drivers are dropped beyond this
+    MAX_PENDING_DRIVERS = 50000
+
+
+class LocationIngestBuffer:
+    """
+    Latest-position table in front of driver_profiles.
+
+    Each ping overwrites the driver's pending entry, so however many pings
+    arrive between flushes only the newest point per driver is written.
+    The table is bounded: if MongoDB falls behind and the table fills up,
+    pings from drivers not already pending are dropped (and counted) while
+    drivers already in the table keep coalescing in place.
+
+    With a realtime bus, every flushed chunk is also published once on
+    DRIVER_POSITIONS_CHANNEL as [driver_id, lat, lng, recorded_at] rows,
+    so each worker's in-memory grid sees pings that landed elsewhere.
+    """
+
+    def __init__(
+        self,
+        db,
+        flush_interval: float = LocationIngestConfig.FLUSH_INTERVAL_SECONDS,
+        batch_size: int = LocationIngestConfig.FLUSH_BATCH_SIZE,
+        max_pending: int = LocationIngestConfig.MAX_PENDING_DRIVERS,
+        bus=None
+    ):
+        self.db = db
+        self.bus = bus
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        # driver_id -> (lat, lng, recorded_at)
+        self.pending: Dict[str, Tuple[float, float, datetime]] = {}
+        self._flush_lock = asyncio.Lock()
+        self.counters = {
+            "received": 0,
+            "coalesced": 0,
+            "flushed": 0,
+            "dropped": 0,
+            "flushes": 0,
+            "flush_errors": 0,
+            "publish_errors": 0
+        }
+
+    def submit(self, driver_id: str, lat: float, lng: float, recorded_at: Optional[datetime] = None) -> bool:
+        """Queue a ping; returns False if it was dropped"""
+        recorded_at = recorded_at or datetime.utcnow()
+        self.counters["received"] += 1
+
+        existing = self.pending.get(driver_id)
+        if existing:
+            self.counters["coalesced"] += 1
+            if recorded_at >= existing[2]:
+                self.pending[driver_id] = (lat, lng, recorded_at)
+            return True
+
+        if len(self.pending) >= self.max_pending:
+            self.counters["dropped"] += 1
+            return False
+
+        self.pending[driver_id] = (lat, lng, recorded_at)
+        return True
+
+    async def flush(self) -> int:
+        """Write all pending positions with bulk_write; returns how many were flushed"""
+        async with self._flush_lock:
+            if not self.pending:
+                return 0
+
+            batch, self.pending = self.pending, {}
+            items = list(batch.items())
+            flushed = 0
+            for start in range(0, len(items), self.batch_size):
+                chunk = items[start:start + self.batch_size]
+                operations = [
+                    UpdateOne(
+                        {"user_id": driver_id},
+                        {"$set": {
+                            "current_location": {"lat": lat, "lng": lng, "updated_at": recorded_at.isoformat()},
+                            "location": to_geojson_point(lat, lng),
+                            "location_updated_at": recorded_at
+                        }}
+                    )
+                    for driver_id, (lat, lng, recorded_at) in chunk
+                ]
+                try:
+                    await self.db.driver_profiles.bulk_write(operations, ordered=False)
+                    flushed += len(chunk)
+                except Exception as e:
+                    self.counters["flush_errors"] += 1
+                    logger.error(f"Location flush failed ({len(chunk)} drivers): {e}")
+                    self._requeue(chunk)
+                    continue
+                await self._publish(chunk)
+
+            self.counters["flushes"] += 1
+            self.counters["flushed"] += flushed
+            return flushed
+
+    async def _publish(self, chunk: List[Tuple[str, Tuple[float, float, datetime]]]):
+        if self.bus is None:
+            return
+        try:
+            await self.bus.publish(DRIVER_POSITIONS_CHANNEL, {
+                "positions": [[driver_id, lat, lng, recorded_at] for driver_id, (lat, lng, recorded_at) in chunk]
+            })
+        except Exception as e:
+            self.counters["publish_errors"] += 1
+            logger.error(f"Location publish failed ({len(chunk)} drivers): {e}")
+
+    def _requeue(self, chunk):
+        """Put failed entries back unless a newer ping has arrived meanwhile"""
+        for driver_id, position in chunk:
+            if driver_id not in self.pending and len(self.pending) < self.max_pending:
+                self.pending[driver_id] = position
+
+    async def run_forever(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Location ingest loop error: {e}")
+
+    async def close(self):
+        """Flush whatever is left (called on shutdown)"""
+        await self.flush()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self.counters,
+            "pending": len(self.pending),
+            "max_pending": self.max_pending,
+            "flush_interval_seconds": self.flush_interval
+        }
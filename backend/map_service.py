@@ -9,6 +9,8 @@ from pydantic import BaseModel
 from enum import Enum
 import asyncio
 
+from route_cache import route_cache
+
 class MapRequestType(str, Enum):
     DISTANCE_CALCULATION = "distance_calculation"
     ROUTE_PLANNING = "route_planning"
@@ -198,7 +200,8 @@ class DistanceCache:
     """Caches distance calculations to avoid redundant API calls"""
     
     def __init__(self):
-        self.cache = {}  # In production, use Redis
+        # Shared bounded LRU+TTL cache (also serves server.get_directions_from_google)
+        self.cache = route_cache
     
     def get_cached_distance(
         self,
@@ -213,17 +216,7 @@ class DistanceCache:
             pickup_lat, pickup_lng, dropoff_lat, dropoff_lng
         )
         
-        if cache_key in self.cache:
-            cached_data = self.cache[cache_key]
-            
-            # Check if cache is still valid
-            cache_age = (datetime.utcnow() - cached_data["timestamp"]).total_seconds()
-            max_age = MapUsageConfig.DISTANCE_CACHE_DURATION_HOURS * 3600
-            
-            if cache_age < max_age:
-                return cached_data["data"]
-        
-        return None
+        return self.cache.get(cache_key)
     
     def cache_distance(
         self,
@@ -241,14 +234,15 @@ class DistanceCache:
             pickup_lat, pickup_lng, dropoff_lat, dropoff_lng
         )
         
-        self.cache[cache_key] = {
-            "timestamp": datetime.utcnow(),
-            "data": {
+        self.cache.set(
+            cache_key,
+            {
                 "distance_km": distance_km,
                 "duration_minutes": duration_minutes,
                 "fare_estimate": fare_estimate
-            }
-        }
+            },
+            ttl_seconds=MapUsageConfig.DISTANCE_CACHE_DURATION_HOURS * 3600
+        )
     
     def _generate_cache_key(
         self,
@@ -258,7 +252,7 @@ class DistanceCache:
         dropoff_lng: float
     ) -> str:
         """Generate cache key from coordinates (rounded to 3 decimals)"""
-        return f"{round(pickup_lat, 3)}_{round(pickup_lng, 3)}_" \
+        return f"distance:{round(pickup_lat, 3)}_{round(pickup_lng, 3)}_" \
                f"{round(dropoff_lat, 3)}_{round(dropoff_lng, 3)}"
 
 class MapService:
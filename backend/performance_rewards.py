@@ -14,8 +14,15 @@ logger = logging.getLogger(__name__)
 class PerformanceRewardsManager:
     """Manages driver performance rewards"""
     
-    def __init__(self, db):
+    def __init__(self, db, unread_counters=None):
         self.db = db
+        # Optional UnreadCounters, kept in step with notifications inserted here
+        self.unread_counters = unread_counters
+    
+    async def _insert_notification(self, notification: Dict[str, Any]):
+        await self.db.notifications.insert_one(notification)
+        if self.unread_counters:
+            self.unread_counters.incr_notifications(notification["user_id"])
     
     async def get_top_drivers_monthly(self, limit: int = 10) -> List[Dict[str, Any]]:
         """
@@ -175,7 +182,7 @@ class PerformanceRewardsManager:
         message = messages.get(reason, "🎉 Congratulations! You've earned 1 FREE MONTH of subscription!")
         
         # Store in-app notification
-        await self.db.notifications.insert_one({
+        await self._insert_notification({
             "user_id": driver_id,
             "type": "reward",
             "title": "Free Month Reward!",
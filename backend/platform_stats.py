@@ -0,0 +1,181 @@
+"""
+NexRyde Platform Stats
+Materialized dashboard counters, maintained with $inc on write paths and reconciled periodically
+"""
+
+from datetime import datetime
+from typing import Any, Dict, Optional
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Full recount that corrects drift (missed increments, writes outside the API)
+RECONCILE_INTERVAL_SECONDS = 3600
+
+TOTALS_ID = "totals"
+TOTAL_FIELDS = (
+    "total_riders", "total_drivers", "total_trips", "completed_trips", "total_revenue", "active_subscriptions"
+)
+
+
+def day_id(at: Optional[datetime] = None) -> str:
+    """_id of a day's stats document (UTC)"""
+    return f"day:{(at or datetime.utcnow()).strftime('%Y-%m-%d')}"
+
+
+def role_field(role: str) -> Optional[str]:
+    return {"rider": "total_riders", "driver": "total_drivers"}.get(role)
+
+
+class PlatformStats:
+    """
+    Dashboard counters in `platform_stats`: one {_id: "totals"} document
+    and one {_id: "day:YYYY-MM-DD"} document per day (trips, signups).
+
+    Trip, user and subscription write paths call the record_* methods,
+    which are single atomic $inc upserts, so the admin overview is two
+    reads by _id instead of counts and a $group over every trip. A
+    counter failure is logged and left to the reconciliation job rather
+    than failing the request that caused it.
+    """
+
+    def __init__(self, db, reconcile_interval: float = RECONCILE_INTERVAL_SECONDS):
+        self.db = db
+        self.reconcile_interval = reconcile_interval
+        self.counters = {
+            "increments": 0, "increment_errors": 0, "reconciliations": 0, "last_drift": {}, "last_unsettled": []
+        }
+
+    async def _inc(self, doc_id: str, fields: Dict[str, float]):
+        fields = {k: v for k, v in fields.items() if v}
+        if not fields:
+            return
+        try:
+            await self.db.platform_stats.update_one(
+                {"_id": doc_id},
+                {"$inc": fields, "$set": {"updated_at": datetime.utcnow()}},
+                upsert=True
+            )
+            self.counters["increments"] += 1
+        except Exception as e:
+            self.counters["increment_errors"] += 1
+            logger.error(f"Platform stats increment failed ({doc_id} {fields}): {e}")
+
+    async def record_signup(self, role: str):
+        field = role_field(role)
+        if field:
+            await self._inc(TOTALS_ID, {field: 1})
+        await self._inc(day_id(), {"signups": 1})
+
+    async def record_role_change(self, old_role: str, new_role: str):
+        if old_role == new_role:
+            return
+        changes: Dict[str, float] = {}
+        for role, delta in ((old_role, -1), (new_role, 1)):
+            field = role_field(role)
+            if field:
+                changes[field] = changes.get(field, 0) + delta
+        await self._inc(TOTALS_ID, changes)
+
+    async def record_trip_created(self):
+        await self._inc(TOTALS_ID, {"total_trips": 1})
+        await self._inc(day_id(), {"trips": 1})
+
+    async def record_trip_completed(self, fare: Optional[float]):
+        await self._inc(TOTALS_ID, {"completed_trips": 1, "total_revenue": fare or 0})
+
+    async def record_subscription_status(self, old_status: Optional[str], new_status: Optional[str]):
+        """Call with a subscription's status before and after a write"""
+        delta = int(new_status == "active") - int(old_status == "active")
+        await self._inc(TOTALS_ID, {"active_subscriptions": delta})
+
+    async def overview(self) -> Dict[str, Any]:
+        """Totals plus today's numbers; seeds itself with a reconcile on first use"""
+        docs = await self._read_current()
+        if TOTALS_ID not in docs:
+            await self.reconcile()
+            docs = await self._read_current()
+        totals = docs.get(TOTALS_ID, {})
+        today = docs.get(day_id(), {})
+        return {
+            **{field: totals.get(field, 0) for field in TOTAL_FIELDS},
+            "today_trips": today.get("trips", 0),
+            "today_signups": today.get("signups", 0),
+            "reconciled_at": totals.get("reconciled_at")
+        }
+
+    async def _read_current(self, at: Optional[datetime] = None) -> Dict[str, Dict[str, Any]]:
+        return {
+            doc["_id"]: doc
+            async for doc in self.db.platform_stats.find({"_id": {"$in": [TOTALS_ID, day_id(at)]}})
+        }
+
+    async def reconcile(self) -> Dict[str, Any]:
+        """
+        Recount everything from the source collections and correct the
+        counters by the difference, returning the drift corrected.
+
+        The correction is an $inc of (recount - counter as read before the
+        recount), so increments landing meanwhile are kept, not
+        overwritten. A counter that moved while the recount ran is left
+        alone until the next run, since its recount may or may not include
+        those writes. What remains is a write whose source document was
+        counted but whose $inc lands after the second read; that is at most
+        the writes in flight at that instant, and the next run corrects it.
+        """
+        today_start = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+        before = await self._read_current(today_start)
+        revenue = await self.db.trips.aggregate([
+            {"$match": {"status": "completed"}},
+            {"$group": {"_id": None, "total": {"$sum": "$fare"}}}
+        ]).to_list(1)
+        actual = {
+            "total_riders": await self.db.users.count_documents({"role": "rider"}),
+            "total_drivers": await self.db.users.count_documents({"role": "driver"}),
+            "total_trips": await self.db.trips.count_documents({}),
+            "completed_trips": await self.db.trips.count_documents({"status": "completed"}),
+            "total_revenue": revenue[0]["total"] if revenue else 0,
+            "active_subscriptions": await self.db.subscriptions.count_documents({"status": "active"})
+        }
+        today = {
+            "trips": await self.db.trips.count_documents({"created_at": {"$gte": today_start}}),
+            "signups": await self.db.users.count_documents({"created_at": {"$gte": today_start}})
+        }
+        after = await self._read_current(today_start)
+
+        now = datetime.utcnow()
+        corrections: Dict[str, Dict[str, float]] = {}
+        unsettled = []
+        for doc_id, recount in ((TOTALS_ID, actual), (day_id(today_start), today)):
+            stored_before = before.get(doc_id, {})
+            stored_after = after.get(doc_id, {})
+            corrections[doc_id] = {}
+            for field, value in recount.items():
+                if stored_before.get(field, 0) != stored_after.get(field, 0):
+                    unsettled.append(field)
+                elif value != stored_before.get(field, 0):
+                    corrections[doc_id][field] = value - stored_before.get(field, 0)
+            update: Dict[str, Any] = {"$set": {"reconciled_at": now, "updated_at": now}}
+            if corrections[doc_id]:
+                update["$inc"] = corrections[doc_id]
+            await self.db.platform_stats.update_one({"_id": doc_id}, update, upsert=True)
+
+        drift = corrections[TOTALS_ID]
+        self.counters["reconciliations"] += 1
+        self.counters["last_drift"] = drift
+        self.counters["last_unsettled"] = unsettled
+        if drift and TOTALS_ID in before:
+            logger.warning(f"Platform stats drift corrected: {drift}")
+        return drift
+
+    async def run_forever(self):
+        while True:
+            await asyncio.sleep(self.reconcile_interval)
+            try:
+                await self.reconcile()
+            except Exception as e:
+                logger.error(f"Platform stats reconciliation failed: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self.counters, "reconcile_interval_seconds": self.reconcile_interval}
@@ -0,0 +1,175 @@
+"""
+NexRyde Query Utilities
+Opaque keyset cursors for paginated MongoDB reads and batched lookups for list enrichment
+"""
+
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import base64
+import json
+
+
+def mongo_utcnow() -> datetime:
+    """utcnow truncated to MongoDB's millisecond precision, so in-memory and
+    stored copies of a document compare the same under a cursor"""
+    now = datetime.utcnow()
+    return now.replace(microsecond=now.microsecond // 1000 * 1000)
+
+
+def encode_cursor(sort_value: Optional[datetime], doc_id: str) -> str:
+    """Opaque token for the position just after (sort_value, doc_id); a None
+    sort_value stands for documents missing the sort field"""
+    raw = json.dumps(
+        {"t": sort_value.isoformat() if sort_value else None, "i": doc_id}, separators=(",", ":")
+    )
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(token: str) -> Tuple[Optional[datetime], str]:
+    """Inverse of encode_cursor; raises ValueError on a malformed token"""
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+        sort_value = datetime.fromisoformat(data["t"]) if data["t"] is not None else None
+        return sort_value, str(data["i"])
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {e}")
+
+
+def cursor_for(doc: Dict[str, Any], field: str = "created_at", id_field: str = "id") -> Optional[str]:
+    """
+    Cursor pointing just after `doc`. A document without the sort field
+    (legacy data) gets an id-only cursor; None if it has no id or the sort
+    field is not a datetime.
+    """
+    value = doc.get(field)
+    if doc.get(id_field) is None or not (value is None or isinstance(value, datetime)):
+        return None
+    return encode_cursor(value, doc[id_field])
+
+
+def encode_seq_cursor(seq: int) -> str:
+    """Opaque token for the position just after sequence number `seq`"""
+    raw = json.dumps({"s": seq}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_seq_cursor(token: str) -> int:
+    """Inverse of encode_seq_cursor; raises ValueError on any other token"""
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        return int(json.loads(base64.urlsafe_b64decode(padded.encode()).decode())["s"])
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {e}")
+
+
+def keyset_filter(
+    cursor: Tuple[datetime, str],
+    field: str = "created_at",
+    id_field: str = "id",
+    descending: bool = False
+) -> Dict[str, Any]:
+    """
+    Filter for documents strictly after `cursor` in (field, id_field) order.
+    Pair it with sort([(field, d), (id_field, d)]) and an index on those keys,
+    so each page starts with an index seek instead of skipping documents.
+    Documents missing `field` sort before every value, as MongoDB sorts them.
+    """
+    sort_value, doc_id = cursor
+    op = "$lt" if descending else "$gt"
+    if sort_value is None:
+        same = {field: None, id_field: {op: doc_id}}
+        return same if descending else {"$or": [{field: {"$ne": None}}, same]}
+    clauses = [
+        {field: {op: sort_value}},
+        {field: sort_value, id_field: {op: doc_id}}
+    ]
+    if descending:
+        clauses.append({field: None})
+    return {"$or": clauses}
+
+
+async def keyset_page(
+    collection,
+    query: Dict[str, Any],
+    limit: int,
+    after: Optional[str] = None,
+    skip: int = 0,
+    field: str = "created_at",
+    id_field: str = "id",
+    projection: Optional[Dict[str, Any]] = None
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """
+    One page, newest first, in (field, id_field) order. With an `after`
+    cursor the page starts at an index seek however deep it is; without
+    one, `skip` is still honoured for older clients. Returns (docs,
+    next_cursor), next_cursor being None on the last page. Documents
+    missing `field` come last and are paged by id. Raises ValueError on a
+    malformed cursor, TypeError if `field` holds something other than a
+    datetime. A narrowing projection always keeps `field` and `id_field`,
+    since the cursor is built from them.
+    """
+    if after:
+        seek = keyset_filter(decode_cursor(after), field, id_field, descending=True)
+        query = {"$and": [query, seek]} if query else seek
+    if projection and any(v for k, v in projection.items() if k != "_id"):
+        projection = {**projection, field: 1, id_field: 1}
+    cursor = collection.find(query, projection).sort([(field, -1), (id_field, -1)])
+    if skip and not after:
+        cursor = cursor.skip(skip)
+    docs = await cursor.limit(limit + 1).to_list(limit + 1)
+    has_more = len(docs) > limit
+    docs = docs[:limit]
+    next_cursor = cursor_for(docs[-1], field, id_field) if has_more and docs else None
+    if has_more and docs and next_cursor is None:
+        raise TypeError(f"Cannot build a cursor from {field!r}={docs[-1].get(field)!r}; it must be a datetime")
+    return docs, next_cursor
+
+
+def _unique_ids(ids: Iterable[Any]) -> List[Any]:
+    return list(dict.fromkeys(i for i in ids if i is not None))
+
+
+async def batch_lookup(
+    collection,
+    ids: Iterable[Any],
+    key: str = "id",
+    projection: Optional[Dict[str, Any]] = None,
+    query: Optional[Dict[str, Any]] = None,
+    sort: Optional[List[Tuple[str, int]]] = None
+) -> Dict[Any, Dict[str, Any]]:
+    """
+    Fetch the documents for many ids with one $in query, keyed by `key`.
+    With `sort`, the first document per key wins (e.g. a driver's latest
+    subscription). Use it to enrich a page of rows instead of one
+    find_one per row.
+    """
+    unique = _unique_ids(ids)
+    if not unique:
+        return {}
+    if projection and any(v for k, v in projection.items() if k != "_id"):
+        projection = {**projection, key: 1}
+    cursor = collection.find({**(query or {}), key: {"$in": unique}}, projection)
+    if sort:
+        cursor = cursor.sort(sort)
+    found: Dict[Any, Dict[str, Any]] = {}
+    async for doc in cursor:
+        found.setdefault(doc.get(key), doc)
+    return found
+
+
+async def batch_count(
+    collection,
+    field: str,
+    ids: Iterable[Any],
+    query: Optional[Dict[str, Any]] = None
+) -> Dict[Any, int]:
+    """Count documents per value of `field` for many ids with one $group"""
+    unique = _unique_ids(ids)
+    if not unique:
+        return {}
+    pipeline = [
+        {"$match": {**(query or {}), field: {"$in": unique}}},
+        {"$group": {"_id": f"${field}", "count": {"$sum": 1}}}
+    ]
+    return {row["_id"]: row["count"] async for row in collection.aggregate(pipeline)}
@@ -0,0 +1,429 @@
+"""
+NexRyde Realtime
+WebSocket chat and event gateway with per-connection bounded send queues, fed by a cross-worker pub/sub bus
+"""
+
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+import asyncio
+import logging
+import os
+import socket
+import uuid
+
+from fastapi import WebSocket
+
+logger = logging.getLogger(__name__)
+
+
+class RealtimeConfig:
+    """Outbound queue sizing and slow-client policy"""
+
+    # Messages buffered per socket before the client is considered too slow
+    SEND_QUEUE_SIZE = 64
+    # A single send taking longer than this marks the client as dead
+    SEND_TIMEOUT_SECONDS = 5.0
+    # Close code used when a slow client is dropped (1013 = try again later)
+    SLOW_CLIENT_CLOSE_CODE = 1013
+    # Change stream reconnect backoff
+    BUS_RETRY_SECONDS = 2.0
+
+
+BusHandler = Callable[[str, Dict[str, Any]], Awaitable[None]]
+
+
+class InMemoryBus:
+    """
+    Single-process pub/sub: publish hands the payload straight to the local
+    subscribers. Enough for one worker and for tests.
+    """
+
+    def __init__(self):
+        self.handlers: List[BusHandler] = []
+        self.counters = {"published": 0, "delivered_local": 0, "received_remote": 0, "errors": 0}
+
+    def subscribe(self, handler: BusHandler):
+        self.handlers.append(handler)
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def publish(self, channel: str, payload: Dict[str, Any]):
+        self.counters["published"] += 1
+        await self._dispatch(channel, payload)
+        self.counters["delivered_local"] += 1
+
+    async def _dispatch(self, channel: str, payload: Dict[str, Any]):
+        for handler in self.handlers:
+            try:
+                await handler(channel, payload)
+            except Exception as e:
+                self.counters["errors"] += 1
+                logger.error(f"Bus handler failed on {channel}: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": "memory", **self.counters}
+
+
+class MongoChangeStreamBus(InMemoryBus):
+    """
+    Cross-worker pub/sub over a MongoDB change stream.
+
+    publish delivers to this worker's sockets immediately and inserts the
+    event into `realtime_events`, tagged with this worker's id. Every
+    worker tails inserts on that collection and delivers events that
+    originated elsewhere, so both parties of a trip get each message
+    whichever worker or pod their sockets landed on. Change streams need a
+    replica set (or Atlas); events expire through a TTL index.
+    """
+
+    def __init__(self, db, worker_id: Optional[str] = None):
+        super().__init__()
+        self.db = db
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._tail_forever())
+            logger.info(f"Realtime bus tailing realtime_events as {self.worker_id}")
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    async def publish(self, channel: str, payload: Dict[str, Any]):
+        await super().publish(channel, payload)
+        try:
+            await self.db.realtime_events.insert_one({
+                "channel": channel,
+                "payload": payload,
+                "origin": self.worker_id,
+                "created_at": datetime.utcnow()
+            })
+        except Exception as e:
+            self.counters["errors"] += 1
+            logger.error(f"Realtime publish to {channel} failed: {e}")
+
+    async def _tail_forever(self):
+        pipeline = [{"$match": {"operationType": "insert", "fullDocument.origin": {"$ne": self.worker_id}}}]
+        resume_token = None
+        while True:
+            try:
+                async with self.db.realtime_events.watch(pipeline, resume_after=resume_token) as stream:
+                    async for change in stream:
+                        resume_token = stream.resume_token
+                        event = change["fullDocument"]
+                        self.counters["received_remote"] += 1
+                        await self._dispatch(event["channel"], event["payload"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.counters["errors"] += 1
+                logger.error(f"Realtime change stream error, retrying: {e}")
+                await asyncio.sleep(RealtimeConfig.BUS_RETRY_SECONDS)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": "mongo", "worker_id": self.worker_id, **self.counters}
+
+
+def chat_channel(trip_id: str) -> str:
+    return f"chat:{trip_id}"
+
+
+# Event gateway channel kinds: trip lifecycle/location, driver offers, shared-trip tracking
+EVENT_CHANNEL_KINDS = ("trip", "driver", "share")
+
+
+class Connection:
+    """
+    One accepted WebSocket with its own outbound queue.
+
+    A dedicated writer task drains the queue, so producers only ever do a
+    non-blocking put and one slow socket never holds up anyone else. The
+    sender identity is resolved once on connect and cached here, since it
+    cannot change for the lifetime of the socket.
+    """
+
+    def __init__(
+        self,
+        websocket: WebSocket,
+        trip_id: str,
+        user_id: str,
+        queue_size: int,
+        user_name: str = "User",
+        role: str = "rider",
+        other_party_id: Optional[str] = None
+    ):
+        self.websocket = websocket
+        self.trip_id = trip_id
+        self.user_id = user_id
+        self.user_name = user_name
+        self.role = role
+        self.other_party_id = other_party_id
+        # Event gateway subscriptions
+        self.channels: Set[str] = set()
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.writer: Optional[asyncio.Task] = None
+        self.closed = False
+        self.sent = 0
+
+    def enqueue(self, message: Dict[str, Any]) -> bool:
+        """Queue a message; False if the connection is closed or its queue is full"""
+        if self.closed:
+            return False
+        try:
+            self.queue.put_nowait(message)
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    async def write_forever(self, on_failure):
+        try:
+            while True:
+                message = await self.queue.get()
+                await asyncio.wait_for(
+                    self.websocket.send_json(message), timeout=RealtimeConfig.SEND_TIMEOUT_SECONDS
+                )
+                self.sent += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"WebSocket send failed: user={self.user_id}, trip={self.trip_id}: {e}")
+            await on_failure(self)
+
+
+class SocketRegistry:
+    """
+    Accepted sockets, their writer tasks and the slow-client policy shared
+    by the chat manager and the event gateway.
+    """
+
+    def __init__(self, bus: Optional[InMemoryBus] = None, queue_size: int = RealtimeConfig.SEND_QUEUE_SIZE):
+        self.bus = bus or InMemoryBus()
+        self.bus.subscribe(self._on_bus_message)
+        self.queue_size = queue_size
+        # socket -> connection, so fan-out never has to search for the user
+        self.connections: Dict[WebSocket, Connection] = {}
+        self.metrics = {
+            "connected": 0,
+            "disconnected": 0,
+            "messages_queued": 0,
+            "messages_dropped": 0,
+            "slow_clients_dropped": 0
+        }
+
+    async def start(self):
+        await self.bus.start()
+
+    async def close(self):
+        await self.bus.close()
+
+    async def _accept(self, websocket: WebSocket, trip_id: Optional[str], user_id: str, **identity) -> Connection:
+        await websocket.accept()
+        connection = Connection(websocket, trip_id, user_id, self.queue_size, **identity)
+        connection.writer = asyncio.create_task(connection.write_forever(self._drop_slow_client))
+        self.connections[websocket] = connection
+        self.metrics["connected"] += 1
+        return connection
+
+    def disconnect(self, websocket: WebSocket, trip_id: str = None, user_id: str = None):
+        connection = self.connections.pop(websocket, None)
+        if connection is None:
+            return
+        connection.closed = True
+        # The writer itself may be the caller (send failure); it exits on its own
+        if connection.writer and not connection.writer.done() and connection.writer is not asyncio.current_task():
+            connection.writer.cancel()
+        self.metrics["messages_dropped"] += connection.queue.qsize()
+        self._forget(connection)
+        self.metrics["disconnected"] += 1
+        logger.info(f"WebSocket disconnected: user={connection.user_id}, trip={connection.trip_id}")
+
+    def _forget(self, connection: Connection):
+        """Remove a closed connection from subclass indexes"""
+
+    async def _drop_slow_client(self, connection: Connection):
+        """Close a client that cannot keep up; its receive loop then exits"""
+        if connection.closed:
+            return
+        self.metrics["slow_clients_dropped"] += 1
+        self.disconnect(connection.websocket)
+        try:
+            await connection.websocket.close(code=RealtimeConfig.SLOW_CLIENT_CLOSE_CODE)
+        except Exception:
+            pass
+
+    def _deliver(self, connection: Connection, message: Dict[str, Any]):
+        if connection.enqueue(message):
+            self.metrics["messages_queued"] += 1
+            return
+        self.metrics["messages_dropped"] += 1
+        if not connection.closed:
+            logger.warning(f"Send queue full, dropping client: user={connection.user_id}, trip={connection.trip_id}")
+            asyncio.ensure_future(self._drop_slow_client(connection))
+
+    async def send_personal_message(self, message: dict, websocket: WebSocket):
+        connection = self.connections.get(websocket)
+        if connection:
+            self._deliver(connection, message)
+
+    async def _on_bus_message(self, channel: str, payload: Dict[str, Any]):
+        pass
+
+    def stats(self) -> Dict[str, Any]:
+        depths = [c.queue.qsize() for c in self.connections.values()]
+        return {
+            **self.metrics,
+            "connections": len(self.connections),
+            "queue_capacity": self.queue_size,
+            "queue_depth_total": sum(depths),
+            "queue_depth_max": max(depths, default=0),
+            "bus": self.bus.stats()
+        }
+
+
+class ConnectionManager(SocketRegistry):
+    """
+    Manages WebSocket connections for real-time chat.
+
+    Broadcasts go through the bus; each worker's manager receives them
+    back through its subscription and delivers to the sockets it holds.
+    """
+
+    def __init__(self, bus: Optional[InMemoryBus] = None, queue_size: int = RealtimeConfig.SEND_QUEUE_SIZE):
+        super().__init__(bus, queue_size)
+        # trip_id -> connections in that trip
+        self.active_connections: Dict[str, Set[Connection]] = {}
+        # user_id -> most recent connection
+        self.user_connections: Dict[str, Connection] = {}
+
+    async def connect(self, websocket: WebSocket, trip_id: str, user_id: str, **identity) -> Connection:
+        connection = await self._accept(websocket, trip_id, user_id, **identity)
+        self.active_connections.setdefault(trip_id, set()).add(connection)
+        self.user_connections[user_id] = connection
+        logger.info(f"WebSocket connected: user={user_id}, trip={trip_id}")
+        return connection
+
+    def _forget(self, connection: Connection):
+        trip_connections = self.active_connections.get(connection.trip_id)
+        if trip_connections is not None:
+            trip_connections.discard(connection)
+            if not trip_connections:
+                del self.active_connections[connection.trip_id]
+        # Only forget the user if this is still their current socket
+        if self.user_connections.get(connection.user_id) is connection:
+            del self.user_connections[connection.user_id]
+
+    async def broadcast_to_trip(self, message: dict, trip_id: str, exclude_user: str = None):
+        """Broadcast message to all users in a trip, on every worker"""
+        await self.bus.publish(chat_channel(trip_id), {"message": message, "exclude_user": exclude_user})
+
+    async def _on_bus_message(self, channel: str, payload: Dict[str, Any]):
+        kind, _, key = channel.partition(":")
+        if kind == "chat":
+            self.deliver_to_trip(payload["message"], key, payload.get("exclude_user"))
+
+    def deliver_to_trip(self, message: dict, trip_id: str, exclude_user: str = None):
+        """Queue a message for this worker's sockets in a trip (never waits on a socket)"""
+        for connection in list(self.active_connections.get(trip_id, ())):
+            if exclude_user and connection.user_id == exclude_user:
+                continue
+            self._deliver(connection, message)
+
+    def stats(self) -> Dict[str, Any]:
+        return {**super().stats(), "trips": len(self.active_connections)}
+
+
+class EventGateway(SocketRegistry):
+    """
+    Push channel for state that clients used to poll.
+
+    A socket subscribes to typed channels:
+      trip:<trip_id>     status transitions and driver location for a trip
+      driver:<driver_id> dispatcher offers and nearby new trip requests
+      share:<token>      the trip:<trip_id> stream, for share-link watchers
+    Lifecycle handlers publish to the bus and every worker fans out to the
+    subscribers it holds. Share watchers ride on their trip's events, so a
+    trip update reaches its share links without a second publish.
+    """
+
+    def __init__(self, bus: Optional[InMemoryBus] = None, queue_size: int = RealtimeConfig.SEND_QUEUE_SIZE):
+        super().__init__(bus, queue_size)
+        # channel -> subscribed connections on this worker
+        self.subscribers: Dict[str, Set[Connection]] = {}
+        # trip_id -> share tokens with local watchers
+        self.trip_shares: Dict[str, Set[str]] = {}
+        self.events_published = 0
+
+    async def connect(self, websocket: WebSocket, user_id: Optional[str] = None) -> Connection:
+        connection = await self._accept(websocket, None, user_id or "anonymous")
+        logger.info(f"Event gateway connected: user={connection.user_id}")
+        return connection
+
+    def subscribe(self, connection: Connection, channel: str, share_trip_id: Optional[str] = None):
+        """Subscribe a socket; share channels need the trip they track"""
+        connection.channels.add(channel)
+        self.subscribers.setdefault(channel, set()).add(connection)
+        if share_trip_id:
+            self.trip_shares.setdefault(share_trip_id, set()).add(channel.partition(":")[2])
+
+    def unsubscribe(self, connection: Connection, channel: str):
+        connection.channels.discard(channel)
+        channel_subscribers = self.subscribers.get(channel)
+        if channel_subscribers is not None:
+            channel_subscribers.discard(connection)
+            if not channel_subscribers:
+                del self.subscribers[channel]
+                if channel.startswith("share:"):
+                    token = channel.partition(":")[2]
+                    for trip_id, tokens in list(self.trip_shares.items()):
+                        tokens.discard(token)
+                        if not tokens:
+                            del self.trip_shares[trip_id]
+
+    def _forget(self, connection: Connection):
+        for channel in list(connection.channels):
+            self.unsubscribe(connection, channel)
+
+    async def publish(self, channel: str, event: Dict[str, Any]):
+        """Publish a JSON-safe event to a channel on every worker"""
+        self.events_published += 1
+        await self.bus.publish(channel, {"event": event})
+
+    async def _on_bus_message(self, channel: str, payload: Dict[str, Any]):
+        kind, _, key = channel.partition(":")
+        if kind not in EVENT_CHANNEL_KINDS:
+            return
+        event = payload["event"]
+        if kind == "trip":
+            self.deliver_to_trip(key, event)
+        else:
+            self.deliver(channel, event)
+
+    def deliver_to_trip(self, trip_id: str, event: Dict[str, Any]):
+        """Queue a trip event for this worker's trip:<id> and share-link subscribers"""
+        self.deliver(f"trip:{trip_id}", event)
+        for token in list(self.trip_shares.get(trip_id, ())):
+            self.deliver(f"share:{token}", event)
+
+    def deliver(self, channel: str, event: Dict[str, Any]):
+        """Queue an event for this worker's subscribers of a channel"""
+        channel_subscribers = self.subscribers.get(channel)
+        if not channel_subscribers:
+            return
+        message = {"channel": channel, **event}
+        for connection in list(channel_subscribers):
+            self._deliver(connection, message)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **super().stats(),
+            "channels": len(self.subscribers),
+            "shared_trips": len(self.trip_shares),
+            "events_published": self.events_published
+        }
@@ -1,6 +1,6 @@
 from fastapi import FastAPI, APIRouter, HTTPException, status, Response, Request, WebSocket, WebSocketDisconnect
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from typing import Set
@@ -14,10 +14,10 @@ import uuid
 from datetime import datetime, timedelta, timezone
 import random
 import math
-import httpx
 import hashlib
 import json
 import asyncio
+import time
 
 # Import LLM Chat for AI Assistants
 from emergentintegrations.llm.chat import LlmChat, UserMessage
@@ -29,9 +29,60 @@ from payment_reminder_system import payment_reminder_job
 # Import Map Service (Cost Controlled)
 from map_service import map_router
 
+# Import Route Cache (bounded LRU + TTL)
+from route_cache import route_cache, SingleFlight
+
+# Import pooled outbound HTTP clients
+from http_clients import UpstreamClients
+
+# Import Fare Quote Store (price-locked estimates)
+from fare_quote_store import FareQuoteStore
+
+# Import Trip Telemetry (bucketed GPS breadcrumbs)
+from trip_telemetry import TripTelemetry, update_route_summary
+
+# Import Trip Safety Monitor (incremental stop/deviation/traffic detection)
+from trip_safety import TripSafetyMonitor
+
+# Import Database Index registry
+from db_indexes import apply_indexes, index_report
+
+# Import Realtime WebSocket connection manager
+from realtime import ConnectionManager, EventGateway, InMemoryBus, MongoChangeStreamBus
+
+# Import Chat Persistence (write-behind messages and read markers)
+from chat_persistence import ChatPersister, ChatPersistConfig, message_time
+
+# Import Unread Counters (chat and notification badges)
+from unread_counters import UnreadCounters, NOTIFICATIONS_SCOPE, TRIP_SCOPE_PREFIX, trip_scope
+
+# Import keyset cursor and batched lookup helpers
+from query_utils import decode_cursor, cursor_for, keyset_filter, mongo_utcnow, batch_lookup, batch_count, keyset_page, encode_seq_cursor, decode_seq_cursor
+
 # Import Call Service (Privacy Protected)
 from call_service import call_router
 
+# Import Geo Service (nearest-driver lookups)
+from geo_service import GeoIndex, SpatialGrid, to_geojson_point, DRIVER_LOCATION_MAX_AGE_MINUTES
+
+# Import Trip Dispatcher (batched matching windows)
+from dispatcher import TripDispatcher
+
+# Import Location Ingestion (write-behind GPS buffer)
+from location_ingest import LocationIngestBuffer, DRIVER_POSITIONS_CHANNEL
+
+# Import Shared Trip Tracking hub (latest state per share link)
+from share_tracking import SharedTripHub
+
+# Import Platform Stats (materialized admin dashboard counters)
+from platform_stats import PlatformStats
+
+# Import Exports (streaming CSV/NDJSON admin exports)
+from exports import EXPORT_COLUMNS, EXPORT_FORMATS, stream_rows
+
+# Import Leaderboards (driver daily rollups and cached rankings)
+from leaderboards import DriverLeaderboards, PERIOD_DAYS, LEADERBOARD_SIZE, DEFAULT_CITY
+
 ROOT_DIR = Path(__file__).parent
 ADMIN_DIR = ROOT_DIR.parent / 'admin'
 load_dotenv(ROOT_DIR / '.env')
@@ -41,6 +92,36 @@ mongo_url = os.environ['MONGO_URL']
 client = AsyncIOMotorClient(mongo_url)
 db = client[os.environ.get('DB_NAME', 'nexryde_db')]
 
+# Pooled outbound HTTP clients (Google, Termii, Emergent auth)
+upstream_clients = UpstreamClients()
+
+# Fare estimates, shared across workers through MongoDB
+fare_quotes = FareQuoteStore(db)
+
+# In-trip GPS breadcrumbs, stored outside the trip document
+trip_telemetry = TripTelemetry(db)
+# Rolling per-trip safety state, rebuilt from telemetry when missing
+safety_monitor = TripSafetyMonitor(db, trip_telemetry)
+
+# Unread badges per (user, trip chat) and per user's notifications
+unread_counters = UnreadCounters(db)
+
+# Admin dashboard totals, kept current by the write paths
+platform_stats = PlatformStats(db)
+# Driver leaderboards, rebuilt from daily rollups on a schedule
+driver_leaderboards = DriverLeaderboards(db)
+
+# Pending trips drop out of the in-memory pickup grid after this long
+PENDING_TRIP_MAX_AGE_MINUTES = 30
+
+# Geospatial driver/trip index
+geo_index = GeoIndex(db)
+# In-process grids of online driver positions and pending trip pickups
+driver_grid = SpatialGrid(max_age_seconds=DRIVER_LOCATION_MAX_AGE_MINUTES * 60)
+pending_trip_grid = SpatialGrid(max_age_seconds=PENDING_TRIP_MAX_AGE_MINUTES * 60)
+# Drivers currently online (refreshed from MongoDB by the grid eviction job)
+online_driver_ids: Set[str] = set()
+
 # Google Maps API Key
 GOOGLE_MAPS_API_KEY = os.environ.get('GOOGLE_MAPS_API_KEY', '')
 
@@ -52,6 +133,17 @@ TERMII_API_KEY = os.environ.get('TERMII_API_KEY', '')
 TERMII_BASE_URL = os.environ.get('TERMII_BASE_URL', 'https://api.ng.termii.com')
 TERMII_FROM_ID = os.environ.get('TERMII_FROM_ID', 'NEXRYDE')
 
+# Batched trip dispatcher; with several workers one at a time runs it, elected through a MongoDB lease
+DISPATCH_ENABLED = os.environ.get('DISPATCH_ENABLED', 'true').lower() == 'true'
+# Realtime pub/sub backend: "memory" (single worker) or "mongo" (change streams, multi-worker)
+REALTIME_BUS = os.environ.get('REALTIME_BUS', 'memory').lower()
+# Pub/sub shared by WebSocket chat and the event gateway
+realtime_bus = MongoChangeStreamBus(db) if REALTIME_BUS == "mongo" else InMemoryBus()
+# Latest status and driver location for shared trips, served to share-link watchers from memory
+shared_trips = SharedTripHub(realtime_bus)
+# Write-behind buffer for driver GPS pings; flushed positions are fanned out to every worker's grid
+location_buffer = LocationIngestBuffer(db, bus=realtime_bus)
+
 # Emergent Auth URL
 EMERGENT_AUTH_URL = os.environ.get('EMERGENT_AUTH_URL', 'https://demobackend.emergentagent.com/auth/v1/env/oauth/session-data')
 
@@ -117,19 +209,19 @@ DRIVER_CERTIFICATION_LEVELS = {
     }
 }
 
+# Matching radius and candidate pool for nearest-driver lookups
+MATCH_RADIUS_KM = 10.0
+MATCH_CANDIDATE_LIMIT = 20
+# How often stale grid entries are evicted
+GRID_EVICTION_INTERVAL_SECONDS = 30
 # Route deviation threshold in km
 ROUTE_DEVIATION_THRESHOLD = 0.5
-# Abnormal stop duration in seconds
-ABNORMAL_STOP_THRESHOLD = 300  # 5 minutes
-# Cache settings
-route_cache: Dict[str, Dict[str, Any]] = {}
-CACHE_TTL_SECONDS = 300
+# Most GPS points accepted in one batch location upload
+MAX_LOCATION_BATCH_POINTS = 500
 # Fare lock duration
 FARE_LOCK_MINUTES = 3
 # OTP storage
 otp_store = {}
-# Fare estimate storage
-fare_estimate_store: Dict[str, Dict[str, Any]] = {}
 
 # ==================== DRIVER SUBSCRIPTION CONFIG ====================
 SUBSCRIPTION_CONFIG = {
@@ -287,6 +379,8 @@ class Trip(BaseModel):
     fare: float
     surge_multiplier: float = 1.0
     service_type: str = "economy"
+    # Operating city (fare config, exports, leaderboards)
+    city: str = "lagos"
     status: str = "pending"
     payment_method: str = "cash"
     payment_status: str = "pending"
@@ -306,9 +400,12 @@ class Trip(BaseModel):
     risk_alert_by_rider: bool = False
     recording_enabled: bool = False
     face_verified_at_start: bool = False
+    # GeoJSON pickup point for 2dsphere lookups of pending trips
+    pickup_point: Optional[dict] = None
     # Route tracking
     polyline: Optional[str] = None
-    actual_route: List[dict] = []  # [{lat, lng, timestamp}]
+    # Compact breadcrumb summary; full trail lives in trip_telemetry
+    route_summary: Optional[dict] = None  # {point_count, first_point, last_point, distance_km, stationary_since}
     fare_locked_until: Optional[datetime] = None
     # Insurance
     is_insured: bool = True
@@ -433,6 +530,15 @@ class LocationUpdate(BaseModel):
     latitude: float
     longitude: float
 
+class TripLocationPoint(BaseModel):
+    latitude: float
+    longitude: float
+    timestamp: datetime
+    speed_kmh: Optional[float] = None
+
+class TripLocationBatch(BaseModel):
+    points: List[TripLocationPoint]
+
 class FareEstimateRequest(BaseModel):
     pickup_lat: float
     pickup_lng: float
@@ -452,6 +558,7 @@ class TripRequest(BaseModel):
     payment_method: str = "cash"
     fare_estimate_id: Optional[str] = None
     enable_recording: bool = False
+    city: str = "lagos"
 
 class ComfortRatingRequest(BaseModel):
     overall_rating: float
@@ -489,6 +596,7 @@ class BookForOtherRequest(BaseModel):
     rider_phone: str
     service_type: str = "economy"
     payment_method: str = "cash"
+    city: str = "lagos"
 
 class SubscriptionRequest(BaseModel):
     payment_method: str
@@ -731,14 +839,6 @@ def get_cache_key(pickup_lat: float, pickup_lng: float, dropoff_lat: float, drop
     key_str = f"{round(pickup_lat, 4)},{round(pickup_lng, 4)}-{round(dropoff_lat, 4)},{round(dropoff_lng, 4)}"
     return hashlib.md5(key_str.encode()).hexdigest()
 
-def is_cache_valid(cache_entry: dict) -> bool:
-    if not cache_entry:
-        return False
-    cached_at = cache_entry.get("cached_at")
-    if not cached_at:
-        return False
-    return (datetime.utcnow() - cached_at).total_seconds() < CACHE_TTL_SECONDS
-
 def calculate_distance_haversine(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
     R = 6371
     lat1_rad = math.radians(lat1)
@@ -749,14 +849,25 @@ def calculate_distance_haversine(lat1: float, lon1: float, lat2: float, lon2: fl
     c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
     return R * c
 
+# In-flight Google directions lookups, keyed by get_cache_key
+directions_flight = SingleFlight()
+
 async def get_directions_from_google(pickup_lat: float, pickup_lng: float, dropoff_lat: float, dropoff_lng: float) -> dict:
     cache_key = get_cache_key(pickup_lat, pickup_lng, dropoff_lat, dropoff_lng)
-    if cache_key in route_cache and is_cache_valid(route_cache[cache_key]):
-        return route_cache[cache_key]["data"]
+    cached = route_cache.get(cache_key)
+    if cached is not None:
+        return cached
     
     if not GOOGLE_MAPS_API_KEY:
         return None
     
+    # Concurrent quotes for the same route share one Google request and its outcome
+    return await directions_flight.do(
+        cache_key,
+        lambda: fetch_directions_from_google(cache_key, pickup_lat, pickup_lng, dropoff_lat, dropoff_lng)
+    )
+
+async def fetch_directions_from_google(cache_key: str, pickup_lat: float, pickup_lng: float, dropoff_lat: float, dropoff_lng: float) -> dict:
     # Try Routes API first
     try:
         url = "https://routes.googleapis.com/directions/v2:computeRoutes"
@@ -772,9 +883,8 @@ async def get_directions_from_google(pickup_lat: float, pickup_lng: float, dropo
             "routingPreference": "TRAFFIC_AWARE"
         }
         
-        async with httpx.AsyncClient() as client:
-            response = await client.post(url, headers=headers, json=body, timeout=10.0)
-            data = response.json()
+        response = await upstream_clients.post("google_routes", url, headers=headers, json=body)
+        data = response.json()
         
         if "routes" in data and len(data["routes"]) > 0:
             route = data["routes"][0]
@@ -786,7 +896,7 @@ async def get_directions_from_google(pickup_lat: float, pickup_lng: float, dropo
                 "duration_in_traffic_seconds": duration_seconds,
                 "polyline": route.get("polyline", {}).get("encodedPolyline", ""),
             }
-            route_cache[cache_key] = {"data": result, "cached_at": datetime.utcnow()}
+            route_cache.set(cache_key, result)
             return result
     except Exception as e:
         logger.warning(f"Routes API failed: {e}")
@@ -800,9 +910,8 @@ async def get_directions_from_google(pickup_lat: float, pickup_lng: float, dropo
             "key": GOOGLE_MAPS_API_KEY,
             "departure_time": "now"
         }
-        async with httpx.AsyncClient() as client:
-            response = await client.get(url, params=params, timeout=10.0)
-            data = response.json()
+        response = await upstream_clients.get("google_maps", url, params=params)
+        data = response.json()
         
         if data.get("status") == "OK":
             route = data["routes"][0]
@@ -813,7 +922,7 @@ async def get_directions_from_google(pickup_lat: float, pickup_lng: float, dropo
                 "duration_in_traffic_seconds": leg.get("duration_in_traffic", {}).get("value", leg["duration"]["value"]),
                 "polyline": route["overview_polyline"]["points"],
             }
-            route_cache[cache_key] = {"data": result, "cached_at": datetime.utcnow()}
+            route_cache.set(cache_key, result)
             return result
     except Exception as e:
         logger.warning(f"Directions API failed: {e}")
@@ -1002,37 +1111,53 @@ async def send_sms_notification(phone: str, message: str):
             logger.info(f"SMS notification (mock): {phone} - {message}")
             return True
         
-        async with httpx.AsyncClient() as http_client:
-            # Termii requires phone number WITHOUT the + prefix
-            termii_phone = phone.lstrip('+')
-            
-            payload = {
-                "api_key": TERMII_API_KEY,
-                "to": termii_phone,
-                "from": "NEXRYDE",
-                "channel": "dnd",
-                "type": "plain",
-                "sms": message
-            }
-            
-            logger.info(f"Sending SMS notification to {termii_phone}")
-            
-            response = await http_client.post(
-                f"{TERMII_BASE_URL}/api/sms/send",
-                json=payload,
-                timeout=30.0
-            )
-            
-            if response.status_code == 200:
-                logger.info(f"✅ SMS notification sent to {termii_phone}")
-                return True
-            else:
-                logger.error(f"SMS notification failed: {response.status_code} - {response.text}")
-                return False
+        # Termii requires phone number WITHOUT the + prefix
+        termii_phone = phone.lstrip('+')
+        
+        payload = {
+            "api_key": TERMII_API_KEY,
+            "to": termii_phone,
+            "from": "NEXRYDE",
+            "channel": "dnd",
+            "type": "plain",
+            "sms": message
+        }
+        
+        logger.info(f"Sending SMS notification to {termii_phone}")
+        
+        response = await upstream_clients.post(
+            "termii",
+            f"{TERMII_BASE_URL}/api/sms/send",
+            json=payload
+        )
+        
+        if response.status_code == 200:
+            logger.info(f"✅ SMS notification sent to {termii_phone}")
+            return True
+        else:
+            logger.error(f"SMS notification failed: {response.status_code} - {response.text}")
+            return False
     except Exception as e:
         logger.error(f"SMS notification error: {e}")
         return False
 
+async def set_subscription_status(query: dict, update: dict) -> Optional[dict]:
+    """
+    Update one subscription and keep the active-subscription counter in
+    step. Returns the subscription's previous status document (None if no
+    subscription matched).
+    """
+    previous = await db.subscriptions.find_one_and_update(query, update, projection={"_id": 0, "status": 1})
+    if previous is not None:
+        new_status = update.get("$set", {}).get("status", previous.get("status"))
+        await platform_stats.record_subscription_status(previous.get("status"), new_status)
+    return previous
+
+async def insert_notification(notification: dict):
+    """Store an in-app notification and bump the recipient's unread counter"""
+    await db.notifications.insert_one(notification)
+    unread_counters.incr_notifications(notification["user_id"])
+
 async def send_driver_verification_notification(user_id: str, status: str, reason: str = None):
     """Send notification to driver about verification status"""
     try:
@@ -1064,7 +1189,7 @@ async def send_driver_verification_notification(user_id: str, status: str, reaso
             "read": False,
             "created_at": datetime.utcnow()
         }
-        await db.notifications.insert_one(notification)
+        await insert_notification(notification)
         
         logger.info(f"📱 Verification notification sent to {name} ({phone}): {status}")
         
@@ -1094,56 +1219,55 @@ async def send_otp(request: OTPRequest):
         # Check if Termii is configured and try to send
         if TERMII_API_KEY:
             try:
-                async with httpx.AsyncClient() as http_client:
-                    # Termii requires phone number WITHOUT the + prefix
-                    termii_phone = normalized_phone.lstrip('+')
-                    
-                    # Use the registered sender ID from environment
-                    sender_id = TERMII_FROM_ID or "OE Alert"
-                    
-                    payload = {
-                        "api_key": TERMII_API_KEY,
-                        "to": termii_phone,
-                        "from": sender_id,
-                        "channel": "dnd",
-                        "type": "plain",
-                        "sms": f"Your NexRyde verification code is {otp_code}. This code expires in {OTP_EXPIRY_MINUTES} minutes."
-                    }
-                    
-                    logger.info(f"Sending OTP to {termii_phone} via Termii v3 API (sender: {sender_id})")
+                # Termii requires phone number WITHOUT the + prefix
+                termii_phone = normalized_phone.lstrip('+')
+                
+                # Use the registered sender ID from environment
+                sender_id = TERMII_FROM_ID or "OE Alert"
+                
+                payload = {
+                    "api_key": TERMII_API_KEY,
+                    "to": termii_phone,
+                    "from": sender_id,
+                    "channel": "dnd",
+                    "type": "plain",
+                    "sms": f"Your NexRyde verification code is {otp_code}. This code expires in {OTP_EXPIRY_MINUTES} minutes."
+                }
+                
+                logger.info(f"Sending OTP to {termii_phone} via Termii v3 API (sender: {sender_id})")
+                
+                response = await upstream_clients.post(
+                    "termii",
+                    f"{TERMII_BASE_URL}/api/sms/send",
+                    json=payload
+                )
+                
+                logger.info(f"Termii response status: {response.status_code}")
+                logger.info(f"Termii response: {response.text}")
+                
+                if response.status_code == 200:
+                    data = response.json()
+                    message_id = data.get('message_id')
                     
-                    response = await http_client.post(
-                        f"{TERMII_BASE_URL}/api/sms/send",
-                        json=payload,
-                        timeout=30.0
+                    # Save OTP to database
+                    await save_otp_record(
+                        phone=request.phone,
+                        otp=otp_code,
+                        provider="termii",
+                        message_id=message_id
                     )
                     
-                    logger.info(f"Termii response status: {response.status_code}")
-                    logger.info(f"Termii response: {response.text}")
-                    
-                    if response.status_code == 200:
-                        data = response.json()
-                        message_id = data.get('message_id')
-                        
-                        # Save OTP to database
-                        await save_otp_record(
-                            phone=request.phone,
-                            otp=otp_code,
-                            provider="termii",
-                            message_id=message_id
-                        )
-                        
-                        logger.info(f"Termii SMS sent successfully to {normalized_phone}")
-                        return {
-                            "success": True,
-                            "message": "OTP sent successfully via SMS",
-                            "expires_in_minutes": OTP_EXPIRY_MINUTES,
-                            "resend_cooldown_seconds": OTP_RESEND_COOLDOWN_SECONDS,
-                            "provider": "termii"
-                        }
-                    else:
-                        logger.error(f"Termii API error: {response.status_code} - {response.text}")
-                        raise Exception(f"Termii API failed: {response.text}")
+                    logger.info(f"Termii SMS sent successfully to {normalized_phone}")
+                    return {
+                        "success": True,
+                        "message": "OTP sent successfully via SMS",
+                        "expires_in_minutes": OTP_EXPIRY_MINUTES,
+                        "resend_cooldown_seconds": OTP_RESEND_COOLDOWN_SECONDS,
+                        "provider": "termii"
+                    }
+                else:
+                    logger.error(f"Termii API error: {response.status_code} - {response.text}")
+                    raise Exception(f"Termii API failed: {response.text}")
             except Exception as e:
                 logger.error(f"Termii error: {str(e)}")
                 # Fall through to mock mode
@@ -1229,33 +1353,33 @@ async def send_otp_whatsapp(request: OTPRequest):
                 
                 logger.info(f"Sending WhatsApp OTP to {normalized_phone}")
                 
-                async with httpx.AsyncClient(timeout=30.0) as client:
-                    response = await client.post(
-                        f"{TERMII_BASE_URL}/api/sms/send",
-                        json=payload
-                    )
-                    
-                    logger.info(f"WhatsApp Termii response: {response.text}")
-                    
-                    if response.status_code == 200:
-                        result = response.json()
-                        if result.get("code") == "ok":
-                            logger.info(f"WhatsApp OTP sent successfully to {normalized_phone}")
-                            return {
-                                "success": True,
-                                "message": "OTP sent successfully via WhatsApp",
-                                "expires_in_minutes": OTP_EXPIRY_MINUTES,
-                                "resend_cooldown_seconds": OTP_RESEND_COOLDOWN_SECONDS,
-                                "provider": "whatsapp"
-                            }
-                    
-                    # WhatsApp failed - return error with details
-                    error_msg = response.text
-                    logger.error(f"WhatsApp delivery failed: {error_msg}")
-                    return {
-                        "success": False,
-                        "message": "WhatsApp not available. Please use SMS instead."
-                    }
+                response = await upstream_clients.post(
+                    "termii",
+                    f"{TERMII_BASE_URL}/api/sms/send",
+                    json=payload
+                )
+                
+                logger.info(f"WhatsApp Termii response: {response.text}")
+                
+                if response.status_code == 200:
+                    result = response.json()
+                    if result.get("code") == "ok":
+                        logger.info(f"WhatsApp OTP sent successfully to {normalized_phone}")
+                        return {
+                            "success": True,
+                            "message": "OTP sent successfully via WhatsApp",
+                            "expires_in_minutes": OTP_EXPIRY_MINUTES,
+                            "resend_cooldown_seconds": OTP_RESEND_COOLDOWN_SECONDS,
+                            "provider": "whatsapp"
+                        }
+                
+                # WhatsApp failed - return error with details
+                error_msg = response.text
+                logger.error(f"WhatsApp delivery failed: {error_msg}")
+                return {
+                    "success": False,
+                    "message": "WhatsApp not available. Please use SMS instead."
+                }
                     
             except Exception as e:
                 logger.error(f"WhatsApp error: {str(e)}")
@@ -1410,22 +1534,21 @@ async def exchange_google_session(request: SessionExchangeRequest, response: Res
         logger.info(f"Received session_id for exchange: {request.session_id[:20]}..." if len(request.session_id) > 20 else f"Received session_id: {request.session_id}")
         
         # Call Emergent Auth to get user data
-        async with httpx.AsyncClient() as client:
-            auth_response = await client.get(
-                EMERGENT_AUTH_URL,
-                headers={"X-Session-ID": request.session_id},
-                timeout=30.0
-            )
-            
-            logger.info(f"Emergent Auth response status: {auth_response.status_code}")
-            
-            if auth_response.status_code != 200:
-                logger.error(f"Emergent Auth error: {auth_response.status_code} - {auth_response.text}")
-                raise HTTPException(status_code=401, detail="Invalid session. Please try signing in again.")
-            
-            user_data = auth_response.json()
-            logger.info(f"Emergent Auth returned user: {user_data.get('email', 'unknown')}")
-            session_data = SessionDataResponse(**user_data)
+        auth_response = await upstream_clients.get(
+            "emergent_auth",
+            EMERGENT_AUTH_URL,
+            headers={"X-Session-ID": request.session_id}
+        )
+        
+        logger.info(f"Emergent Auth response status: {auth_response.status_code}")
+        
+        if auth_response.status_code != 200:
+            logger.error(f"Emergent Auth error: {auth_response.status_code} - {auth_response.text}")
+            raise HTTPException(status_code=401, detail="Invalid session. Please try signing in again.")
+        
+        user_data = auth_response.json()
+        logger.info(f"Emergent Auth returned user: {user_data.get('email', 'unknown')}")
+        session_data = SessionDataResponse(**user_data)
         
         # Check if user exists by email
         existing_user = await db.users.find_one({"email": session_data.email}, {"_id": 0})
@@ -1568,6 +1691,7 @@ async def register(request: RegisterRequest):
         profile_image=request.profile_image
     )
     await db.users.insert_one(user.dict())
+    await platform_stats.record_signup(user.role)
     
     wallet = Wallet(user_id=user.id)
     await db.wallets.insert_one(wallet.dict())
@@ -1637,6 +1761,7 @@ async def switch_role(user_id: str):
             await db.driver_profiles.insert_one(DriverProfile(user_id=user_id).dict())
     
     await db.users.update_one({"id": user_id}, {"$set": {"role": new_role}})
+    await platform_stats.record_role_change(user["role"], new_role)
     user = await db.users.find_one({"id": user_id})
     user["_id"] = str(user["_id"])
     return user
@@ -1852,6 +1977,324 @@ async def verify_face_at_ride_start(user_id: str, request: FaceVerificationReque
         "message": "Face verified" if is_match else "Face does not match"
     }
 
+# ==================== LIVE DRIVER GRID ====================
+
+def grid_upsert_from_datetime(grid: SpatialGrid, entity_id: str, lat: float, lng: float, seen_at: Optional[datetime]):
+    """Add a position to a grid, ageing it by how long ago it was reported (a newer entry is kept)"""
+    age_seconds = (datetime.utcnow() - seen_at).total_seconds() if seen_at else 0
+    updated_at = time.monotonic() - max(0, age_seconds)
+    previous = grid.positions.get(entity_id)
+    if previous and previous[3] >= updated_at:
+        return
+    grid.upsert(entity_id, lat, lng, updated_at=updated_at)
+
+# Realtime bus channel announcing a driver going online or offline on any worker
+DRIVER_STATUS_CHANNEL = "driver_status"
+
+async def apply_driver_bus_message(channel: str, payload: dict):
+    """Keep this worker's online set and driver grid in step with pings and toggles handled elsewhere"""
+    if channel == DRIVER_POSITIONS_CHANNEL:
+        for driver_id, lat, lng, recorded_at in payload["positions"]:
+            if driver_id in online_driver_ids:
+                grid_upsert_from_datetime(driver_grid, driver_id, lat, lng, recorded_at)
+            # Share-link watchers of a trip this driver is heading to see the driver move
+            timestamp = recorded_at.isoformat() if isinstance(recorded_at, datetime) else recorded_at
+            for trip_id in shared_trips.apply_driver_position(driver_id, lat, lng, timestamp):
+                event_gateway.deliver_to_trip(trip_id, {
+                    "type": "location", "trip_id": trip_id, "lat": lat, "lng": lng, "timestamp": timestamp
+                })
+    elif channel == DRIVER_STATUS_CHANNEL:
+        if payload["is_online"]:
+            online_driver_ids.add(payload["driver_id"])
+        else:
+            online_driver_ids.discard(payload["driver_id"])
+            driver_grid.remove(payload["driver_id"])
+
+realtime_bus.subscribe(apply_driver_bus_message)
+
+async def nearest_available_drivers(lat: float, lng: float, radius_km: float = MATCH_RADIUS_KM, limit: int = MATCH_CANDIDATE_LIMIT) -> List[dict]:
+    """
+    k nearest online drivers as driver_profiles documents with `distance_km`.
+    Positions come from the in-memory grid, which every worker fills from
+    the flushed pings published on the realtime bus; the 2dsphere index
+    answers while the grid is cold (e.g. right after a restart) or has no
+    one near the point. The profile read stays: callers rank on profile
+    fields, and it is the authority on is_online.
+    """
+    nearest = driver_grid.nearest(lat, lng, k=limit, radius_km=radius_km) if len(driver_grid) else []
+    if not nearest:
+        return await geo_index.nearest_online_drivers(lat, lng, radius_km=radius_km, limit=limit)
+    
+    profiles = await db.driver_profiles.find(
+        {"user_id": {"$in": [driver_id for driver_id, _ in nearest]}, "is_online": True}
+    ).to_list(len(nearest))
+    by_user = {p["user_id"]: p for p in profiles}
+    
+    drivers = []
+    for driver_id, distance_km in nearest:
+        profile = by_user.get(driver_id)
+        if not profile:
+            # Went offline on another worker; the grid entry is out of date
+            driver_grid.remove(driver_id)
+            continue
+        profile["distance_km"] = distance_km
+        drivers.append(profile)
+    return drivers
+
+async def nearest_pending_trips(lat: float, lng: float, radius_km: float = MATCH_RADIUS_KM, limit: int = 10) -> List[dict]:
+    """k nearest pending trips (by pickup) with `distance_km`, grid first"""
+    if not len(pending_trip_grid):
+        return await geo_index.nearest_pending_trips(lat, lng, radius_km=radius_km, limit=limit)
+    
+    nearest = pending_trip_grid.nearest(lat, lng, k=limit, radius_km=radius_km)
+    if not nearest:
+        return []
+    
+    trips = await db.trips.find(
+        {"id": {"$in": [trip_id for trip_id, _ in nearest]}, "status": "pending"}
+    ).to_list(len(nearest))
+    by_id = {t["id"]: t for t in trips}
+    
+    results = []
+    for trip_id, distance_km in nearest:
+        trip = by_id.get(trip_id)
+        if not trip:
+            pending_trip_grid.remove(trip_id)
+            continue
+        trip["distance_km"] = distance_km
+        results.append(trip)
+    return results
+
+def track_pending_trip(trip: dict):
+    """Register a newly requested trip's pickup in the pending grid"""
+    pickup = trip.get("pickup_location") or {}
+    if pickup.get("lat") is not None and pickup.get("lng") is not None:
+        pending_trip_grid.upsert(trip["id"], pickup["lat"], pickup["lng"])
+
+async def refresh_online_drivers():
+    """Sync the online driver set with MongoDB (drivers may toggle on another worker)"""
+    online = set(await db.driver_profiles.distinct("user_id", {"is_online": True}))
+    online_driver_ids.clear()
+    online_driver_ids.update(online)
+    for driver_id in list(driver_grid.positions):
+        if driver_id not in online:
+            driver_grid.remove(driver_id)
+
+async def warm_spatial_grids():
+    """Rebuild the in-memory grids from MongoDB (the durable copy)"""
+    await refresh_online_drivers()
+    fresh_since = datetime.utcnow() - timedelta(minutes=DRIVER_LOCATION_MAX_AGE_MINUTES)
+    async for profile in db.driver_profiles.find(
+        {"is_online": True, "location_updated_at": {"$gte": fresh_since}},
+        {"user_id": 1, "current_location": 1, "location_updated_at": 1}
+    ):
+        location = profile.get("current_location") or {}
+        grid_upsert_from_datetime(
+            driver_grid, profile["user_id"], location["lat"], location["lng"], profile["location_updated_at"]
+        )
+    
+    pending_since = datetime.utcnow() - timedelta(minutes=PENDING_TRIP_MAX_AGE_MINUTES)
+    async for trip in db.trips.find(
+        {"status": "pending", "pickup_point": {"$ne": None}, "created_at": {"$gte": pending_since}},
+        {"id": 1, "pickup_location": 1, "created_at": 1}
+    ):
+        pickup = trip["pickup_location"]
+        grid_upsert_from_datetime(pending_trip_grid, trip["id"], pickup["lat"], pickup["lng"], trip["created_at"])
+    
+    logger.info(f"Spatial grids warmed: {len(driver_grid)} drivers, {len(pending_trip_grid)} pending trips")
+
+async def grid_eviction_job():
+    """Periodically drop drivers that stopped reporting, stale pending trips and expired cached routes"""
+    while True:
+        await asyncio.sleep(GRID_EVICTION_INTERVAL_SECONDS)
+        try:
+            await refresh_online_drivers()
+        except Exception as e:
+            logger.error(f"Online driver refresh failed: {e}")
+        evicted_drivers = driver_grid.evict_stale()
+        evicted_trips = pending_trip_grid.evict_stale()
+        shared_trips.evict_expired()
+        safety_monitor.evict_idle()
+        # Expired routes nobody asks for again would otherwise sit in the cache until LRU pushes them out
+        route_cache.purge_expired()
+        if evicted_drivers or evicted_trips:
+            logger.info(f"Grid eviction: {evicted_drivers} drivers, {evicted_trips} pending trips")
+
+# ==================== EVENT GATEWAY ====================
+
+# Pushes trip status, driver location, offers and share-link updates to subscribed sockets
+event_gateway = EventGateway(bus=realtime_bus)
+
+def trip_status_event(trip: dict, **extra) -> dict:
+    """JSON-safe trip_status event for a trip document"""
+    return {
+        "type": "trip_status",
+        "trip_id": trip["id"],
+        "status": trip.get("status"),
+        "driver_id": trip.get("driver_id"),
+        "at": datetime.utcnow().isoformat(),
+        **extra
+    }
+
+def trip_location_event(trip_id: str, point: Optional[dict], **extra) -> Optional[dict]:
+    """JSON-safe location event from a route_summary point"""
+    if not point:
+        return None
+    timestamp = point.get("timestamp")
+    return {
+        "type": "location",
+        "trip_id": trip_id,
+        "lat": point["lat"],
+        "lng": point["lng"],
+        "timestamp": timestamp.isoformat() if isinstance(timestamp, datetime) else timestamp,
+        **extra
+    }
+
+async def publish_event(channel: str, event: dict):
+    """Publish to the gateway; a failed push never fails the request that caused it"""
+    try:
+        await event_gateway.publish(channel, event)
+    except Exception as e:
+        logger.error(f"Event publish to {channel} failed: {e}")
+
+async def announce_pending_trip(trip: dict):
+    """Push a new trip request to the nearest online drivers' channels"""
+    pickup = trip.get("pickup_location") or {}
+    if pickup.get("lat") is None or pickup.get("lng") is None:
+        return
+    nearest = driver_grid.nearest(pickup["lat"], pickup["lng"], k=MATCH_CANDIDATE_LIMIT, radius_km=MATCH_RADIUS_KM)
+    # One concurrent publish per driver, so the request waits for the slowest push, not their sum
+    await asyncio.gather(*(
+        publish_event(f"driver:{driver_id}", {
+            "type": "pending_trip",
+            "trip_id": trip["id"],
+            "pickup": pickup,
+            "dropoff": trip.get("dropoff_location"),
+            "fare": trip.get("fare"),
+            "distance_km": round(distance_km, 2)
+        })
+        for driver_id, distance_km in nearest
+    ))
+
+async def authorize_event_channel(channel: str, user_id: Optional[str]) -> tuple:
+    """
+    Check a subscription request. Returns (share_trip_id, snapshot events);
+    raises ValueError with the reason when the channel is not allowed.
+    """
+    kind, _, key = channel.partition(":")
+    if not key:
+        raise ValueError("Invalid channel")
+    
+    if kind == "driver":
+        if not user_id or user_id != key:
+            raise ValueError("Not your driver channel")
+        return None, []
+    
+    if kind == "share":
+        # Served from the shared-trip hub; MongoDB is only read on the first watcher
+        shared = await load_shared_trip(key)
+        if not shared or shared[0] < datetime.utcnow():
+            raise ValueError("Invalid or expired tracking link")
+        view = shared[1]
+        snapshot = [trip_status_event({**view, "id": view["trip_id"]})]
+        location = trip_location_event(view["trip_id"], view.get("driver_location"))
+        if location:
+            snapshot.append(location)
+        return view["trip_id"], snapshot
+    if kind != "trip":
+        raise ValueError("Unknown channel type")
+    
+    trip = await db.trips.find_one(
+        {"id": key},
+        {"_id": 0, "id": 1, "status": 1, "rider_id": 1, "driver_id": 1, "route_summary.last_point": 1}
+    )
+    if not trip:
+        raise ValueError("Trip not found")
+    if user_id not in (trip.get("rider_id"), trip.get("driver_id")):
+        raise ValueError("Not a participant in this trip")
+    
+    # Current state first, so the client never needs a REST round trip to catch up
+    snapshot = [trip_status_event(trip)]
+    location = trip_location_event(key, (trip.get("route_summary") or {}).get("last_point"))
+    if location:
+        snapshot.append(location)
+    return None, snapshot
+
+@app.websocket("/ws/events")
+async def websocket_events(websocket: WebSocket, user_id: Optional[str] = None):
+    """
+    Real-time trip events instead of polling.
+    
+    Clients send {"type": "subscribe" | "unsubscribe", "channel": ...} with
+    channel trip:<trip_id> (rider or driver of the trip), driver:<driver_id>
+    (the driver themself) or share:<token> (anyone with a valid share link).
+    A subscribe is answered with "subscribed" and the channel's current
+    state; afterwards every event arrives as {"channel": ..., "type": ...}.
+    """
+    connection = await event_gateway.connect(websocket, user_id)
+    try:
+        while True:
+            data = await websocket.receive_json()
+            channel = str(data.get("channel") or "")
+            
+            if data.get("type") == "subscribe":
+                try:
+                    share_trip_id, snapshot = await authorize_event_channel(channel, user_id)
+                except ValueError as e:
+                    await event_gateway.send_personal_message(
+                        {"type": "error", "channel": channel, "message": str(e)}, websocket
+                    )
+                    continue
+                event_gateway.subscribe(connection, channel, share_trip_id=share_trip_id)
+                await event_gateway.send_personal_message({"type": "subscribed", "channel": channel}, websocket)
+                for event in snapshot:
+                    await event_gateway.send_personal_message({"channel": channel, **event}, websocket)
+            
+            elif data.get("type") == "unsubscribe":
+                event_gateway.unsubscribe(connection, channel)
+                await event_gateway.send_personal_message({"type": "unsubscribed", "channel": channel}, websocket)
+            
+            elif data.get("type") == "ping":
+                await event_gateway.send_personal_message({"type": "pong"}, websocket)
+                
+    except WebSocketDisconnect:
+        event_gateway.disconnect(websocket)
+    except Exception as e:
+        logger.error(f"Event gateway error: {e}")
+        event_gateway.disconnect(websocket)
+
+# ==================== TRIP DISPATCH ====================
+
+async def notify_trip_offer(driver_id: str, trip: dict, distance_km: float):
+    """Tell a driver the dispatcher has offered them a trip"""
+    pickup = trip.get("pickup_location") or trip.get("pickup") or {}
+    await insert_notification({
+        "id": str(uuid.uuid4()),
+        "user_id": driver_id,
+        "type": "trip_offer",
+        "title": "New Trip Offer",
+        "message": f"Pickup {distance_km:.1f} km away{': ' + pickup['address'] if pickup.get('address') else ''}",
+        "trip_id": trip["id"],
+        "read": False,
+        "created_at": datetime.utcnow()
+    })
+    await publish_event(f"driver:{driver_id}", {
+        "type": "trip_offer",
+        "trip_id": trip["id"],
+        "pickup": pickup,
+        "dropoff": trip.get("dropoff_location"),
+        "fare": trip.get("fare"),
+        "distance_km": round(distance_km, 2)
+    })
+
+trip_dispatcher = TripDispatcher(db, driver_grid, on_offer=notify_trip_offer)
+
+def offer_blocks_driver(trip: dict, driver_id: Optional[str]) -> bool:
+    """True if the trip is currently offered to a different driver"""
+    offered_to = trip.get("offered_to")
+    expires_at = trip.get("offer_expires_at")
+    return bool(offered_to and offered_to != driver_id and expires_at and expires_at > datetime.utcnow())
+
 # ==================== DRIVER ENDPOINTS ====================
 
 @api_router.get("/drivers/{user_id}/profile")
@@ -1877,10 +2320,10 @@ async def update_driver_profile(user_id: str, request: DriverProfileUpdate):
 
 @api_router.put("/drivers/{user_id}/location")
 async def update_driver_location(user_id: str, request: LocationUpdate):
-    await db.driver_profiles.update_one(
-        {"user_id": user_id},
-        {"$set": {"current_location": {"lat": request.latitude, "lng": request.longitude, "updated_at": datetime.utcnow().isoformat()}}}
-    )
+    # Acknowledge immediately; the buffer flushes the newest point per driver in bulk
+    location_buffer.submit(user_id, request.latitude, request.longitude)
+    if user_id in online_driver_ids:
+        driver_grid.upsert(user_id, request.latitude, request.longitude)
     return {"message": "Location updated"}
 
 @api_router.put("/drivers/{user_id}/online")
@@ -1902,6 +2345,20 @@ async def toggle_driver_online(user_id: str, is_online: bool):
         )
     
     await db.driver_profiles.update_one({"user_id": user_id}, {"$set": {"is_online": is_online}})
+    try:
+        await realtime_bus.publish(DRIVER_STATUS_CHANNEL, {"driver_id": user_id, "is_online": is_online})
+    except Exception as e:
+        logger.error(f"Driver status publish failed for {user_id}: {e}")
+    
+    location = profile.get("current_location") if profile else None
+    if is_online:
+        online_driver_ids.add(user_id)
+        if location and profile.get("location_updated_at"):
+            grid_upsert_from_datetime(driver_grid, user_id, location["lat"], location["lng"], profile["location_updated_at"])
+    else:
+        online_driver_ids.discard(user_id)
+        driver_grid.remove(user_id)
+    
     return {"message": f"Driver is now {'online' if is_online else 'offline'}"}
 
 @api_router.get("/drivers/{user_id}/stats")
@@ -2249,21 +2706,21 @@ async def get_driver_verification_status(user_id: str):
     return verification
 
 @api_router.get("/admin/verifications")
-async def admin_get_verifications(status: str = None, limit: int = 100, skip: int = 0):
-    """Get all driver verification submissions for admin review"""
+async def admin_get_verifications(status: str = None, limit: int = 100, skip: int = 0, after: Optional[str] = None):
+    """Get all driver verification submissions for admin review (pass `after`=next_cursor for the next page)"""
     query = {}
     if status:
         query["status"] = status
     
-    verifications = await db.driver_verifications.find(
-        query,
-        {"_id": 0}
-    ).sort("submitted_at", -1).skip(skip).limit(limit).to_list(limit)
+    verifications, next_cursor = await admin_page(
+        db.driver_verifications, query, limit, after, skip, field="submitted_at"
+    )
     
-    # Enrich with user names
+    # Enrich with user names (one $in query for the whole page)
+    users = await batch_lookup(db.users, [v.get("user_id") for v in verifications], projection={"name": 1, "phone": 1, "_id": 0})
     enriched_verifications = []
     for v in verifications:
-        user = await db.users.find_one({"id": v.get("user_id")}, {"name": 1, "phone": 1, "_id": 0})
+        user = users.get(v.get("user_id"))
         enriched_verifications.append({
             **v,
             "user_name": user.get("name") if user else "Unknown",
@@ -2271,10 +2728,11 @@ async def admin_get_verifications(status: str = None, limit: int = 100, skip: in
         })
     
     # Get counts by status
-    pending_count = await db.driver_verifications.count_documents({"status": "pending"})
-    under_review_count = await db.driver_verifications.count_documents({"status": "under_review"})
-    approved_count = await db.driver_verifications.count_documents({"status": "approved"})
-    rejected_count = await db.driver_verifications.count_documents({"status": "rejected"})
+    status_counts = await batch_count(db.driver_verifications, "status", ["pending", "under_review", "approved", "rejected"])
+    pending_count = status_counts.get("pending", 0)
+    under_review_count = status_counts.get("under_review", 0)
+    approved_count = status_counts.get("approved", 0)
+    rejected_count = status_counts.get("rejected", 0)
     
     return {
         "verifications": enriched_verifications,
@@ -2284,7 +2742,8 @@ async def admin_get_verifications(status: str = None, limit: int = 100, skip: in
             "approved": approved_count,
             "rejected": rejected_count,
             "total": pending_count + under_review_count + approved_count + rejected_count
-        }
+        },
+        "next_cursor": next_cursor
     }
 
 @api_router.post("/admin/verifications/{verification_id}/review")
@@ -2386,7 +2845,7 @@ async def get_user_notifications(user_id: str, limit: int = 50, unread_only: boo
         {"_id": 0}
     ).sort("created_at", -1).limit(limit).to_list(limit)
     
-    unread_count = await db.notifications.count_documents({"user_id": user_id, "read": False})
+    unread_count = await unread_counters.get(user_id, NOTIFICATIONS_SCOPE)
     
     return {
         "notifications": notifications,
@@ -2403,6 +2862,7 @@ async def mark_notification_read(user_id: str, notification_id: str):
     
     if result.modified_count == 0:
         raise HTTPException(status_code=404, detail="Notification not found")
+    unread_counters.decr(user_id, NOTIFICATIONS_SCOPE)
     
     return {"success": True}
 
@@ -2413,6 +2873,7 @@ async def mark_all_notifications_read(user_id: str):
         {"user_id": user_id, "read": False},
         {"$set": {"read": True}}
     )
+    unread_counters.reset(user_id, NOTIFICATIONS_SCOPE)
     
     return {"success": True, "marked_read": result.modified_count}
 
@@ -2446,7 +2907,7 @@ async def get_subscription(driver_id: str):
             trial_end = subscription.get("trial_end_date")
             if trial_end and now > trial_end:
                 # Trial expired
-                await db.subscriptions.update_one(
+                await set_subscription_status(
                     {"id": subscription["id"]},
                     {"$set": {"status": "pending_payment"}}
                 )
@@ -2462,7 +2923,7 @@ async def get_subscription(driver_id: str):
             if end_date:
                 if now > end_date:
                     # Subscription expired
-                    await db.subscriptions.update_one(
+                    await set_subscription_status(
                         {"id": subscription["id"]},
                         {"$set": {"status": "expired"}}
                     )
@@ -2544,7 +3005,7 @@ async def submit_payment_proof(driver_id: str, request: PaymentProofSubmission):
     
     # Update with payment proof
     now = datetime.utcnow()
-    await db.subscriptions.update_one(
+    await set_subscription_status(
         {"driver_id": driver_id},
         {"$set": {
             "status": "pending_verification",
@@ -2580,7 +3041,7 @@ async def verify_payment(driver_id: str):
     now = datetime.utcnow()
     end_date = now + timedelta(days=30)  # 30 days subscription
     
-    await db.subscriptions.update_one(
+    await set_subscription_status(
         {"driver_id": driver_id},
         {"$set": {
             "status": "active",
@@ -2673,7 +3134,7 @@ async def request_grace_period(driver_id: str, request: GracePeriodRequest):
     days = min(request.days_requested, 3)
     new_end_date = datetime.utcnow() + timedelta(days=days)
     
-    await db.subscriptions.update_one(
+    await set_subscription_status(
         {"driver_id": driver_id},
         {"$set": {
             "status": "grace_period",
@@ -2716,7 +3177,7 @@ async def estimate_fare(request: FareEstimateRequest):
     fare = calculate_fare(distance_km, duration_min, traffic_duration_min, request.service_type, request.city)
     
     estimate_id = str(uuid.uuid4())
-    fare_estimate_store[estimate_id] = {
+    await fare_quotes.put(estimate_id, {
         "fare": fare,
         "distance_km": round(distance_km, 2),
         "duration_min": duration_min,
@@ -2727,7 +3188,7 @@ async def estimate_fare(request: FareEstimateRequest):
         "dropoff": {"lat": request.dropoff_lat, "lng": request.dropoff_lng},
         "created_at": datetime.utcnow(),
         "expires_at": datetime.utcnow() + timedelta(minutes=FARE_LOCK_MINUTES)
-    }
+    })
     
     return {
         "estimate_id": estimate_id,
@@ -2757,12 +3218,13 @@ async def request_trip(rider_id: str, request: TripRequest):
     rider = await db.users.find_one({"id": rider_id})
     blocked_drivers = rider.get("blocked_drivers", []) if rider else []
     
+    # Price lock: honour the estimate from any worker until it expires
     fare_data = None
-    if request.fare_estimate_id and request.fare_estimate_id in fare_estimate_store:
-        estimate = fare_estimate_store[request.fare_estimate_id]
-        if datetime.utcnow() < estimate["expires_at"]:
-            fare_data = estimate
+    if request.fare_estimate_id:
+        fare_data = await fare_quotes.get(request.fare_estimate_id)
     
+    # The quoted city wins, so the trip matches the fare the rider accepted
+    city = (fare_data.get("city") if fare_data else None) or request.city
     if fare_data:
         distance_km = fare_data["distance_km"]
         duration_min = fare_data["duration_min"]
@@ -2788,12 +3250,13 @@ async def request_trip(rider_id: str, request: TripRequest):
             traffic_duration_min = duration_min
             polyline = None
         
-        fare = calculate_fare(distance_km, duration_min, traffic_duration_min, request.service_type)
+        fare = calculate_fare(distance_km, duration_min, traffic_duration_min, request.service_type, city)
     
     trip = Trip(
         rider_id=rider_id,
         pickup_location={"lat": request.pickup_lat, "lng": request.pickup_lng, "address": request.pickup_address},
         dropoff_location={"lat": request.dropoff_lat, "lng": request.dropoff_lng, "address": request.dropoff_address},
+        pickup_point=to_geojson_point(request.pickup_lat, request.pickup_lng),
         distance_km=round(distance_km, 2),
         duration_mins=duration_min,
         base_fare=fare["base_fare"],
@@ -2803,6 +3266,7 @@ async def request_trip(rider_id: str, request: TripRequest):
         fare=fare["total_fare"],
         surge_multiplier=fare["multiplier"],
         service_type=request.service_type,
+        city=city.lower(),
         payment_method=request.payment_method,
         polyline=polyline,
         recording_enabled=request.enable_recording,
@@ -2811,6 +3275,9 @@ async def request_trip(rider_id: str, request: TripRequest):
     )
     
     await db.trips.insert_one(trip.dict())
+    await platform_stats.record_trip_created()
+    track_pending_trip(trip.dict())
+    await announce_pending_trip(trip.dict())
     
     return {"message": "Trip requested", "trip": trip.dict()}
 
@@ -2836,12 +3303,13 @@ async def book_for_other(booker_id: str, request: BookForOtherRequest):
         traffic_duration_min = duration_min
         polyline = None
     
-    fare = calculate_fare(distance_km, duration_min, traffic_duration_min, request.service_type)
+    fare = calculate_fare(distance_km, duration_min, traffic_duration_min, request.service_type, request.city)
     
     trip = Trip(
         rider_id=booker_id,
         pickup_location={"lat": request.pickup_lat, "lng": request.pickup_lng, "address": request.pickup_address},
         dropoff_location={"lat": request.dropoff_lat, "lng": request.dropoff_lng, "address": request.dropoff_address},
+        pickup_point=to_geojson_point(request.pickup_lat, request.pickup_lng),
         distance_km=round(distance_km, 2),
         duration_mins=duration_min,
         base_fare=fare["base_fare"],
@@ -2851,6 +3319,7 @@ async def book_for_other(booker_id: str, request: BookForOtherRequest):
         fare=fare["total_fare"],
         surge_multiplier=fare["multiplier"],
         service_type=request.service_type,
+        city=request.city.lower(),
         payment_method=request.payment_method,
         polyline=polyline,
         fare_locked_until=datetime.utcnow() + timedelta(minutes=FARE_LOCK_MINUTES),
@@ -2861,26 +3330,24 @@ async def book_for_other(booker_id: str, request: BookForOtherRequest):
     trip_dict["booked_for"] = {"name": request.rider_name, "phone": request.rider_phone}
     
     await db.trips.insert_one(trip_dict)
+    await platform_stats.record_trip_created()
+    track_pending_trip(trip_dict)
+    await announce_pending_trip(trip_dict)
     
     return {"message": "Trip booked for other person", "trip": trip_dict}
 
 @api_router.get("/trips/pending")
-async def get_pending_trips(driver_lat: float, driver_lng: float):
-    # Get driver's blocked riders
-    # For now, return all pending trips within range
-    trips = await db.trips.find({"status": "pending"}).to_list(50)
+async def get_pending_trips(driver_lat: float, driver_lng: float, driver_id: Optional[str] = None):
+    # Nearest pending pickups first, served by the in-memory pickup grid
+    trips = await nearest_pending_trips(driver_lat, driver_lng, radius_km=MATCH_RADIUS_KM, limit=10)
+    # Trips the dispatcher has offered to someone else are not up for grabs
+    trips = [trip for trip in trips if not offer_blocks_driver(trip, driver_id)]
     
-    nearby_trips = []
     for trip in trips:
-        pickup = trip["pickup_location"]
-        distance = calculate_distance_haversine(driver_lat, driver_lng, pickup["lat"], pickup["lng"])
-        if distance <= 10:
-            trip["_id"] = str(trip["_id"])
-            trip["distance_to_pickup"] = round(distance, 2)
-            nearby_trips.append(trip)
+        trip["_id"] = str(trip["_id"])
+        trip["distance_to_pickup"] = round(trip.pop("distance_km"), 2)
     
-    nearby_trips.sort(key=lambda x: x["distance_to_pickup"])
-    return nearby_trips[:10]
+    return trips
 
 @api_router.put("/trips/{trip_id}/accept")
 async def accept_trip(trip_id: str, driver_id: str):
@@ -2899,18 +3366,60 @@ async def accept_trip(trip_id: str, driver_id: str):
         if rider and driver_id in rider.get("blocked_drivers", []):
             raise HTTPException(status_code=403, detail="You cannot accept this ride")
     
+    # Only the driver holding the dispatcher's offer may accept until it expires
+    now = datetime.utcnow()
     result = await db.trips.update_one(
-        {"id": trip_id, "status": "pending"},
-        {"$set": {"driver_id": driver_id, "status": "accepted", "accepted_at": datetime.utcnow()}}
+        {
+            "id": trip_id,
+            "status": "pending",
+            "$or": [
+                {"offered_to": None},
+                {"offered_to": driver_id},
+                {"offer_expires_at": {"$lte": now}}
+            ]
+        },
+        {"$set": {"driver_id": driver_id, "status": "accepted", "accepted_at": now}}
     )
     
     if result.modified_count == 0:
         raise HTTPException(status_code=400, detail="Trip not available")
     
+    pending_trip_grid.remove(trip_id)
+    
     trip = await db.trips.find_one({"id": trip_id})
+    await publish_event(f"trip:{trip_id}", trip_status_event(trip))
     trip["_id"] = str(trip["_id"])
     return trip
 
+@api_router.put("/trips/{trip_id}/decline-offer")
+async def decline_trip_offer(trip_id: str, driver_id: str):
+    """Driver declines a dispatcher offer so the trip is re-dispatched next window"""
+    result = await db.trips.update_one(
+        {"id": trip_id, "status": "pending", "offered_to": driver_id},
+        {
+            "$set": {"offered_to": None, "offer_expires_at": None},
+            "$addToSet": {"declined_by": driver_id}
+        }
+    )
+    
+    if result.modified_count == 0:
+        raise HTTPException(status_code=400, detail="No active offer for this driver")
+    
+    return {"message": "Offer declined"}
+
+@api_router.get("/drivers/{user_id}/offers")
+async def get_driver_offers(user_id: str):
+    """Trips the dispatcher is currently offering to this driver"""
+    trips = await db.trips.find({
+        "status": "pending",
+        "offered_to": user_id,
+        "offer_expires_at": {"$gt": datetime.utcnow()}
+    }).to_list(5)
+    
+    for trip in trips:
+        trip["_id"] = str(trip["_id"])
+    return {"offers": trips}
+
 @api_router.put("/trips/{trip_id}/verify-face-and-start")
 async def verify_face_and_start_trip(trip_id: str, request: FaceVerificationRequest):
     """Verify driver face and start trip"""
@@ -2925,8 +3434,8 @@ async def verify_face_and_start_trip(trip_id: str, request: FaceVerificationRequ
     # For MVP: Accept any image
     face_verified = True
     
-    await db.trips.update_one(
-        {"id": trip_id},
+    result = await db.trips.update_one(
+        {"id": trip_id, "status": "accepted"},
         {"$set": {
             "status": "ongoing",
             "started_at": datetime.utcnow(),
@@ -2934,7 +3443,11 @@ async def verify_face_and_start_trip(trip_id: str, request: FaceVerificationRequ
         }}
     )
     
+    if result.modified_count == 0:
+        raise HTTPException(status_code=400, detail="Trip must be accepted first")
+    
     trip = await db.trips.find_one({"id": trip_id})
+    await publish_event(f"trip:{trip_id}", trip_status_event(trip))
     trip["_id"] = str(trip["_id"])
     return {"trip": trip, "face_verified": face_verified}
 
@@ -2949,68 +3462,165 @@ async def start_trip(trip_id: str):
         raise HTTPException(status_code=400, detail="Cannot start trip")
     
     trip = await db.trips.find_one({"id": trip_id})
+    await publish_event(f"trip:{trip_id}", trip_status_event(trip))
     trip["_id"] = str(trip["_id"])
     return trip
 
-@api_router.put("/trips/{trip_id}/update-location")
-async def update_trip_location(trip_id: str, request: LocationUpdate):
-    """Update trip location for live monitoring"""
-    location_point = {
-        "lat": request.latitude,
-        "lng": request.longitude,
-        "timestamp": datetime.utcnow().isoformat()
-    }
-    
-    trip = await db.trips.find_one({"id": trip_id})
+def as_naive_utc(value: datetime) -> datetime:
+    """Client timestamps may carry an offset; everything stored is naive UTC"""
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    # MongoDB keeps milliseconds; truncating keeps stored and in-memory copies equal
+    return value.replace(microsecond=value.microsecond // 1000 * 1000)
+
+def traffic_delay_changes(anomalies: List[dict]) -> tuple:
+    """(delays to append, end time for the delay already open) from monitor anomalies"""
+    new_delays: List[dict] = []
+    close_open_at = None
+    for anomaly in anomalies:
+        if anomaly["check_type"] == "traffic_started":
+            new_delays.append({"start": anomaly["triggered_at"].isoformat(), "location": anomaly["location"]})
+        elif anomaly["check_type"] == "traffic_ended":
+            if new_delays and "end" not in new_delays[-1]:
+                new_delays[-1]["end"] = anomaly["triggered_at"].isoformat()
+            else:
+                close_open_at = anomaly["triggered_at"].isoformat()
+    return new_delays, close_open_at
+
+async def record_safety_anomalies(trip_id: str, anomalies: List[dict]):
+    """Store abnormal stops and route deviations as safety checks and push them to trip watchers"""
+    checks = [
+        SafetyCheck(
+            trip_id=trip_id,
+            check_type=anomaly["check_type"],
+            triggered_at=anomaly["triggered_at"],
+            location=anomaly["location"]
+        )
+        for anomaly in anomalies if anomaly["check_type"] in ("abnormal_stop", "route_deviation")
+    ]
+    if not checks:
+        return
+    await db.safety_checks.insert_many([check.dict() for check in checks])
+    for check in checks:
+        await publish_event(f"trip:{trip_id}", {
+            "type": "safety_check",
+            "trip_id": trip_id,
+            "check_id": check.id,
+            "check_type": check.check_type,
+            "location": check.location,
+            "at": check.triggered_at.isoformat()
+        })
+
+async def ingest_trip_points(trip_id: str, points: List[dict]) -> dict:
+    """
+    Fold time-ordered GPS points ({lat, lng, timestamp, speed_kmh?}) into a
+    trip in one pass: route summary, plus stop/deviation/traffic detection
+    by the trip's in-memory safety state. Each collection is written once
+    per call, so a batch of N points costs the same round trips as a
+    single point. Points not newer than the trip's last recorded point (a
+    retried upload) are skipped.
+    """
+    trip = await db.trips.find_one({"id": trip_id}, {"_id": 0, "polyline": 1, "route_summary": 1})
     if not trip:
         raise HTTPException(status_code=404, detail="Trip not found")
     
-    # Check for route deviation
-    route_deviation = False
-    if trip.get("polyline"):
-        # In production: Decode polyline and check deviation
-        pass
-    
-    # Check for abnormal stop (same location for too long)
-    actual_route = trip.get("actual_route", [])
-    abnormal_stop = False
-    if len(actual_route) >= 2:
-        last_point = actual_route[-1]
-        distance = calculate_distance_haversine(
-            request.latitude, request.longitude,
-            last_point["lat"], last_point["lng"]
-        )
-        if distance < 0.01:  # Less than 10 meters
-            last_time = datetime.fromisoformat(last_point["timestamp"])
-            if (datetime.utcnow() - last_time).total_seconds() > ABNORMAL_STOP_THRESHOLD:
-                abnormal_stop = True
-    
+    summary = trip.get("route_summary")
+    last_seen = ((summary or {}).get("last_point") or {}).get("timestamp")
+    points = sorted(points, key=lambda p: p["timestamp"])
+    fresh = [p for p in points if last_seen is None or p["timestamp"] > last_seen]
+    if not fresh:
+        return {"accepted": 0, "skipped": len(points), "route_deviation": False, "abnormal_stop": False}
+    
+    # Detection is incremental (O(1) per point); the trip read above doubles as the freshness check
+    anomalies = await safety_monitor.observe(trip_id, fresh, trip=trip)
+    state = await safety_monitor.state_for(trip_id)
+    for point in fresh:
+        summary = update_route_summary(summary, point["lat"], point["lng"], point["timestamp"])
+    
+    await trip_telemetry.append_many(trip_id, [
+        {k: v for k, v in point.items() if v is not None} for point in fresh
+    ])
     await db.trips.update_one(
         {"id": trip_id},
         {
-            "$push": {"actual_route": location_point},
             "$set": {
-                "route_deviation_detected": route_deviation,
-                "abnormal_stop_detected": abnormal_stop
+                "route_summary": summary,
+                "route_deviation_detected": state.off_route,
+                "abnormal_stop_detected": state.stopped
             }
         }
     )
     
-    # Create safety check if needed
-    if route_deviation or abnormal_stop:
-        safety_check = SafetyCheck(
-            trip_id=trip_id,
-            check_type="route_deviation" if route_deviation else "abnormal_stop",
-            location={"lat": request.latitude, "lng": request.longitude}
-        )
-        await db.safety_checks.insert_one(safety_check.dict())
+    speed_points = [p for p in fresh if p.get("speed_kmh") is not None]
+    if speed_points:
+        new_delays, close_open_at = traffic_delay_changes(anomalies)
+        await trip_telemetry.record_speeds(trip_id, speed_points, new_delays, close_open_at)
+    await record_safety_anomalies(trip_id, anomalies)
+    
+    await publish_event(f"trip:{trip_id}", trip_location_event(
+        trip_id, summary["last_point"],
+        distance_km=summary["distance_km"],
+        route_deviation=state.off_route,
+        abnormal_stop=state.stopped
+    ))
     
+    return {
+        "accepted": len(fresh),
+        "skipped": len(points) - len(fresh),
+        "route_deviation": state.off_route,
+        "abnormal_stop": state.stopped,
+        "traffic_delay_open": state.traffic_open
+    }
+
+@api_router.put("/trips/{trip_id}/update-location")
+async def update_trip_location(trip_id: str, request: LocationUpdate):
+    """Update trip location for live monitoring"""
+    result = await ingest_trip_points(trip_id, [
+        {"lat": request.latitude, "lng": request.longitude, "timestamp": mongo_utcnow()}
+    ])
     return {
         "location_updated": True,
-        "route_deviation": route_deviation,
-        "abnormal_stop": abnormal_stop
+        "route_deviation": result["route_deviation"],
+        "abnormal_stop": result["abnormal_stop"]
     }
 
+@api_router.post("/trips/{trip_id}/locations/batch")
+async def upload_trip_locations(trip_id: str, request: TripLocationBatch):
+    """
+    Upload GPS points the app buffered (e.g. on a weak network) in one
+    request, instead of one update-location/track call per point.
+    """
+    if not request.points:
+        raise HTTPException(status_code=400, detail="No points supplied")
+    if len(request.points) > MAX_LOCATION_BATCH_POINTS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_LOCATION_BATCH_POINTS} points per batch")
+    
+    # Device clocks run ahead; a future timestamp would make later points look stale
+    now = mongo_utcnow()
+    result = await ingest_trip_points(trip_id, [
+        {
+            "lat": point.latitude,
+            "lng": point.longitude,
+            "timestamp": min(as_naive_utc(point.timestamp), now),
+            "speed_kmh": point.speed_kmh
+        }
+        for point in request.points
+    ])
+    return {"location_updated": result["accepted"] > 0, **result}
+
+@api_router.get("/trips/{trip_id}/route")
+async def get_trip_route(trip_id: str):
+    """Stream a trip's GPS points in time order as NDJSON"""
+    trip = await db.trips.find_one({"id": trip_id}, {"_id": 0, "id": 1})
+    if not trip:
+        raise HTTPException(status_code=404, detail="Trip not found")
+    
+    async def point_lines():
+        async for point in trip_telemetry.iter_points(trip_id):
+            yield json.dumps({**point, "timestamp": point["timestamp"].isoformat()}) + "\n"
+    
+    return StreamingResponse(point_lines(), media_type="application/x-ndjson")
+
 @api_router.put("/trips/{trip_id}/complete")
 async def complete_trip(trip_id: str):
     result = await db.trips.update_one(
@@ -3022,6 +3632,8 @@ async def complete_trip(trip_id: str):
         raise HTTPException(status_code=400, detail="Cannot complete trip")
     
     trip = await db.trips.find_one({"id": trip_id})
+    await platform_stats.record_trip_completed(trip.get("fare"))
+    await driver_leaderboards.record_trip_completed(trip)
     
     # Update stats
     if trip.get("driver_id"):
@@ -3033,6 +3645,9 @@ async def complete_trip(trip_id: str):
         )
     
     await db.users.update_one({"id": trip["rider_id"]}, {"$inc": {"total_trips": 1}})
+    await unread_counters.clear_scope(trip_scope(trip_id))
+    safety_monitor.forget(trip_id)
+    await publish_event(f"trip:{trip_id}", trip_status_event(trip))
     
     trip["_id"] = str(trip["_id"])
     return trip
@@ -3050,6 +3665,12 @@ async def cancel_trip(trip_id: str, cancelled_by: str):
         {"id": trip_id},
         {"$set": {"status": "cancelled", "cancelled_by": cancelled_by, "cancelled_at": datetime.utcnow()}}
     )
+    pending_trip_grid.remove(trip_id)
+    await unread_counters.clear_scope(trip_scope(trip_id))
+    safety_monitor.forget(trip_id)
+    await publish_event(f"trip:{trip_id}", trip_status_event(
+        {**trip, "status": "cancelled"}, cancelled_by=cancelled_by
+    ))
     
     # Update behavior score and streak
     if cancelled_by == trip.get("driver_id"):
@@ -3105,6 +3726,8 @@ async def rate_trip(trip_id: str, rater_id: str, request: ComfortRatingRequest):
                         )
     
     await db.trips.update_one({"id": trip_id}, {"$set": update_data})
+    if is_rider_rating:
+        await driver_leaderboards.record_rating(trip, request.overall_rating)
     
     # Update user rating
     if rated_user_id:
@@ -3180,6 +3803,11 @@ async def trigger_sos(request: SOSRequest):
         {"id": request.trip_id},
         {"$set": {"sos_triggered": True, "sos_triggered_at": datetime.utcnow()}}
     )
+    await publish_event(f"trip:{request.trip_id}", {
+        "type": "sos",
+        "trip_id": request.trip_id,
+        "at": datetime.utcnow().isoformat()
+    })
     
     # ENHANCED: Send REAL SMS to emergency contacts via Termii
     contacts_successfully_notified = 0
@@ -3187,42 +3815,43 @@ async def trigger_sos(request: SOSRequest):
         # Create Google Maps link for location
         location_link = f"https://maps.google.com/?q={request.location_lat},{request.location_lng}"
         
-        async with httpx.AsyncClient() as http_client:
-            for contact in emergency_contacts:
-                try:
-                    # Format phone number (remove + for Termii)
-                    contact_phone = contact["phone"].lstrip('+')
-                    
-                    # Craft urgent SOS message
-                    sms_text = (
-                        f"🚨 EMERGENCY! {user_name} triggered SOS on NexRyde! "
-                        f"Location: {location_link} "
-                        f"Trip ID: {request.trip_id}. Please check on them immediately!"
-                    )
-                    
-                    payload = {
-                        "api_key": TERMII_API_KEY,
-                        "to": contact_phone,
-                        "from": TERMII_FROM_ID or "NexRyde",
-                        "channel": "dnd",
-                        "type": "plain",
-                        "sms": sms_text
-                    }
-                    
-                    response = await http_client.post(
-                        f"{TERMII_BASE_URL}/api/sms/send",
-                        json=payload,
-                        timeout=10.0
-                    )
+        for contact in emergency_contacts:
+            try:
+                # Format phone number (remove + for Termii)
+                contact_phone = contact["phone"].lstrip('+')
+                
+                # Craft urgent SOS message
+                sms_text = (
+                    f"🚨 EMERGENCY! {user_name} triggered SOS on NexRyde! "
+                    f"Location: {location_link} "
+                    f"Trip ID: {request.trip_id}. Please check on them immediately!"
+                )
+                
+                payload = {
+                    "api_key": TERMII_API_KEY,
+                    "to": contact_phone,
+                    "from": TERMII_FROM_ID or "NexRyde",
+                    "channel": "dnd",
+                    "type": "plain",
+                    "sms": sms_text
+                }
+                
+                # SOS keeps a tighter timeout than the Termii default
+                response = await upstream_clients.post(
+                    "termii",
+                    f"{TERMII_BASE_URL}/api/sms/send",
+                    json=payload,
+                    timeout=10.0
+                )
+                
+                if response.status_code == 200:
+                    contacts_successfully_notified += 1
+                    logger.info(f"✅ SOS SMS sent to {contact['name']} ({contact_phone})")
+                else:
+                    logger.error(f"❌ Failed to send SOS SMS to {contact_phone}: {response.text}")
                     
-                    if response.status_code == 200:
-                        contacts_successfully_notified += 1
-                        logger.info(f"✅ SOS SMS sent to {contact['name']} ({contact_phone})")
-                    else:
-                        logger.error(f"❌ Failed to send SOS SMS to {contact_phone}: {response.text}")
-                        
-                except Exception as e:
-                    logger.error(f"❌ Error sending SOS SMS to {contact.get('name', 'contact')}: {e}")
+            except Exception as e:
+                logger.error(f"❌ Error sending SOS SMS to {contact.get('name', 'contact')}: {e}")
     
     # Log critical alert
     logger.critical(f"🚨 SOS TRIGGERED for trip {request.trip_id} by {user_name} at {request.location_lat}, {request.location_lng}")
@@ -3939,7 +4568,10 @@ async def send_chat_message(request: ChatMessageRequest):
             "created_at": datetime.utcnow()
         }
         
-        await db.trip_messages.insert_one(message)
+        await chat_persister.persist_now(message)
+        recipient_id = trip.get("driver_id") if request.sender_id == trip["rider_id"] else trip["rider_id"]
+        if recipient_id:
+            unread_counters.incr(recipient_id, trip_scope(request.trip_id))
         
         # Update trip with latest message timestamp
         await db.trips.update_one(
@@ -3960,45 +4592,80 @@ async def send_chat_message(request: ChatMessageRequest):
         raise HTTPException(status_code=500, detail="Failed to send message")
 
 @api_router.get("/chat/messages/{trip_id}")
-async def get_trip_messages(trip_id: str, user_id: str, limit: int = 50, since: Optional[str] = None):
-    """Get messages for a trip (polling endpoint for real-time updates)"""
+async def get_trip_messages(
+    trip_id: str,
+    user_id: str,
+    limit: int = 50,
+    since: Optional[str] = None,
+    cursor: Optional[str] = None
+):
+    """
+    Get messages for a trip (polling endpoint for real-time updates).
+    Pass the returned `next_cursor` as `cursor` to get only newer messages;
+    `since` (ISO timestamp) is still accepted.
+    """
     try:
-        trip = await db.trips.find_one({"id": trip_id})
+        trip = await db.trips.find_one({"id": trip_id}, {"_id": 0, "rider_id": 1, "driver_id": 1})
         if not trip:
             raise HTTPException(status_code=404, detail="Trip not found")
         
-        # Build query
-        query = {"trip_id": trip_id}
-        if since:
+        after_seq = 0
+        if cursor:
             try:
-                since_dt = datetime.fromisoformat(since.replace('Z', '+00:00'))
-                query["created_at"] = {"$gt": since_dt}
-            except:
+                after_seq = await decode_chat_cursor(trip_id, cursor)
+            except ValueError:
+                raise HTTPException(status_code=400, detail="Invalid cursor")
+        elif since:
+            try:
+                since_dt = datetime.fromisoformat(since.replace('Z', '+00:00')).replace(tzinfo=None)
+                # "\uffff" sorts after every real id at since_dt, so this means "after since_dt"
+                after_seq = await chat_seq_at(trip_id, (since_dt, "\uffff"))
+            except ValueError:
                 pass
         
-        messages = await db.trip_messages.find(query).sort("created_at", 1).limit(limit).to_list(limit)
+        messages, next_cursor, has_more = await load_chat_page(trip_id, after_seq, limit=limit)
         
-        # Mark messages as read for this user
-        other_role = "driver" if trip["rider_id"] == user_id else "rider"
-        await db.trip_messages.update_many(
-            {"trip_id": trip_id, "sender_role": other_role, "is_read": False},
-            {"$set": {"is_read": True}}
-        )
+        # is_read follows the recipient's marker as it was before this poll
+        other_id = trip.get("driver_id") if trip["rider_id"] == user_id else trip["rider_id"]
+        my_read_at = await chat_persister.read_marker(trip_id, user_id)
+        other_read_at = await chat_persister.read_marker(trip_id, other_id) if other_id else None
+        
+        # Reading advances this user's marker (up to the last message returned) instead of updating every message
+        sent_at = [t for t in (message_time(m) for m in messages) if t]
+        if sent_at:
+            chat_persister.mark_read(trip_id, user_id, max(sent_at))
+        if has_more:
+            newly_read = 0
+            for m in messages:
+                t = message_time(m)
+                if m.get("sender_id") != user_id and t and not (my_read_at and t <= my_read_at):
+                    newly_read += 1
+            unread_counters.decr(user_id, trip_scope(trip_id), newly_read)
+        else:
+            unread_counters.reset(user_id, trip_scope(trip_id))
+        
+        def read_by_recipient(msg: dict) -> bool:
+            read_at = other_read_at if msg.get("sender_id") == user_id else my_read_at
+            sent = message_time(msg)
+            return bool(msg.get("is_read") or (read_at and sent and sent <= read_at))
         
         return {
             "messages": [
                 {
                     "id": msg["id"],
                     "sender_id": msg["sender_id"],
-                    "sender_role": msg["sender_role"],
-                    "message": msg["message"],
-                    "message_type": msg["message_type"],
-                    "is_read": msg["is_read"],
-                    "timestamp": msg["created_at"].isoformat()
+                    "sender_role": msg.get("sender_role"),
+                    "message": msg.get("message", ""),
+                    "message_type": msg.get("message_type", "text"),
+                    "is_read": read_by_recipient(msg),
+                    "timestamp": msg["created_at"].isoformat() if msg.get("created_at") else msg.get("timestamp"),
+                    "cursor": chat_cursor_for(msg)
                 }
                 for msg in messages
             ],
-            "trip_id": trip_id
+            "trip_id": trip_id,
+            "next_cursor": next_cursor,
+            "has_more": has_more
         }
         
     except HTTPException:
@@ -4011,29 +4678,9 @@ async def get_trip_messages(trip_id: str, user_id: str, limit: int = 50, since:
 async def get_unread_count(user_id: str):
     """Get unread message count for a user"""
     try:
-        # Find active trips for user
-        active_trips = await db.trips.find({
-            "$or": [
-                {"rider_id": user_id},
-                {"driver_id": user_id}
-            ],
-            "status": {"$in": ["accepted", "ongoing"]}
-        }).to_list(100)
-        
-        total_unread = 0
-        for trip in active_trips:
-            # Determine user's role in this trip
-            is_rider = trip["rider_id"] == user_id
-            other_role = "driver" if is_rider else "rider"
-            
-            count = await db.trip_messages.count_documents({
-                "trip_id": trip["id"],
-                "sender_role": other_role,
-                "is_read": False
-            })
-            total_unread += count
-        
-        return {"unread_count": total_unread}
+        # Counters are cleared when a trip completes or is cancelled, so only active trips remain
+        counts = await unread_counters.totals(user_id, prefix=TRIP_SCOPE_PREFIX)
+        return {"unread_count": sum(counts.values())}
         
     except Exception as e:
         logger.error(f"Get unread count error: {e}")
@@ -4069,116 +4716,195 @@ async def get_preset_messages(role: str):
 
 # ==================== WEBSOCKET CHAT ====================
 
-class ConnectionManager:
-    """Manages WebSocket connections for real-time chat"""
-    def __init__(self):
-        # Store active connections by trip_id
-        self.active_connections: Dict[str, Set[WebSocket]] = {}
-        # Store user to websocket mapping
-        self.user_connections: Dict[str, WebSocket] = {}
-    
-    async def connect(self, websocket: WebSocket, trip_id: str, user_id: str):
-        await websocket.accept()
-        if trip_id not in self.active_connections:
-            self.active_connections[trip_id] = set()
-        self.active_connections[trip_id].add(websocket)
-        self.user_connections[user_id] = websocket
-        logger.info(f"WebSocket connected: user={user_id}, trip={trip_id}")
-    
-    def disconnect(self, websocket: WebSocket, trip_id: str, user_id: str):
-        if trip_id in self.active_connections:
-            self.active_connections[trip_id].discard(websocket)
-            if not self.active_connections[trip_id]:
-                del self.active_connections[trip_id]
-        if user_id in self.user_connections:
-            del self.user_connections[user_id]
-        logger.info(f"WebSocket disconnected: user={user_id}, trip={trip_id}")
-    
-    async def send_personal_message(self, message: dict, websocket: WebSocket):
-        try:
-            await websocket.send_json(message)
-        except Exception as e:
-            logger.error(f"Error sending message: {e}")
+# Global connection manager; the Mongo bus lets sockets on different workers reach each other
+chat_manager = ConnectionManager(bus=realtime_bus)
+
+# Chat messages are broadcast first and persisted in micro-batches
+chat_persister = ChatPersister(db)
+
+# Messages per history page (REST default is 50)
+CHAT_PAGE_SIZE = 100
+
+def chat_cursor_for(message: dict) -> Optional[str]:
+    """Sequence cursor once the message is stored; (created_at, id) cursor for a live one"""
+    if message.get("seq") is not None:
+        return encode_seq_cursor(message["seq"])
+    return cursor_for(message)
+
+def chat_message_to_wire(message: dict, recipient_read_at: Optional[datetime] = None) -> dict:
+    """JSON-safe chat message; is_read follows the recipient's read marker"""
+    wire = {k: v for k, v in message.items() if k not in ("_id", "created_at", "sequenced_at")}
+    created_at = message.get("created_at")
+    if isinstance(created_at, datetime):
+        wire["timestamp"] = created_at.isoformat()
+    cursor = chat_cursor_for(message)
+    if cursor:
+        wire["cursor"] = cursor
+    sent_at = message_time(message)
+    if recipient_read_at and sent_at and sent_at <= recipient_read_at:
+        wire["is_read"] = True
+    return wire
+
+async def chat_seq_at(trip_id: str, after: tuple) -> int:
+    """
+    Sequence number to resume from for a (created_at, id) position: just
+    before the first stored message past it, or the current end when none
+    is. Messages that land later get higher numbers, so none are skipped.
+    """
+    await chat_persister.ensure_sequence(trip_id)
+    query = {"trip_id": trip_id, "seq": {"$exists": True}, **keyset_filter(after)}
+    first = await db.trip_messages.find(query, {"_id": 0, "seq": 1}).sort("seq", 1).limit(1).to_list(1)
+    if first:
+        return first[0]["seq"] - 1
+    last = await db.trip_messages.find(
+        {"trip_id": trip_id, "seq": {"$exists": True}}, {"_id": 0, "seq": 1}
+    ).sort("seq", -1).limit(1).to_list(1)
+    return last[0]["seq"] if last else 0
+
+async def decode_chat_cursor(trip_id: str, token: str) -> int:
+    """Sequence number behind a chat cursor; (created_at, id) cursors are translated. Raises ValueError."""
+    try:
+        return decode_seq_cursor(token)
+    except ValueError:
+        return await chat_seq_at(trip_id, decode_cursor(token))
+
+async def load_chat_page(
+    trip_id: str,
+    after_seq: int = 0,
+    limit: int = CHAT_PAGE_SIZE,
+    include_pending: bool = False
+) -> tuple:
+    """
+    One page of a trip's chat in sequence order, strictly after `after_seq`.
+    Returns (messages, next_cursor, has_more).
     
-    async def broadcast_to_trip(self, message: dict, trip_id: str, exclude_user: str = None):
-        """Broadcast message to all users in a trip"""
-        if trip_id not in self.active_connections:
-            return
-        
-        for connection in self.active_connections[trip_id]:
-            try:
-                # Get user_id for this connection
-                user_id = None
-                for uid, ws in self.user_connections.items():
-                    if ws == connection:
-                        user_id = uid
-                        break
-                
-                if exclude_user and user_id == exclude_user:
-                    continue
-                    
-                await connection.send_json(message)
-            except Exception as e:
-                logger.error(f"Error broadcasting: {e}")
-
-# Global connection manager
-chat_manager = ConnectionManager()
+    The page stops at a missing number, since that message is still being
+    flushed by some worker; next_cursor stays before it so the next page
+    picks it up. A number missing for longer than
+    SEQUENCE_GAP_TIMEOUT_SECONDS is taken as lost and stepped over.
+    """
+    await chat_persister.ensure_sequence(trip_id)
+    stored = await db.trip_messages.find(
+        {"trip_id": trip_id, "seq": {"$gt": after_seq}}, {"_id": 0}
+    ).sort("seq", 1).limit(limit + 1).to_list(limit + 1)
+    
+    gap_cutoff = datetime.utcnow() - timedelta(seconds=ChatPersistConfig.SEQUENCE_GAP_TIMEOUT_SECONDS)
+    messages = []
+    last_seq = after_seq
+    for message in stored:
+        if message["seq"] != last_seq + 1 and message.get("sequenced_at", datetime.min) > gap_cutoff:
+            break
+        messages.append(message)
+        last_seq = message["seq"]
+    has_more = len(messages) > limit
+    messages = messages[:limit]
+    next_cursor = encode_seq_cursor(messages[-1]["seq"] if messages else after_seq)
+    
+    if include_pending and not has_more:
+        # Same-worker messages still waiting in the write-behind queue; shown now,
+        # and returned again (same id) by the page after they are stored
+        seen = {m["id"] for m in messages}
+        for pending in chat_persister.pending_for_trip(trip_id):
+            if pending["id"] in seen or pending.get("seq", after_seq + 1) <= after_seq:
+                continue
+            messages.append({k: v for k, v in pending.items() if k != "_id"})
+    return messages, next_cursor, has_more
 
 @app.websocket("/ws/chat/{trip_id}/{user_id}")
-async def websocket_chat(websocket: WebSocket, trip_id: str, user_id: str):
-    """WebSocket endpoint for real-time driver-rider chat"""
-    await chat_manager.connect(websocket, trip_id, user_id)
+async def websocket_chat(websocket: WebSocket, trip_id: str, user_id: str, cursor: Optional[str] = None):
+    """
+    WebSocket endpoint for real-time driver-rider chat.
+    
+    Resume protocol: a reconnecting client passes the `next_cursor` of the
+    last history frame, or the `cursor` of the last message it saw
+    (?cursor=...), and gets only newer messages in the history frame.
+    While `has_more` is true it sends {"type": "sync", "cursor":
+    next_cursor} for the next page. Pages follow each trip's sequence
+    numbers, so messages flushed late by another worker still arrive.
+    Messages carry `id`, so clients drop any duplicate of a live or
+    pending message that also lands in a page.
+    """
+    # Resolve identity and trip membership once; messages are built from the cached connection
+    trip = await db.trips.find_one({"id": trip_id}, {"_id": 0, "rider_id": 1, "driver_id": 1})
+    if not trip or user_id not in (trip.get("rider_id"), trip.get("driver_id")):
+        await websocket.close(code=1008)
+        return
+    user = await db.users.find_one({"id": user_id}, {"name": 1, "_id": 0}) or {}
+    is_rider = trip["rider_id"] == user_id
+    connection = await chat_manager.connect(
+        websocket, trip_id, user_id,
+        user_name=user.get("name") or "User",
+        role="rider" if is_rider else "driver",
+        other_party_id=trip.get("driver_id") if is_rider else trip["rider_id"]
+    )
     
     try:
         # Send connection confirmation
-        await websocket.send_json({
+        await chat_manager.send_personal_message({
             "type": "connected",
             "trip_id": trip_id,
             "user_id": user_id,
             "message": "Connected to chat"
-        })
-        
-        # Load existing messages
-        messages = await db.trip_messages.find(
-            {"trip_id": trip_id},
-            {"_id": 0}
-        ).sort("timestamp", 1).to_list(100)
+        }, websocket)
         
-        if messages:
-            await websocket.send_json({
+        async def send_history_page(page_cursor: Optional[str]):
+            try:
+                after_seq = await decode_chat_cursor(trip_id, page_cursor) if page_cursor else 0
+            except ValueError:
+                await chat_manager.send_personal_message({"type": "error", "message": "Invalid cursor"}, websocket)
+                return
+            messages, next_cursor, has_more = await load_chat_page(trip_id, after_seq, include_pending=True)
+            my_read_at = await chat_persister.read_marker(trip_id, user_id)
+            other_read_at = (
+                await chat_persister.read_marker(trip_id, connection.other_party_id)
+                if connection.other_party_id else None
+            )
+            await chat_manager.send_personal_message({
                 "type": "history",
-                "messages": messages
-            })
+                "messages": [
+                    chat_message_to_wire(m, other_read_at if m.get("sender_id") == user_id else my_read_at)
+                    for m in messages
+                ],
+                "next_cursor": next_cursor,
+                "has_more": has_more
+            }, websocket)
+        
+        # Full history from the start, or only the delta since the client's cursor
+        await send_history_page(cursor)
         
         while True:
             # Wait for messages from this client
             data = await websocket.receive_json()
             
-            if data.get("type") == "message":
-                # Get user info
-                user = await db.users.find_one({"id": user_id}, {"name": 1, "role": 1, "_id": 0})
-                
+            if data.get("type") == "sync":
+                await send_history_page(data.get("cursor"))
+            
+            elif data.get("type") == "message":
                 # Create message document
                 message_doc = {
                     "id": str(uuid.uuid4()),
                     "trip_id": trip_id,
                     "sender_id": user_id,
-                    "sender_name": user.get("name", "User") if user else "User",
-                    "sender_role": data.get("sender_role", user.get("role", "rider") if user else "rider"),
+                    "sender_name": connection.user_name,
+                    "sender_role": connection.role,
                     "message": data.get("message", ""),
                     "message_type": data.get("message_type", "text"),
-                    "timestamp": datetime.utcnow().isoformat(),
-                    "is_read": False
+                    "is_read": False,
+                    "created_at": mongo_utcnow()
                 }
                 
-                # Save to database
-                await db.trip_messages.insert_one(message_doc)
-                
-                # Broadcast to all users in trip
+                # Broadcast to all users in trip, then persist in the background
                 await chat_manager.broadcast_to_trip({
                     "type": "new_message",
-                    **message_doc
+                    **chat_message_to_wire(message_doc)
                 }, trip_id)
+                await chat_persister.submit(message_doc)
+                if connection.other_party_id is None:
+                    # Rider joined before a driver was assigned
+                    current = await db.trips.find_one({"id": trip_id}, {"_id": 0, "driver_id": 1}) or {}
+                    connection.other_party_id = current.get("driver_id")
+                if connection.other_party_id:
+                    unread_counters.incr(connection.other_party_id, trip_scope(trip_id))
                 
             elif data.get("type") == "typing":
                 # Broadcast typing indicator
@@ -4189,14 +4915,14 @@ async def websocket_chat(websocket: WebSocket, trip_id: str, user_id: str):
                 }, trip_id, exclude_user=user_id)
                 
             elif data.get("type") == "read":
-                # Mark messages as read
-                await db.trip_messages.update_many(
-                    {"trip_id": trip_id, "sender_id": {"$ne": user_id}},
-                    {"$set": {"is_read": True}}
-                )
+                # Advance this user's read marker instead of flipping every message
+                read_at = datetime.utcnow()
+                chat_persister.mark_read(trip_id, user_id, read_at)
+                unread_counters.reset(user_id, trip_scope(trip_id))
                 await chat_manager.broadcast_to_trip({
                     "type": "messages_read",
-                    "user_id": user_id
+                    "user_id": user_id,
+                    "read_at": read_at.isoformat()
                 }, trip_id, exclude_user=user_id)
                 
     except WebSocketDisconnect:
@@ -4329,10 +5055,13 @@ async def accept_driver_offer(bid_id: str, rider_id: str, offer_id: str):
         "dropoff": bid["dropoff"],
         "fare": accepted_offer["counter_price"],
         "ride_type": bid["ride_type"],
+        "city": DEFAULT_CITY,
         "status": "accepted",
         "created_at": datetime.utcnow()
     }
     await db.trips.insert_one(trip)
+    await platform_stats.record_trip_created()
+    await publish_event(f"trip:{trip['id']}", trip_status_event(trip))
     
     return {"success": True, "trip_id": trip["id"], "agreed_price": accepted_offer["counter_price"]}
 
@@ -4451,10 +5180,12 @@ async def request_female_driver(rider_id: str, pickup_lat: float, pickup_lng: fl
         "dropoff": {"lat": dropoff_lat, "lng": dropoff_lng, "address": dropoff_address},
         "ride_type": "female_only",
         "female_driver_only": True,
+        "city": DEFAULT_CITY,
         "status": "pending",
         "created_at": datetime.utcnow()
     }
     await db.trips.insert_one(trip)
+    await platform_stats.record_trip_created()
     return {"trip_id": trip["id"], "message": "Looking for female drivers..."}
 
 # ==================== DRIVER HEAT MAPS ====================
@@ -4744,17 +5475,22 @@ async def book_for_family_member(
         "is_family_booking": True,
         "pickup_location": {"lat": pickup_lat, "lng": pickup_lng, "address": pickup_address},
         "dropoff_location": {"lat": dropoff_lat, "lng": dropoff_lng, "address": dropoff_address},
+        "pickup_point": to_geojson_point(pickup_lat, pickup_lng),
+        "city": DEFAULT_CITY,
         "status": "pending",
         "created_at": datetime.utcnow(),
         "fare": 0  # Will be calculated
     }
     
     await db.trips.insert_one(trip)
+    await platform_stats.record_trip_created()
+    track_pending_trip(trip)
+    await announce_pending_trip(trip)
     
     # Notify all family members (Safety Circle)
     for m in family["members"]:
         if m["user_id"] != booker_id:
-            await db.notifications.insert_one({
+            await insert_notification({
                 "user_id": m["user_id"],
                 "type": "family_trip_booked",
                 "title": f"Family Trip Alert",
@@ -4782,7 +5518,7 @@ async def trigger_family_safety_alert(family_id: str, member_id: str, location_l
     # Notify all family members
     for m in family["members"]:
         if m["user_id"] != member_id:
-            await db.notifications.insert_one({
+            await insert_notification({
                 "user_id": m["user_id"],
                 "type": "safety_circle_alert",
                 "title": "⚠️ SAFETY ALERT",
@@ -4886,27 +5622,31 @@ async def verify_gender(user_id: str, gender: str):
 @api_router.get("/drivers/available-female")
 async def get_available_female_drivers(lat: float, lng: float, radius_km: float = 5.0):
     """Get available female drivers for women-only rides"""
-    # In production, this would use geospatial queries
+    nearby = await nearest_available_drivers(lat, lng, radius_km=radius_km, limit=MATCH_CANDIDATE_LIMIT * 2)
+    profiles = {p["user_id"]: p for p in nearby}
+    
     female_drivers = await db.users.find({
+        "id": {"$in": list(profiles.keys())},
         "role": "driver",
         "gender": "female",
         "is_verified": True
-    }).to_list(20)
+    }).to_list(len(profiles))
     
     available = []
     for driver in female_drivers:
-        profile = await db.driver_profiles.find_one({"user_id": driver["id"]})
-        if profile and profile.get("is_online"):
-            available.append({
-                "driver_id": driver["id"],
-                "name": driver.get("name", "Driver"),
-                "rating": driver.get("rating", 5.0),
-                "total_trips": driver.get("total_trips", 0),
-                "vehicle": profile.get("vehicle_model"),
-                "plate": profile.get("plate_number")
-            })
+        profile = profiles[driver["id"]]
+        available.append({
+            "driver_id": driver["id"],
+            "name": driver.get("name", "Driver"),
+            "rating": driver.get("rating", 5.0),
+            "total_trips": driver.get("total_trips", 0),
+            "vehicle": profile.get("vehicle_model"),
+            "plate": profile.get("vehicle_plate"),
+            "distance_km": round(profile["distance_km"], 2)
+        })
     
-    return {"female_drivers": available, "count": len(available)}
+    available.sort(key=lambda x: x["distance_km"])
+    return {"female_drivers": available[:20], "count": len(available[:20])}
 
 # ==================== EARNINGS PREDICTOR AI ====================
 
@@ -5039,77 +5779,24 @@ async def update_drive_time(user_id: str, hours: float):
 # ==================== LEADERBOARD ====================
 
 @api_router.get("/leaderboard/drivers")
-async def get_driver_leaderboard(city: str = "lagos", period: str = "weekly"):
-    """Get driver leaderboard"""
-    # Calculate date range
-    if period == "daily":
-        start_date = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
-    elif period == "weekly":
-        start_date = datetime.utcnow() - timedelta(days=7)
-    else:  # monthly
-        start_date = datetime.utcnow() - timedelta(days=30)
-    
-    # Get top earners
-    pipeline = [
-        {"$match": {"status": "completed", "completed_at": {"$gte": start_date}}},
-        {"$group": {
-            "_id": "$driver_id",
-            "total_earnings": {"$sum": "$fare"},
-            "trip_count": {"$sum": 1},
-            "avg_rating": {"$avg": "$driver_rating"}
-        }},
-        {"$sort": {"total_earnings": -1}},
-        {"$limit": 20}
-    ]
-    
-    earnings_leaders = await db.trips.aggregate(pipeline).to_list(20)
-    
-    # Enrich with driver details
-    leaderboard = []
-    for rank, leader in enumerate(earnings_leaders, 1):
-        if leader["_id"]:
-            user = await db.users.find_one({"id": leader["_id"]})
-            if user:
-                leaderboard.append({
-                    "rank": rank,
-                    "driver_id": leader["_id"],
-                    "name": user.get("name", "Anonymous")[:10] + "..." if user.get("name") else "Anonymous",
-                    "earnings": leader["total_earnings"],
-                    "trips": leader["trip_count"],
-                    "rating": round(leader["avg_rating"] or 5.0, 1)
-                })
-    
-    return {"period": period, "city": city, "leaderboard": leaderboard}
+async def get_driver_leaderboard(city: str = "lagos", period: str = "weekly", limit: int = 20):
+    """Get driver leaderboard for a city (or "all"), served from the cached rankings"""
+    if period not in PERIOD_DAYS:
+        period = "monthly"
+    limit = max(1, min(limit, LEADERBOARD_SIZE))
+    leaderboard = await driver_leaderboards.leaderboard(period, city, limit)
+    return {
+        "period": period,
+        "city": city,
+        "leaderboard": leaderboard,
+        "updated_at": driver_leaderboards.built_at
+    }
 
 @api_router.get("/leaderboard/top-rated")
 async def get_top_rated_drivers(limit: int = 20):
     """Get top rated drivers"""
-    pipeline = [
-        {"$match": {"role": "driver", "rating": {"$exists": True}}},
-        {"$sort": {"rating": -1, "total_trips": -1}},
-        {"$limit": limit}
-    ]
-    
-    top_drivers = await db.users.aggregate(pipeline).to_list(limit)
-    
-    result = []
-    for rank, driver in enumerate(top_drivers, 1):
-        profile = await db.driver_profiles.find_one({"user_id": driver["id"]})
-        result.append({
-            "rank": rank,
-            "driver_id": driver["id"],
-            "name": (driver.get("name", "Anonymous")[:10] + "...") if driver.get("name") else "Anonymous",
-            "rating": driver.get("rating", 5.0),
-            "total_trips": driver.get("total_trips", 0),
-            "comfort_scores": {
-                "smoothness": profile.get("smoothness_rating", 5.0) if profile else 5.0,
-                "politeness": profile.get("politeness_rating", 5.0) if profile else 5.0,
-                "cleanliness": profile.get("cleanliness_rating", 5.0) if profile else 5.0,
-                "safety": profile.get("safety_rating", 5.0) if profile else 5.0,
-            }
-        })
-    
-    return {"top_rated_drivers": result}
+    limit = max(1, min(limit, LEADERBOARD_SIZE))
+    return {"top_rated_drivers": await driver_leaderboards.top_rated_drivers(limit)}
 
 # ==================== TRIP SHARING (Family & Friends) ====================
 
@@ -5134,6 +5821,7 @@ async def share_trip(trip_id: str, recipient_phone: str, recipient_name: str = "
     }
     
     await db.trip_shares.insert_one(share_info)
+    shared_trips.remember(share_token, trip_id, share_info["expires_at"])
     
     # In production: Send SMS with tracking link
     tracking_link = f"https://koda.app/track/{share_token}"
@@ -5144,36 +5832,72 @@ async def share_trip(trip_id: str, recipient_phone: str, recipient_name: str = "
         "tracking_link": tracking_link
     }
 
-@api_router.get("/trips/track/{share_token}")
-async def track_shared_trip(share_token: str):
-    """Track a shared trip (for family/friends)"""
-    share = await db.trip_shares.find_one({"token": share_token})
-    if not share:
-        raise HTTPException(status_code=404, detail="Invalid tracking link")
-    
-    if datetime.utcnow() > share["expires_at"]:
-        raise HTTPException(status_code=400, detail="Tracking link has expired")
+async def load_shared_trip(share_token: str) -> Optional[tuple]:
+    """
+    (expires_at, tracking view) for a share link, or None if the link or
+    trip does not exist. The hub answers repeat lookups from memory; only
+    the first lookup of a link on this worker reads MongoDB.
+    """
+    view = shared_trips.view(share_token)
+    if view is not None:
+        return shared_trips.resolve(share_token)[1], view
     
-    trip = await db.trips.find_one({"id": share["trip_id"]})
+    share = await db.trip_shares.find_one({"token": share_token}, {"_id": 0, "trip_id": 1, "expires_at": 1})
+    if not share:
+        return None
+    trip = await db.trips.find_one({"id": share["trip_id"]}, {
+        "_id": 0, "id": 1, "status": 1, "driver_id": 1, "pickup_location": 1, "dropoff_location": 1,
+        "fare": 1, "sos_triggered": 1, "route_summary.last_point": 1
+    })
     if not trip:
-        raise HTTPException(status_code=404, detail="Trip not found")
+        return None
     
-    # Get driver location
-    driver_location = None
-    if trip.get("driver_id"):
-        profile = await db.driver_profiles.find_one({"user_id": trip["driver_id"]})
-        driver_location = profile.get("current_location") if profile else None
+    # Driver location: in-trip GPS, else this worker's live grid, else the stored profile
+    driver_location = trip_location_event(trip["id"], (trip.get("route_summary") or {}).get("last_point"))
+    if driver_location:
+        driver_location = {k: driver_location[k] for k in ("lat", "lng", "timestamp")}
+    elif trip.get("driver_id"):
+        position = driver_grid.get(trip["driver_id"])
+        if position:
+            driver_location = {"lat": position[0], "lng": position[1]}
+        else:
+            profile = await db.driver_profiles.find_one({"user_id": trip["driver_id"]}, {"_id": 0, "current_location": 1})
+            driver_location = profile.get("current_location") if profile else None
     
-    return {
+    view = {
         "trip_id": trip["id"],
         "status": trip["status"],
+        "driver_id": trip.get("driver_id"),
         "pickup": trip["pickup_location"],
         "dropoff": trip["dropoff_location"],
         "driver_location": driver_location,
-        "rider_name": "Rider",  # Don't expose full name for privacy
         "fare": trip["fare"],
         "sos_triggered": trip.get("sos_triggered", False)
     }
+    shared_trips.remember(share_token, trip["id"], share["expires_at"], view)
+    return share["expires_at"], view
+
+@api_router.get("/trips/track/{share_token}")
+async def track_shared_trip(share_token: str):
+    """Track a shared trip (for family/friends); live updates are on /ws/events share:<token>"""
+    shared = await load_shared_trip(share_token)
+    if not shared:
+        raise HTTPException(status_code=404, detail="Invalid tracking link")
+    
+    expires_at, view = shared
+    if datetime.utcnow() > expires_at:
+        raise HTTPException(status_code=400, detail="Tracking link has expired")
+    
+    return {
+        "trip_id": view["trip_id"],
+        "status": view["status"],
+        "pickup": view["pickup"],
+        "dropoff": view["dropoff"],
+        "driver_location": view["driver_location"],
+        "rider_name": "Rider",  # Don't expose full name for privacy
+        "fare": view["fare"],
+        "sos_triggered": view["sos_triggered"]
+    }
 
 # ==================== FRAUD DETECTION ====================
 
@@ -5665,54 +6389,16 @@ async def get_fare_breakdown(trip_id: str):
 @api_router.post("/trips/{trip_id}/track")
 async def update_trip_tracking(trip_id: str, update: TripTrackingUpdate):
     """Update trip tracking data (speed, location)"""
-    tracking = await db.trip_tracking.find_one({"trip_id": trip_id})
-    
-    speed_log = {
-        "timestamp": update.timestamp.isoformat(),
-        "speed_kmh": update.speed_kmh,
-        "location": {"lat": update.latitude, "lng": update.longitude}
+    point = {
+        "lat": update.latitude,
+        "lng": update.longitude,
+        "timestamp": as_naive_utc(update.timestamp),
+        "speed_kmh": update.speed_kmh
     }
-    
-    if not tracking:
-        tracking = {
-            "id": str(uuid.uuid4()),
-            "trip_id": trip_id,
-            "speed_logs": [speed_log],
-            "traffic_delays": [],
-            "weather_conditions": [],
-            "route_deviations": [],
-            "stationary_periods": [],
-            "created_at": datetime.utcnow()
-        }
-        await db.trip_tracking.insert_one(tracking)
-    else:
-        # Detect traffic (speed < 10 km/h for extended period)
-        speed_logs = tracking.get("speed_logs", [])
-        if len(speed_logs) >= 5:
-            recent_speeds = [log["speed_kmh"] for log in speed_logs[-5:]]
-            avg_speed = sum(recent_speeds) / len(recent_speeds)
-            
-            if avg_speed < 10 and update.speed_kmh < 10:
-                # Traffic detected
-                traffic_delays = tracking.get("traffic_delays", [])
-                if traffic_delays and not traffic_delays[-1].get("end"):
-                    # Continue existing delay
-                    pass
-                else:
-                    # New delay
-                    traffic_delays.append({
-                        "start": datetime.utcnow().isoformat(),
-                        "location": {"lat": update.latitude, "lng": update.longitude}
-                    })
-                    await db.trip_tracking.update_one(
-                        {"trip_id": trip_id},
-                        {"$set": {"traffic_delays": traffic_delays}}
-                    )
-        
-        await db.trip_tracking.update_one(
-            {"trip_id": trip_id},
-            {"$push": {"speed_logs": speed_log}}
-        )
+    # Traffic is detected from the trip's rolling speed window, not by re-reading speed_logs
+    anomalies = await safety_monitor.observe(trip_id, [point], speed_only=True)
+    new_delays, close_open_at = traffic_delay_changes(anomalies)
+    await trip_telemetry.record_speeds(trip_id, [point], new_delays, close_open_at)
     
     return {"message": "Tracking updated", "trip_id": trip_id}
 
@@ -6109,36 +6795,42 @@ async def find_best_matched_driver(rider_id: str, pickup_lat: float, pickup_lng:
     rider_prefs = await db.rider_preferences.find_one({"user_id": rider_id})
     rider = await db.users.find_one({"id": rider_id})
     
-    # Get available drivers
-    available_drivers = await db.driver_profiles.find({
-        "is_online": True,
-        "current_location": {"$ne": None}
-    }).to_list(50)
+    # Get the nearest online drivers around the pickup (in-memory grid)
+    available_drivers = await nearest_available_drivers(
+        pickup_lat, pickup_lng,
+        radius_km=MATCH_RADIUS_KM,
+        limit=MATCH_CANDIDATE_LIMIT
+    )
     
     if not available_drivers:
         return {"matched_driver": None, "message": "No drivers available"}
     
+    driver_ids = [d.get("user_id") for d in available_drivers]
+    driver_users = {
+        u["id"]: u for u in await db.users.find({"id": {"$in": driver_ids}}).to_list(len(driver_ids))
+    }
+    driver_tiers = {
+        t["driver_id"]: t for t in await db.driver_tiers.find({"driver_id": {"$in": driver_ids}}).to_list(len(driver_ids))
+    }
+    
+    # Drivers holding a dispatcher offer for another trip
+    reserved = await trip_dispatcher.reserved_drivers(driver_ids)
+    
     scored_drivers = []
     
     for driver in available_drivers:
-        driver_location = driver.get("current_location", {})
-        if not driver_location:
-            continue
+        distance = driver["distance_km"]
         
-        # Calculate distance
-        distance = calculate_distance_haversine(
-            pickup_lat, pickup_lng,
-            driver_location.get("latitude", 0),
-            driver_location.get("longitude", 0)
-        )
+        if driver.get("user_id") in reserved:
+            continue
         
         # Get driver user info
-        driver_user = await db.users.find_one({"id": driver.get("user_id")})
+        driver_user = driver_users.get(driver.get("user_id"))
         if not driver_user:
             continue
         
         # Get tier info
-        tier_data = await db.driver_tiers.find_one({"driver_id": driver.get("user_id")})
+        tier_data = driver_tiers.get(driver.get("user_id"))
         tier = tier_data.get("tier", "basic") if tier_data else "basic"
         
         # Calculate score (lower is better)
@@ -6222,73 +6914,122 @@ async def admin_login(request: AdminLoginRequest):
 
 @api_router.get("/admin/overview")
 async def admin_overview():
-    """Get dashboard overview stats"""
-    total_riders = await db.users.count_documents({"role": "rider"})
-    total_drivers = await db.users.count_documents({"role": "driver"})
-    total_trips = await db.trips.count_documents({})
-    completed_trips = await db.trips.count_documents({"status": "completed"})
-    
-    # Calculate revenue from completed trips
-    revenue_pipeline = [
-        {"$match": {"status": "completed"}},
-        {"$group": {"_id": None, "total": {"$sum": "$fare"}}}
-    ]
-    revenue_result = await db.trips.aggregate(revenue_pipeline).to_list(1)
-    total_revenue = revenue_result[0]["total"] if revenue_result else 0
-    
-    # Subscription revenue
-    active_subs = await db.subscriptions.count_documents({"status": "active"})
-    subscription_revenue = active_subs * SUBSCRIPTION_CONFIG["monthly_fee"]
-    
-    # Today's stats
-    today_start = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
-    today_trips = await db.trips.count_documents({"created_at": {"$gte": today_start}})
-    today_signups = await db.users.count_documents({"created_at": {"$gte": today_start}})
-    
+    """Get dashboard overview stats (served from the materialized platform_stats counters)"""
+    stats = await platform_stats.overview()
     return {
-        "total_riders": total_riders,
-        "total_drivers": total_drivers,
-        "total_trips": total_trips,
-        "completed_trips": completed_trips,
-        "total_revenue": total_revenue,
-        "subscription_revenue": subscription_revenue,
-        "active_subscriptions": active_subs,
-        "today_trips": today_trips,
-        "today_signups": today_signups
+        "total_riders": stats["total_riders"],
+        "total_drivers": stats["total_drivers"],
+        "total_trips": stats["total_trips"],
+        "completed_trips": stats["completed_trips"],
+        "total_revenue": stats["total_revenue"],
+        "subscription_revenue": stats["active_subscriptions"] * SUBSCRIPTION_CONFIG["monthly_fee"],
+        "active_subscriptions": stats["active_subscriptions"],
+        "today_trips": stats["today_trips"],
+        "today_signups": stats["today_signups"],
+        "stats_reconciled_at": stats["reconciled_at"]
+    }
+
+@api_router.post("/admin/overview/reconcile")
+async def admin_reconcile_overview():
+    """Recount the dashboard totals now; returns the drift that was corrected"""
+    drift = await platform_stats.reconcile()
+    return {"drift": drift, **platform_stats.stats()}
+
+@api_router.post("/admin/leaderboards/rebuild")
+async def admin_rebuild_leaderboards(backfill: bool = False):
+    """Rebuild the cached leaderboards now; backfill=true first recomputes the rollups from trips"""
+    rollups = await driver_leaderboards.backfill() if backfill else None
+    await driver_leaderboards.build()
+    return {"rollups_backfilled": rollups, **driver_leaderboards.stats()}
+
+@api_router.get("/admin/dispatch/stats")
+async def admin_dispatch_stats():
+    """Batched dispatcher counters"""
+    return {
+        "enabled": DISPATCH_ENABLED,
+        "leader": trip_dispatcher.is_leader,
+        "worker_id": trip_dispatcher.worker_id,
+        **trip_dispatcher.stats,
+        "drivers_holding_offers": len(await db.trips.distinct("offered_to", {
+            "status": "pending", "offered_to": {"$ne": None}, "offer_expires_at": {"$gt": datetime.utcnow()}
+        }))
     }
 
+@api_router.get("/admin/ingest/location-stats")
+async def admin_location_ingest_stats():
+    """Driver GPS ingestion counters (received, coalesced, flushed, dropped)"""
+    return location_buffer.stats()
+
+@api_router.get("/admin/cache/routes")
+async def admin_route_cache_stats():
+    """Route cache hit/miss/eviction statistics"""
+    return {**route_cache.stats(), "single_flight": directions_flight.stats()}
+
+@api_router.get("/admin/upstreams/latency")
+async def admin_upstream_latency():
+    """Latency histograms for outbound HTTP calls, per upstream"""
+    return upstream_clients.stats()
+
+@api_router.get("/admin/indexes/report")
+async def admin_index_report():
+    """Registered indexes that are missing, and existing indexes that are unused or unregistered"""
+    return await index_report(db)
+
+@api_router.get("/admin/realtime/stats")
+async def admin_realtime_stats():
+    """WebSocket connections, send queue depth and dropped messages/clients"""
+    return {
+        **chat_manager.stats(),
+        "event_gateway": event_gateway.stats(),
+        "shared_trips": shared_trips.stats(),
+        "chat_persister": chat_persister.stats(),
+        "unread_counters": unread_counters.stats()
+    }
+
+@api_router.get("/admin/safety/monitor")
+async def admin_safety_monitor_stats():
+    """In-memory trip safety states, points processed, anomalies and rebuilds"""
+    return safety_monitor.stats()
+
+async def admin_page(collection, query: dict, limit: int, after: Optional[str], skip: int = 0, **kwargs) -> tuple:
+    """keyset_page for admin lists; a bad `after` token is a 400"""
+    try:
+        return await keyset_page(collection, query, limit, after=after, skip=skip, projection={"_id": 0}, **kwargs)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
 @api_router.get("/admin/riders")
-async def admin_get_riders(limit: int = 100, skip: int = 0):
-    """Get all riders with their details"""
-    riders = await db.users.find(
-        {"role": "rider"},
-        {"_id": 0}
-    ).sort("created_at", -1).skip(skip).limit(limit).to_list(limit)
+async def admin_get_riders(limit: int = 100, skip: int = 0, after: Optional[str] = None):
+    """Get all riders with their details (pass `after`=next_cursor for the next page)"""
+    riders, next_cursor = await admin_page(db.users, {"role": "rider"}, limit, after, skip)
     
-    # Enrich with trip counts
+    # Enrich with trip counts (one $group for the whole page)
+    trip_counts = await batch_count(db.trips, "rider_id", [rider["id"] for rider in riders])
     for rider in riders:
-        rider["total_trips"] = await db.trips.count_documents({"rider_id": rider["id"]})
+        rider["total_trips"] = trip_counts.get(rider["id"], 0)
         rider["blocked"] = rider.get("blocked", False)
     
-    return {"riders": riders, "total": len(riders)}
+    return {"riders": riders, "total": len(riders), "next_cursor": next_cursor}
 
 @api_router.get("/admin/drivers")
-async def admin_get_drivers(limit: int = 100, skip: int = 0):
-    """Get all drivers with their details"""
-    drivers = await db.users.find(
-        {"role": "driver"},
-        {"_id": 0}
-    ).sort("created_at", -1).skip(skip).limit(limit).to_list(limit)
+async def admin_get_drivers(limit: int = 100, skip: int = 0, after: Optional[str] = None):
+    """Get all drivers with their details (pass `after`=next_cursor for the next page)"""
+    drivers, next_cursor = await admin_page(db.users, {"role": "driver"}, limit, after, skip)
+    
+    # Enrich with profile, subscription and trip count data (one query per collection)
+    driver_ids = [driver["id"] for driver in drivers]
+    profiles = await batch_lookup(db.driver_profiles, driver_ids, key="user_id", projection={"_id": 0})
+    subscriptions = await batch_lookup(
+        db.subscriptions, driver_ids, key="driver_id",
+        projection={"_id": 0, "status": 1},
+        sort=[("created_at", -1)]
+    )
+    trip_counts = await batch_count(db.trips, "driver_id", driver_ids)
     
-    # Enrich with profile and subscription data
     enriched_drivers = []
     for driver in drivers:
-        profile = await db.driver_profiles.find_one({"user_id": driver["id"]}, {"_id": 0})
-        subscription = await db.subscriptions.find_one(
-            {"driver_id": driver["id"]},
-            {"_id": 0},
-            sort=[("created_at", -1)]
-        )
+        profile = profiles.get(driver["id"])
+        subscription = subscriptions.get(driver["id"])
         
         enriched_drivers.append({
             **driver,
@@ -6299,26 +7040,31 @@ async def admin_get_drivers(limit: int = 100, skip: int = 0):
             } if profile else None,
             "subscription_status": subscription.get("status") if subscription else "none",
             "is_online": profile.get("is_online", False) if profile else False,
-            "total_trips": await db.trips.count_documents({"driver_id": driver["id"]}),
+            "total_trips": trip_counts.get(driver["id"], 0),
             "blocked": driver.get("blocked", False)
         })
     
-    return {"drivers": enriched_drivers, "total": len(enriched_drivers)}
+    return {"drivers": enriched_drivers, "total": len(enriched_drivers), "next_cursor": next_cursor}
 
 @api_router.get("/admin/trips")
-async def admin_get_trips(limit: int = 100, skip: int = 0, status: str = None):
-    """Get all trips with details"""
+async def admin_get_trips(limit: int = 100, skip: int = 0, status: str = None, after: Optional[str] = None):
+    """Get all trips with details (pass `after`=next_cursor for the next page)"""
     query = {}
     if status:
         query["status"] = status
     
-    trips = await db.trips.find(query, {"_id": 0}).sort("created_at", -1).skip(skip).limit(limit).to_list(limit)
+    trips, next_cursor = await admin_page(db.trips, query, limit, after, skip)
     
-    # Enrich with user names
+    # Enrich with user names (riders and drivers in one $in query)
+    names = await batch_lookup(
+        db.users,
+        [trip.get("rider_id") for trip in trips] + [trip.get("driver_id") for trip in trips],
+        projection={"name": 1, "_id": 0}
+    )
     enriched_trips = []
     for trip in trips:
-        rider = await db.users.find_one({"id": trip.get("rider_id")}, {"name": 1, "_id": 0})
-        driver = await db.users.find_one({"id": trip.get("driver_id")}, {"name": 1, "_id": 0}) if trip.get("driver_id") else None
+        rider = names.get(trip.get("rider_id"))
+        driver = names.get(trip.get("driver_id")) if trip.get("driver_id") else None
         
         enriched_trips.append({
             **trip,
@@ -6328,24 +7074,22 @@ async def admin_get_trips(limit: int = 100, skip: int = 0, status: str = None):
             "dropoff": {"address": trip.get("dropoff_location", {}).get("address", "N/A")}
         })
     
-    return {"trips": enriched_trips, "total": len(enriched_trips)}
+    return {"trips": enriched_trips, "total": len(enriched_trips), "next_cursor": next_cursor}
 
 @api_router.get("/admin/payments")
-async def admin_get_payments(limit: int = 100, skip: int = 0):
-    """Get subscription payments"""
-    subscriptions = await db.subscriptions.find(
-        {},
-        {"_id": 0}
-    ).sort("created_at", -1).skip(skip).limit(limit).to_list(limit)
+async def admin_get_payments(limit: int = 100, skip: int = 0, after: Optional[str] = None):
+    """Get subscription payments (pass `after`=next_cursor for the next page)"""
+    subscriptions, next_cursor = await admin_page(db.subscriptions, {}, limit, after, skip)
     
-    # Enrich with driver names
+    # Enrich with driver names (one $in query for the whole page)
+    names = await batch_lookup(db.users, [sub.get("driver_id") for sub in subscriptions], projection={"name": 1, "_id": 0})
     payments = []
     approved_count = 0
     pending_count = 0
     total_revenue = 0
     
     for sub in subscriptions:
-        driver = await db.users.find_one({"id": sub.get("driver_id")}, {"name": 1, "_id": 0})
+        driver = names.get(sub.get("driver_id"))
         
         status = "approved" if sub.get("status") == "active" else sub.get("status", "pending")
         if status == "approved" or status == "active":
@@ -6370,13 +7114,95 @@ async def admin_get_payments(limit: int = 100, skip: int = 0):
         "payments": payments,
         "approved_count": approved_count,
         "pending_count": pending_count,
-        "total_revenue": total_revenue
+        "total_revenue": total_revenue,
+        "next_cursor": next_cursor
     }
 
+async def enrich_trip_export(batch: List[dict]):
+    # Trips created before cities were recorded belong to the default city
+    for trip in batch:
+        trip["city"] = trip.get("city") or DEFAULT_CITY
+
+async def enrich_payment_export(batch: List[dict]):
+    names = await batch_lookup(db.users, [sub.get("driver_id") for sub in batch], projection={"name": 1, "_id": 0})
+    for sub in batch:
+        sub["driver_name"] = (names.get(sub.get("driver_id")) or {}).get("name")
+
+async def enrich_driver_export(batch: List[dict]):
+    driver_ids = [driver["id"] for driver in batch]
+    vehicle_fields = ("vehicle_type", "vehicle_model", "vehicle_plate", "is_online")
+    profiles = await batch_lookup(
+        db.driver_profiles, driver_ids, key="user_id",
+        projection={"_id": 0, **{field: 1 for field in vehicle_fields}}
+    )
+    subscriptions = await batch_lookup(
+        db.subscriptions, driver_ids, key="driver_id",
+        projection={"_id": 0, "status": 1},
+        sort=[("created_at", -1)]
+    )
+    for driver in batch:
+        profile = profiles.get(driver["id"]) or {}
+        driver.update({field: profile.get(field) for field in vehicle_fields})
+        driver["subscription_status"] = (subscriptions.get(driver["id"]) or {}).get("status", "none")
+
+@api_router.get("/admin/export/{dataset}")
+async def admin_export(
+    dataset: str,
+    format: str = "csv",
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    status: Optional[str] = None,
+    city: Optional[str] = None
+):
+    """
+    Stream trips, payments or drivers as CSV or NDJSON, oldest first.
+    Filters: created_at in [start, end), status (trips, payments) and
+    city (trips). Rows are read from a cursor in batches and written as
+    they arrive, so memory stays flat however many rows match.
+    """
+    if dataset not in EXPORT_COLUMNS:
+        raise HTTPException(status_code=404, detail=f"Unknown export: {dataset}")
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Format must be one of: {', '.join(EXPORT_FORMATS)}")
+    
+    query: Dict[str, Any] = {}
+    if start or end:
+        query["created_at"] = {}
+        if start:
+            query["created_at"]["$gte"] = as_naive_utc(start)
+        if end:
+            query["created_at"]["$lt"] = as_naive_utc(end)
+    if status:
+        if dataset == "drivers":
+            raise HTTPException(status_code=400, detail="status filter applies to trips and payments")
+        query["status"] = status
+    if city:
+        if dataset != "trips":
+            raise HTTPException(status_code=400, detail="city filter applies to trips")
+        city = city.lower()
+        # Trips without a city predate the field and count as the default city
+        query["city"] = {"$in": [city, None]} if city == DEFAULT_CITY else city
+    
+    if dataset == "trips":
+        collection, enrich = db.trips, enrich_trip_export
+    elif dataset == "payments":
+        collection, enrich = db.subscriptions, enrich_payment_export
+    else:
+        collection, enrich = db.users, enrich_driver_export
+        query["role"] = "driver"
+    
+    cursor = collection.find(query, {"_id": 0}).sort([("created_at", 1), ("id", 1)])
+    filename = f"{dataset}-{datetime.utcnow():%Y%m%d-%H%M%S}.{format}"
+    return StreamingResponse(
+        stream_rows(cursor, EXPORT_COLUMNS[dataset], format, enrich=enrich),
+        media_type=EXPORT_FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
 @api_router.post("/admin/subscriptions/{subscription_id}/approve")
 async def admin_approve_subscription(subscription_id: str):
     """Manually approve a subscription payment"""
-    result = await db.subscriptions.update_one(
+    previous = await set_subscription_status(
         {"id": subscription_id},
         {"$set": {
             "status": "active",
@@ -6385,14 +7211,14 @@ async def admin_approve_subscription(subscription_id: str):
         }}
     )
     
-    if result.modified_count > 0:
+    if previous is not None:
         return {"success": True, "message": "Subscription approved"}
     return {"success": False, "message": "Subscription not found"}
 
 @api_router.post("/admin/subscriptions/{subscription_id}/reject")
 async def admin_reject_subscription(subscription_id: str, reason: str = "Payment verification failed"):
     """Reject a subscription payment"""
-    result = await db.subscriptions.update_one(
+    previous = await set_subscription_status(
         {"id": subscription_id},
         {"$set": {
             "status": "rejected",
@@ -6401,7 +7227,7 @@ async def admin_reject_subscription(subscription_id: str, reason: str = "Payment
         }}
     )
     
-    if result.modified_count > 0:
+    if previous is not None:
         return {"success": True, "message": "Subscription rejected"}
     return {"success": False, "message": "Subscription not found"}
 
@@ -6748,7 +7574,7 @@ from performance_rewards import PerformanceRewardsManager
 @api_router.get("/admin/rewards/top-drivers")
 async def admin_get_top_drivers(period: str = "monthly", limit: int = 10):
     """Get top performing drivers for rewards"""
-    rewards_manager = PerformanceRewardsManager(db)
+    rewards_manager = PerformanceRewardsManager(db, unread_counters)
     
     if period == "monthly":
         top_drivers = await rewards_manager.get_top_drivers_monthly(limit=limit)
@@ -6770,7 +7596,7 @@ async def admin_grant_free_month(request: Dict[str, Any]):
     if not driver_id:
         raise HTTPException(status_code=400, detail="driver_id required")
     
-    rewards_manager = PerformanceRewardsManager(db)
+    rewards_manager = PerformanceRewardsManager(db, unread_counters)
     result = await rewards_manager.grant_free_month(driver_id, reason=reason)
     
     return result
@@ -6778,7 +7604,7 @@ async def admin_grant_free_month(request: Dict[str, Any]):
 @api_router.post("/admin/rewards/process-monthly")
 async def admin_process_monthly_rewards():
     """Process monthly performance rewards (top 10 drivers)"""
-    rewards_manager = PerformanceRewardsManager(db)
+    rewards_manager = PerformanceRewardsManager(db, unread_counters)
     result = await rewards_manager.process_monthly_rewards()
     
     return result
@@ -6905,7 +7731,7 @@ async def submit_driver_report(request: Dict[str, Any]):
             detail=f"Invalid category. Must be one of: {', '.join(valid_categories)}"
         )
     
-    report_system = DriverReportSystem(db)
+    report_system = DriverReportSystem(db, unread_counters)
     result = await report_system.submit_report(
         rider_id=rider_id,
         driver_id=driver_id,
@@ -6920,7 +7746,7 @@ async def submit_driver_report(request: Dict[str, Any]):
 @api_router.get("/reports/driver/{driver_id}")
 async def get_driver_reports(driver_id: str, include_resolved: bool = False):
     """Get all reports for a specific driver"""
-    report_system = DriverReportSystem(db)
+    report_system = DriverReportSystem(db, unread_counters)
     reports = await report_system.get_driver_reports(driver_id, include_resolved=include_resolved)
     
     return {
@@ -6932,7 +7758,7 @@ async def get_driver_reports(driver_id: str, include_resolved: bool = False):
 @api_router.get("/reports/driver/{driver_id}/statistics")
 async def get_driver_report_statistics(driver_id: str):
     """Get report statistics for a driver"""
-    report_system = DriverReportSystem(db)
+    report_system = DriverReportSystem(db, unread_counters)
     stats = await report_system.get_report_statistics(driver_id)
     
     return stats
@@ -6941,9 +7767,11 @@ async def get_driver_report_statistics(driver_id: str):
 async def admin_get_all_reports(
     status: Optional[str] = None,
     severity: Optional[str] = None,
-    limit: int = 100
+    limit: int = 100,
+    skip: int = 0,
+    after: Optional[str] = None
 ):
-    """Get all driver reports (admin only)"""
+    """Get all driver reports (admin only; pass `after`=next_cursor for the next page)"""
     query = {}
     
     if status:
@@ -6952,14 +7780,12 @@ async def admin_get_all_reports(
     if severity:
         query["severity"] = severity
     
-    reports = await db.driver_reports.find(query).sort("created_at", -1).to_list(limit)
-    
-    for report in reports:
-        report.pop("_id", None)
+    reports, next_cursor = await admin_page(db.driver_reports, query, limit, after, skip, id_field="report_id")
     
     return {
         "total": len(reports),
-        "reports": reports
+        "reports": reports,
+        "next_cursor": next_cursor
     }
 
 @api_router.post("/admin/reports/{report_id}/resolve")
@@ -7046,18 +7872,49 @@ async def seed_promo_codes():
         )
     logger.info("Default promo codes seeded")
 
+# Indexes for every hot query (see db_indexes.INDEX_REGISTRY)
+@app.on_event("startup")
+async def ensure_db_indexes():
+    """Apply the index registry (idempotent)"""
+    await apply_indexes(db)
+
 # Include routers
 app.include_router(api_router)
 app.include_router(subscription_router)
 app.include_router(map_router)
 app.include_router(call_router)
 
+async def seed_chat_counters():
+    """Count chat unread from before the counters existed for trips still in progress"""
+    try:
+        seeded = await unread_counters.seed_active_trips()
+        if seeded:
+            logger.info(f"Seeded {seeded} chat unread counters")
+    except Exception as e:
+        logger.error(f"Chat counter seeding failed: {e}")
+
 # Payment reminder background job
 @app.on_event("startup")
 async def startup_event():
     """Start background jobs on app startup"""
+    await upstream_clients.start()
+    await chat_manager.start()
+    await event_gateway.start()
+    asyncio.create_task(chat_persister.run_forever())
+    asyncio.create_task(unread_counters.run_forever())
+    asyncio.create_task(seed_chat_counters())
+    asyncio.create_task(platform_stats.run_forever())
+    asyncio.create_task(driver_leaderboards.run_forever())
     asyncio.create_task(payment_reminder_job())
     logger.info("Payment reminder job started")
+    await warm_spatial_grids()
+    asyncio.create_task(grid_eviction_job())
+    logger.info("Grid eviction job started")
+    if DISPATCH_ENABLED:
+        asyncio.create_task(trip_dispatcher.run_forever())
+        logger.info("Trip dispatcher started")
+    asyncio.create_task(location_buffer.run_forever())
+    logger.info("Location ingest buffer started")
 
 # Serve admin panel at /admin (local access)
 @app.get("/admin")
@@ -7098,4 +7955,11 @@ app.mount("/admin", StaticFiles(directory=str(ADMIN_DIR), html=True), name="admi
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    await location_buffer.close()
+    await chat_manager.close()
+    await event_gateway.close()
+    await chat_persister.close()
+    await unread_counters.close()
+    await upstream_clients.close()
+    await trip_dispatcher.release_lease()
     client.close()
@@ -0,0 +1,126 @@
+"""
+NexRyde Shared Trip Tracking
+Latest status and driver location per shared trip, kept in memory from gateway events
+"""
+
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Set, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Statuses after which a trip's state only needs to live until its links expire
+FINISHED_STATUSES = ("completed", "cancelled")
+
+
+class SharedTripHub:
+    """
+    In-memory view of every trip that has been shared on this worker.
+
+    Share tokens resolve to (trip_id, expires_at) and trips to the public
+    tracking view (status, pickup/dropoff, fare, driver location, SOS).
+    The hub subscribes to the realtime bus, so trip_status and location
+    events from any worker keep the view current; a tracking poll or a
+    share:<token> subscribe is then a dict lookup, and pushing an update
+    to the trip's watchers is done by the event gateway without a read.
+    Entries are dropped once every link to the trip has expired.
+
+    Before the trip starts there is no in-trip GPS, so the driver's own
+    pings (fanned out to every worker after each location flush) move
+    the driver_location of trips the driver is heading to.
+    """
+
+    def __init__(self, bus):
+        bus.subscribe(self._on_bus_message)
+        # token -> (trip_id, expires_at)
+        self.shares: Dict[str, Tuple[str, datetime]] = {}
+        # trip_id -> tracking view
+        self.trips: Dict[str, Dict[str, Any]] = {}
+        # driver_id -> tracked trips assigned to that driver
+        self.driver_trips: Dict[str, Set[str]] = {}
+        self.counters = {"hits": 0, "misses": 0, "events_applied": 0, "driver_pings_applied": 0, "evicted": 0}
+
+    def remember(self, token: str, trip_id: str, expires_at: datetime, view: Optional[Dict[str, Any]] = None):
+        """Register a share link (and the trip's view, if loaded)"""
+        self.shares[token] = (trip_id, expires_at)
+        if view is not None:
+            self.trips[trip_id] = {**self.trips.get(trip_id, {}), **view}
+            if view.get("driver_id"):
+                self.driver_trips.setdefault(view["driver_id"], set()).add(trip_id)
+
+    def resolve(self, token: str) -> Optional[Tuple[str, datetime]]:
+        """(trip_id, expires_at) for a known token, else None"""
+        return self.shares.get(token)
+
+    def view(self, token: str) -> Optional[Dict[str, Any]]:
+        """Cached tracking view for a token, or None on a miss"""
+        share = self.shares.get(token)
+        trip = self.trips.get(share[0]) if share else None
+        if trip is None:
+            self.counters["misses"] += 1
+            return None
+        self.counters["hits"] += 1
+        return trip
+
+    def apply(self, trip_id: str, event: Dict[str, Any]):
+        """Fold a gateway event into a tracked trip's view"""
+        trip = self.trips.get(trip_id)
+        if trip is None:
+            return
+        if event.get("type") == "trip_status":
+            trip["status"] = event.get("status", trip.get("status"))
+            if event.get("driver_id"):
+                trip["driver_id"] = event["driver_id"]
+                self.driver_trips.setdefault(event["driver_id"], set()).add(trip_id)
+        elif event.get("type") == "sos":
+            trip["sos_triggered"] = True
+        elif event.get("type") == "location":
+            trip["driver_location"] = {"lat": event["lat"], "lng": event["lng"], "timestamp": event.get("timestamp")}
+        else:
+            return
+        self.counters["events_applied"] += 1
+
+    def apply_driver_position(self, driver_id: str, lat: float, lng: float, timestamp: Optional[str]) -> List[str]:
+        """
+        Fold a driver ping into the trips that driver is on the way to;
+        returns their ids. Once a trip is ongoing its own GPS is used.
+        """
+        updated = []
+        for trip_id in self.driver_trips.get(driver_id, ()):
+            trip = self.trips.get(trip_id)
+            if (
+                trip is None
+                or trip.get("driver_id") != driver_id
+                or trip.get("status") in ("ongoing",) + FINISHED_STATUSES
+            ):
+                continue
+            trip["driver_location"] = {"lat": lat, "lng": lng, "timestamp": timestamp}
+            updated.append(trip_id)
+        self.counters["driver_pings_applied"] += len(updated)
+        return updated
+
+    async def _on_bus_message(self, channel: str, payload: Dict[str, Any]):
+        kind, _, trip_id = channel.partition(":")
+        if kind == "trip" and "event" in payload:
+            self.apply(trip_id, payload["event"])
+
+    def evict_expired(self, now: Optional[datetime] = None) -> int:
+        """Forget expired links, and trips no live link points at"""
+        now = now or datetime.utcnow()
+        for token, (_, expires_at) in list(self.shares.items()):
+            if expires_at <= now:
+                del self.shares[token]
+        live_trips = {trip_id for trip_id, _ in self.shares.values()}
+        stale = [trip_id for trip_id in self.trips if trip_id not in live_trips]
+        for trip_id in stale:
+            del self.trips[trip_id]
+        for driver_id, trip_ids in list(self.driver_trips.items()):
+            trip_ids.intersection_update(self.trips)
+            if not trip_ids:
+                del self.driver_trips[driver_id]
+        self.counters["evicted"] += len(stale)
+        return len(stale)
+
+    def stats(self) -> Dict[str, Any]:
+        finished = sum(1 for t in self.trips.values() if t.get("status") in FINISHED_STATUSES)
+        return {**self.counters, "shares": len(self.shares), "trips": len(self.trips), "finished_trips": finished}
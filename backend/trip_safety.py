@@ -0,0 +1,339 @@
+"""
+NexRyde Trip Safety
+Incremental per-trip anomaly detection (abnormal stops, route deviation, traffic)
+"""
+
+from collections import deque
+from datetime import datetime
+from typing import Any, Deque, Dict, List, Optional, Tuple
+import logging
+import math
+import time
+
+from geo_service import haversine_km
+
+logger = logging.getLogger(__name__)
+
+
+class SafetyConfig:
+    """Detection thresholds"""
+
+    # Stationary for longer than this is an abnormal stop
+    ABNORMAL_STOP_SECONDS = 300
+    # Drifting less than this from where the vehicle stopped still counts as stopped
+    STOP_RADIUS_KM = 0.03
+    # Further than this from the planned route is off-route
+    ROUTE_DEVIATION_KM = 0.5
+    # Consecutive off-route points before a deviation is reported (GPS noise)
+    DEVIATION_CONFIRM_POINTS = 3
+    # Route segments searched ahead of the last match for each point
+    ROUTE_SEARCH_WINDOW = 12
+    # While off-route, look for the whole route again only every this many points
+    ROUTE_RESCAN_EVERY_POINTS = 10
+    # Traffic: the previous TRAFFIC_WINDOW_POINTS speeds average below TRAFFIC_SPEED_KMH
+    TRAFFIC_SPEED_KMH = 10
+    TRAFFIC_WINDOW_POINTS = 5
+    # Trip states untouched this long are dropped (rebuilt on the next point)
+    IDLE_EVICT_SECONDS = 3600
+
+
+def decode_polyline(encoded: str) -> List[Tuple[float, float]]:
+    """Decode a Google encoded polyline into (lat, lng) pairs"""
+    points: List[Tuple[float, float]] = []
+    index = lat = lng = 0
+    while index < len(encoded):
+        deltas = []
+        for _ in range(2):
+            shift = result = 0
+            while True:
+                byte = ord(encoded[index]) - 63
+                index += 1
+                result |= (byte & 0x1F) << shift
+                shift += 5
+                if byte < 0x20:
+                    break
+            deltas.append(~(result >> 1) if result & 1 else result >> 1)
+        lat += deltas[0]
+        lng += deltas[1]
+        points.append((lat / 1e5, lng / 1e5))
+    return points
+
+
+def segment_distance_km(lat: float, lng: float, a: Tuple[float, float], b: Tuple[float, float]) -> float:
+    """Distance from a point to segment a-b (equirectangular; fine at city scale)"""
+    scale = math.cos(math.radians(lat))
+    ax, ay = (a[1] - lng) * scale, a[0] - lat
+    bx, by = (b[1] - lng) * scale, b[0] - lat
+    dx, dy = bx - ax, by - ay
+    length_sq = dx * dx + dy * dy
+    t = 0.0 if length_sq == 0 else max(0.0, min(1.0, -(ax * dx + ay * dy) / length_sq))
+    px, py = ax + t * dx, ay + t * dy
+    return math.hypot(px, py) * 111.32
+
+
+class TripSafetyState:
+    """
+    Rolling state for one ongoing trip. observe() is O(1) per point:
+    the stop anchor, a fixed window of recent speeds and the index of the
+    route segment last matched (searched a few segments ahead; the whole
+    route is only scanned once a point already looks off-route).
+    """
+
+    def __init__(self, trip_id: str, route: Optional[List[Tuple[float, float]]] = None):
+        self.trip_id = trip_id
+        self.route = route or []
+        self.route_index = 0
+        self.point_count = 0
+        self.last_at: Optional[datetime] = None
+        # Where and since when the vehicle has been stationary
+        self.anchor: Optional[Tuple[float, float]] = None
+        self.stationary_since: Optional[datetime] = None
+        self.stop_reported = False
+        self.off_route_points = 0
+        self.deviation_reported = False
+        self.speeds: Deque[float] = deque(maxlen=SafetyConfig.TRAFFIC_WINDOW_POINTS)
+        self.speed_sum = 0.0
+        self.traffic_open = False
+        self.touched = time.monotonic()
+
+    def observe(self, lat: float, lng: float, recorded_at: datetime, speed_kmh: Optional[float] = None) -> List[Dict[str, Any]]:
+        """Fold in one GPS point; returns the anomalies that started or ended at it"""
+        self.touched = time.monotonic()
+        if self.last_at is not None and recorded_at < self.last_at:
+            return []
+        self.last_at = recorded_at
+        anomalies = self._observe_position(lat, lng, recorded_at)
+        if speed_kmh is not None:
+            anomalies.extend(self.observe_speed(lat, lng, recorded_at, speed_kmh))
+        return anomalies
+
+    def _observe_position(self, lat: float, lng: float, recorded_at: datetime) -> List[Dict[str, Any]]:
+        self.point_count += 1
+        location = {"lat": lat, "lng": lng}
+        anomalies: List[Dict[str, Any]] = []
+
+        # Abnormal stop: one report per stop, re-armed once the vehicle moves
+        if self.anchor is None or haversine_km(self.anchor[0], self.anchor[1], lat, lng) >= SafetyConfig.STOP_RADIUS_KM:
+            self.anchor = (lat, lng)
+            self.stationary_since = recorded_at
+            self.stop_reported = False
+        elif (
+            not self.stop_reported
+            and (recorded_at - self.stationary_since).total_seconds() > SafetyConfig.ABNORMAL_STOP_SECONDS
+        ):
+            self.stop_reported = True
+            anomalies.append({
+                "check_type": "abnormal_stop",
+                "location": location,
+                "triggered_at": recorded_at,
+                "stationary_since": self.stationary_since
+            })
+
+        # Route deviation: confirmed over a few points, re-armed once back on route
+        if len(self.route) >= 2:
+            distance_km = self._distance_to_route(lat, lng)
+            if distance_km > SafetyConfig.ROUTE_DEVIATION_KM:
+                self.off_route_points += 1
+                if self.off_route_points >= SafetyConfig.DEVIATION_CONFIRM_POINTS and not self.deviation_reported:
+                    self.deviation_reported = True
+                    anomalies.append({
+                        "check_type": "route_deviation",
+                        "location": location,
+                        "triggered_at": recorded_at,
+                        "distance_km": round(distance_km, 3)
+                    })
+            else:
+                self.off_route_points = 0
+                self.deviation_reported = False
+
+        return anomalies
+
+    def observe_speed(self, lat: float, lng: float, recorded_at: datetime, speed_kmh: float) -> List[Dict[str, Any]]:
+        """
+        Fold in a speed reading (also used alone for speed-only tracking
+        pings): a slow window plus a slow current reading opens a traffic
+        delay, the first reading back above the threshold closes it.
+        """
+        self.touched = time.monotonic()
+        location = {"lat": lat, "lng": lng}
+        anomalies: List[Dict[str, Any]] = []
+        window_full = len(self.speeds) == self.speeds.maxlen
+        slow = (
+            window_full
+            and self.speed_sum / len(self.speeds) < SafetyConfig.TRAFFIC_SPEED_KMH
+            and speed_kmh < SafetyConfig.TRAFFIC_SPEED_KMH
+        )
+        if slow and not self.traffic_open:
+            self.traffic_open = True
+            anomalies.append({"check_type": "traffic_started", "location": location, "triggered_at": recorded_at})
+        elif self.traffic_open and speed_kmh >= SafetyConfig.TRAFFIC_SPEED_KMH:
+            self.traffic_open = False
+            anomalies.append({"check_type": "traffic_ended", "location": location, "triggered_at": recorded_at})
+        if window_full:
+            self.speed_sum -= self.speeds[0]
+        self.speeds.append(speed_kmh)
+        self.speed_sum += speed_kmh
+        return anomalies
+
+    def seed_speeds(self, speeds: List[float], traffic_open: bool):
+        """Replace the speed window and open-delay flag with the stored ones"""
+        self.speeds.clear()
+        self.speeds.extend(speeds[-SafetyConfig.TRAFFIC_WINDOW_POINTS:])
+        self.speed_sum = sum(self.speeds)
+        self.traffic_open = traffic_open
+
+    @property
+    def stopped(self) -> bool:
+        return self.stop_reported
+
+    @property
+    def off_route(self) -> bool:
+        return self.deviation_reported
+
+    def _distance_to_route(self, lat: float, lng: float) -> float:
+        last_segment = len(self.route) - 2
+        start = max(0, self.route_index - 1)
+        end = min(last_segment, self.route_index + SafetyConfig.ROUTE_SEARCH_WINDOW)
+        best_index, best = self._nearest_segment(lat, lng, start, end)
+        rescan_due = not self.deviation_reported or self.off_route_points % SafetyConfig.ROUTE_RESCAN_EVERY_POINTS == 0
+        if best > SafetyConfig.ROUTE_DEVIATION_KM and (start > 0 or end < last_segment) and rescan_due:
+            # Lost the route locally (e.g. a skipped stretch); rescan all of it
+            best_index, best = self._nearest_segment(lat, lng, 0, last_segment)
+        if best <= SafetyConfig.ROUTE_DEVIATION_KM:
+            self.route_index = best_index
+        return best
+
+    def _nearest_segment(self, lat: float, lng: float, start: int, end: int) -> Tuple[int, float]:
+        best_index, best = start, float("inf")
+        for i in range(start, end + 1):
+            distance = segment_distance_km(lat, lng, self.route[i], self.route[i + 1])
+            if distance < best:
+                best_index, best = i, distance
+        return best_index, best
+
+
+class TripSafetyMonitor:
+    """
+    Per-trip TripSafetyState for this worker's ongoing trips.
+
+    Position state lives in memory and is rebuilt by replaying the trip's
+    telemetry when it is missing (restart, eviction). When it is behind the
+    stored route summary (points handled by another worker), only the
+    points after its last one are read and applied, so detection never
+    re-reads the trip's history on the hot path. Speed readings
+    also arrive from /track, which writes no telemetry, so the speed
+    window and open-delay flag are re-seeded from the tail of the trip's
+    `trip_tracking` document (one small read) before speeds are folded in.
+    """
+
+    def __init__(self, db, telemetry):
+        self.db = db
+        self.telemetry = telemetry
+        self.states: Dict[str, TripSafetyState] = {}
+        self.counters = {"points": 0, "anomalies": 0, "rebuilds": 0, "catch_ups": 0, "speed_syncs": 0, "evicted": 0}
+
+    async def state_for(self, trip_id: str, trip: Optional[Dict[str, Any]] = None) -> TripSafetyState:
+        """
+        The trip's state. `trip` (polyline, route_summary.last_point) lets a
+        caller that already read the trip skip a second read; when given and
+        the trip's last stored point is newer than the state's, the points
+        in between are applied first (their anomalies were already reported
+        by the worker that stored them).
+        """
+        state = self.states.get(trip_id)
+        if state is not None:
+            if trip is None:
+                return state
+            last_point = (trip.get("route_summary") or {}).get("last_point") or {}
+            stored_at = last_point.get("timestamp")
+            if stored_at is None:
+                return state
+            if state.last_at is not None:
+                if stored_at > state.last_at:
+                    async for point in self.telemetry.iter_points(trip_id, since=state.last_at):
+                        state.observe(point["lat"], point["lng"], point["timestamp"], point.get("speed_kmh"))
+                    self.counters["catch_ups"] += 1
+                return state
+            # A bare speed-only state: the trip has positions it has never seen
+        if trip is None:
+            trip = await self.db.trips.find_one({"id": trip_id}, {"_id": 0, "polyline": 1}) or {}
+        return await self.rebuild(trip_id, trip.get("polyline"))
+
+    async def rebuild(self, trip_id: str, polyline: Optional[str] = None) -> TripSafetyState:
+        """Replay stored telemetry into a fresh state (anomalies already reported are not re-emitted)"""
+        route: List[Tuple[float, float]] = []
+        if polyline:
+            try:
+                route = decode_polyline(polyline)
+            except (IndexError, ValueError) as e:
+                logger.warning(f"Undecodable polyline for trip {trip_id}: {e}")
+        state = TripSafetyState(trip_id, route)
+        async for point in self.telemetry.iter_points(trip_id):
+            state.observe(point["lat"], point["lng"], point["timestamp"], point.get("speed_kmh"))
+        self.states[trip_id] = state
+        self.counters["rebuilds"] += 1
+        return state
+
+    async def sync_speeds(self, trip_id: str, state: TripSafetyState):
+        """Seed the speed window and open-delay flag from the stored speed logs and delays"""
+        tracking = await self.db.trip_tracking.find_one(
+            {"trip_id": trip_id},
+            {
+                "_id": 0,
+                "trip_id": 1,
+                "speed_logs": {"$slice": -SafetyConfig.TRAFFIC_WINDOW_POINTS},
+                "traffic_delays": {"$slice": -1}
+            }
+        ) or {}
+        delays = tracking.get("traffic_delays") or []
+        state.seed_speeds(
+            [log["speed_kmh"] for log in tracking.get("speed_logs") or [] if log.get("speed_kmh") is not None],
+            bool(delays) and "end" not in delays[-1]
+        )
+        self.counters["speed_syncs"] += 1
+
+    async def observe(
+        self,
+        trip_id: str,
+        points: List[Dict[str, Any]],
+        trip: Optional[Dict[str, Any]] = None,
+        speed_only: bool = False
+    ) -> List[Dict[str, Any]]:
+        """
+        Fold time-ordered points ({lat, lng, timestamp, speed_kmh?}) in and
+        return the anomalies they started or ended. speed_only points feed
+        traffic detection without moving the position state (and need no
+        position state at all, so a missing one is not rebuilt for them).
+        """
+        if speed_only:
+            state = self.states.get(trip_id)
+            if state is None:
+                state = self.states[trip_id] = TripSafetyState(trip_id)
+        else:
+            state = await self.state_for(trip_id, trip)
+        if any(point.get("speed_kmh") is not None for point in points):
+            await self.sync_speeds(trip_id, state)
+        anomalies: List[Dict[str, Any]] = []
+        for point in points:
+            if speed_only:
+                anomalies.extend(state.observe_speed(point["lat"], point["lng"], point["timestamp"], point["speed_kmh"]))
+            else:
+                anomalies.extend(state.observe(point["lat"], point["lng"], point["timestamp"], point.get("speed_kmh")))
+        self.counters["points"] += len(points)
+        self.counters["anomalies"] += len(anomalies)
+        return anomalies
+
+    def forget(self, trip_id: str):
+        """Drop a finished trip's state"""
+        self.states.pop(trip_id, None)
+
+    def evict_idle(self) -> int:
+        cutoff = time.monotonic() - SafetyConfig.IDLE_EVICT_SECONDS
+        idle = [trip_id for trip_id, state in self.states.items() if state.touched < cutoff]
+        for trip_id in idle:
+            del self.states[trip_id]
+        self.counters["evicted"] += len(idle)
+        return len(idle)
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self.counters, "trips": len(self.states)}
@@ -0,0 +1,165 @@
+"""
+NexRyde Trip Telemetry
+Time-bucketed GPS breadcrumbs per trip, kept out of the trip document
+"""
+
+from datetime import datetime, timedelta
+from typing import Any, AsyncIterator, Dict, List, Optional
+from pymongo import UpdateOne
+import logging
+import uuid
+
+from geo_service import haversine_km
+
+logger = logging.getLogger(__name__)
+
+# One telemetry document per trip per bucket
+TELEMETRY_BUCKET_MINUTES = 5
+# Points closer than this to the previous one count as not moving
+STATIONARY_RADIUS_KM = 0.01
+
+
+def bucket_start(recorded_at: datetime, bucket_minutes: int = TELEMETRY_BUCKET_MINUTES) -> datetime:
+    """Floor a timestamp to the start of its bucket"""
+    floored_minute = recorded_at.minute - recorded_at.minute % bucket_minutes
+    return recorded_at.replace(minute=floored_minute, second=0, microsecond=0)
+
+
+def update_route_summary(
+    summary: Optional[Dict[str, Any]],
+    lat: float,
+    lng: float,
+    recorded_at: datetime
+) -> Dict[str, Any]:
+    """
+    Fold one point into the compact per-trip summary stored on the trip:
+    point count, first/last point, travelled distance and since when the
+    vehicle has been stationary.
+    """
+    point = {"lat": lat, "lng": lng, "timestamp": recorded_at}
+    if not summary or not summary.get("last_point"):
+        return {
+            "point_count": 1,
+            "first_point": point,
+            "last_point": point,
+            "distance_km": 0.0,
+            "stationary_since": recorded_at
+        }
+
+    last = summary["last_point"]
+    step_km = haversine_km(last["lat"], last["lng"], lat, lng)
+    moved = step_km >= STATIONARY_RADIUS_KM
+    return {
+        "point_count": summary.get("point_count", 0) + 1,
+        "first_point": summary.get("first_point", last),
+        "last_point": point,
+        "distance_km": round(summary.get("distance_km", 0.0) + step_km, 4),
+        "stationary_since": recorded_at if moved else summary.get("stationary_since", last["timestamp"])
+    }
+
+
+class TripTelemetry:
+    """
+    Breadcrumb store for in-progress trips.
+
+    Points are appended to `trip_telemetry` documents keyed by
+    (trip_id, bucket_start), so a trip's trail grows as many small
+    documents instead of one ever-growing array on the trip itself.
+    """
+
+    def __init__(self, db, bucket_minutes: int = TELEMETRY_BUCKET_MINUTES):
+        self.db = db
+        self.bucket_minutes = bucket_minutes
+
+    def _append_op(self, trip_id: str, points: List[Dict[str, Any]]) -> UpdateOne:
+        start = bucket_start(points[0]["timestamp"], self.bucket_minutes)
+        return UpdateOne(
+            {"trip_id": trip_id, "bucket_start": start},
+            {
+                "$push": {"points": {"$each": points}},
+                "$inc": {"count": len(points)},
+                "$min": {"first_at": points[0]["timestamp"]},
+                "$max": {"last_at": points[-1]["timestamp"]},
+                "$setOnInsert": {"bucket_end": start + timedelta(minutes=self.bucket_minutes)}
+            },
+            upsert=True
+        )
+
+    async def append(self, trip_id: str, lat: float, lng: float, recorded_at: Optional[datetime] = None, **extra):
+        """Append one point to its bucket"""
+        point = {"lat": lat, "lng": lng, "timestamp": recorded_at or datetime.utcnow(), **extra}
+        await self.append_many(trip_id, [point])
+
+    async def append_many(self, trip_id: str, points: List[Dict[str, Any]]):
+        """Append points (each with lat, lng, timestamp) with one bulk write"""
+        if not points:
+            return
+        by_bucket: Dict[datetime, List[Dict[str, Any]]] = {}
+        for point in sorted(points, key=lambda p: p["timestamp"]):
+            by_bucket.setdefault(bucket_start(point["timestamp"], self.bucket_minutes), []).append(point)
+        operations = [self._append_op(trip_id, bucket_points) for bucket_points in by_bucket.values()]
+        await self.db.trip_telemetry.bulk_write(operations, ordered=False)
+
+    async def record_speeds(
+        self,
+        trip_id: str,
+        points: List[Dict[str, Any]],
+        new_delays: Optional[List[Dict[str, Any]]] = None,
+        close_open_delay_at: Optional[str] = None
+    ):
+        """
+        Append speed logs to the trip's `trip_tracking` document and record
+        traffic delays detected by the safety monitor, with one ordered bulk
+        write and no read of the existing logs. New delays are only pushed
+        while no delay is open, so two workers seeing the same slowdown
+        record it once.
+        """
+        if not points:
+            return
+        operations = []
+        if close_open_delay_at:
+            operations.append(UpdateOne(
+                {"trip_id": trip_id},
+                {"$set": {"traffic_delays.$[open].end": close_open_delay_at}},
+                array_filters=[{"open.end": {"$exists": False}}]
+            ))
+        speed_logs = [
+            {
+                "timestamp": p["timestamp"].isoformat(),
+                "speed_kmh": p["speed_kmh"],
+                "location": {"lat": p["lat"], "lng": p["lng"]}
+            }
+            for p in sorted(points, key=lambda p: p["timestamp"])
+        ]
+        operations.append(UpdateOne(
+            {"trip_id": trip_id},
+            {
+                "$push": {"speed_logs": {"$each": speed_logs}},
+                "$setOnInsert": {
+                    "id": str(uuid.uuid4()),
+                    "weather_conditions": [],
+                    "route_deviations": [],
+                    "stationary_periods": [],
+                    "created_at": datetime.utcnow()
+                }
+            },
+            upsert=True
+        ))
+        if new_delays:
+            operations.append(UpdateOne(
+                {"trip_id": trip_id, "traffic_delays": {"$not": {"$elemMatch": {"end": {"$exists": False}}}}},
+                {"$push": {"traffic_delays": {"$each": new_delays}}}
+            ))
+        await self.db.trip_tracking.bulk_write(operations, ordered=True)
+
+    async def iter_points(self, trip_id: str, since: Optional[datetime] = None) -> AsyncIterator[Dict[str, Any]]:
+        """Yield a trip's points in time order, one bucket at a time; only those after `since` if given"""
+        query: Dict[str, Any] = {"trip_id": trip_id}
+        if since is not None:
+            query["bucket_start"] = {"$gte": bucket_start(since, self.bucket_minutes)}
+        cursor = self.db.trip_telemetry.find(query, {"_id": 0, "points": 1}).sort("bucket_start", 1)
+        async for bucket in cursor:
+            # Points inside a bucket can arrive slightly out of order
+            for point in sorted(bucket.get("points", []), key=lambda p: p["timestamp"]):
+                if since is None or point["timestamp"] > since:
+                    yield point
@@ -0,0 +1,207 @@
+"""
+NexRyde Unread Counters
+Per-(user, scope) unread counts for trip chat and notifications, buffered and flushed in bulk
+"""
+
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+from pymongo import UpdateOne
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Scope for a user's in-app notifications; trip chat scopes are "trip:<trip_id>"
+NOTIFICATIONS_SCOPE = "notifications"
+TRIP_SCOPE_PREFIX = "trip:"
+
+# How often buffered counter changes are written
+COUNTER_FLUSH_INTERVAL_SECONDS = 1.0
+
+
+def trip_scope(trip_id: str) -> str:
+    return f"{TRIP_SCOPE_PREFIX}{trip_id}"
+
+
+class UnreadCounters:
+    """
+    Unread counters in `unread_counters` ({user_id, scope, count}).
+
+    Increments, decrements and resets are folded per (user, scope) in
+    memory and written with one bulk_write per flush; reads return the
+    stored count plus this worker's unflushed change, so an unread badge
+    is a single indexed read instead of a count over messages.
+
+    A counter that does not exist yet is seeded from the source collection
+    (unread notifications, or the other party's chat messages after the
+    user's read marker) by whichever read or flush creates it. Changes
+    are queued after the write they describe (chat messages are persisted
+    within milliseconds, well inside a counter flush), so the seed already
+    includes this worker's pending delta and the delta is dropped.
+    """
+
+    def __init__(self, db, flush_interval: float = COUNTER_FLUSH_INTERVAL_SECONDS):
+        self.db = db
+        self.flush_interval = flush_interval
+        # (user_id, scope) -> (reset_first, delta)
+        self.pending: Dict[Tuple[str, str], Tuple[bool, int]] = {}
+        self._flush_lock = asyncio.Lock()
+        self.counters = {"changes": 0, "flushed": 0, "flushes": 0, "flush_errors": 0}
+
+    def incr(self, user_id: str, scope: str, by: int = 1):
+        reset, delta = self.pending.get((user_id, scope), (False, 0))
+        self.pending[(user_id, scope)] = (reset, delta + by)
+        self.counters["changes"] += 1
+
+    def decr(self, user_id: str, scope: str, by: int = 1):
+        self.incr(user_id, scope, -by)
+
+    def reset(self, user_id: str, scope: str):
+        self.pending[(user_id, scope)] = (True, 0)
+        self.counters["changes"] += 1
+
+    def incr_notifications(self, user_id: str):
+        self.incr(user_id, NOTIFICATIONS_SCOPE)
+
+    async def clear_scope(self, scope: str):
+        """Drop every user's counter for a scope (e.g. a finished trip)"""
+        for key in [key for key in self.pending if key[1] == scope]:
+            del self.pending[key]
+        await self.db.unread_counters.delete_many({"scope": scope})
+
+    def _apply_pending(self, user_id: str, scope: str, stored: int) -> int:
+        reset, delta = self.pending.get((user_id, scope), (False, 0))
+        return max(0, (0 if reset else stored) + delta)
+
+    async def get(self, user_id: str, scope: str) -> int:
+        key = {"user_id": user_id, "scope": scope}
+        doc = await self.db.unread_counters.find_one(key, {"_id": 0, "count": 1})
+        if doc is None:
+            seeded = await self._seed_one(user_id, scope)
+            if seeded is not None:
+                # The seed already reflects this worker's unflushed changes
+                self.pending.pop((user_id, scope), None)
+                return seeded
+            doc = await self.db.unread_counters.find_one(key, {"_id": 0, "count": 1})
+        return self._apply_pending(user_id, scope, doc["count"] if doc else 0)
+
+    async def totals(self, user_id: str, prefix: Optional[str] = None) -> Dict[str, int]:
+        """All of a user's counters (optionally only scopes starting with prefix)"""
+        query: Dict[str, Any] = {"user_id": user_id}
+        if prefix:
+            query["scope"] = {"$regex": f"^{prefix}"}
+        stored = {doc["scope"]: doc.get("count", 0)
+                  async for doc in self.db.unread_counters.find(query, {"_id": 0, "scope": 1, "count": 1})}
+        for pending_user, scope in self.pending:
+            if pending_user == user_id and (not prefix or scope.startswith(prefix)):
+                stored.setdefault(scope, 0)
+        return {scope: self._apply_pending(user_id, scope, count) for scope, count in stored.items()}
+
+    async def _baseline(self, user_id: str, scope: str) -> int:
+        """Unread count for a scope, counted from the source collection"""
+        if scope == NOTIFICATIONS_SCOPE:
+            return await self.db.notifications.count_documents({"user_id": user_id, "read": False})
+        trip_id = scope[len(TRIP_SCOPE_PREFIX):]
+        query: Dict[str, Any] = {"trip_id": trip_id, "sender_id": {"$ne": user_id}, "is_read": False}
+        marker = await self.db.trip_read_markers.find_one(
+            {"trip_id": trip_id, "user_id": user_id}, {"_id": 0, "last_read_at": 1}
+        )
+        if marker and marker.get("last_read_at"):
+            query["created_at"] = {"$gt": marker["last_read_at"]}
+        return await self.db.trip_messages.count_documents(query)
+
+    async def _seed_one(self, user_id: str, scope: str) -> Optional[int]:
+        """Create a missing counter from its baseline; returns the count if this call created it"""
+        count = await self._baseline(user_id, scope)
+        result = await self.db.unread_counters.update_one(
+            {"user_id": user_id, "scope": scope},
+            {"$setOnInsert": {"count": count, "updated_at": datetime.utcnow()}},
+            upsert=True
+        )
+        return count if result.upserted_id is not None else None
+
+    async def _missing(self, keys: List[Tuple[str, str]]) -> List[Tuple[str, str]]:
+        """The (user, scope) keys that have no stored counter"""
+        stored = set()
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            async for doc in self.db.unread_counters.find(
+                {"$or": [{"user_id": user_id, "scope": scope} for user_id, scope in chunk]},
+                {"_id": 0, "user_id": 1, "scope": 1}
+            ):
+                stored.add((doc["user_id"], doc["scope"]))
+        return [key for key in keys if key not in stored]
+
+    async def seed_active_trips(self) -> int:
+        """
+        Create missing chat counters for both parties of every active trip
+        (run at startup, so chat unread from before the counters existed is
+        counted). Returns how many counters were created.
+        """
+        keys: List[Tuple[str, str]] = []
+        async for trip in self.db.trips.find(
+            {"status": {"$in": ["accepted", "ongoing"]}}, {"_id": 0, "id": 1, "rider_id": 1, "driver_id": 1}
+        ):
+            keys.extend((user_id, trip_scope(trip["id"])) for user_id in (trip.get("rider_id"), trip.get("driver_id")) if user_id)
+        seeded = 0
+        for user_id, scope in await self._missing(keys):
+            if await self._seed_one(user_id, scope) is not None:
+                seeded += 1
+        return seeded
+
+    async def flush(self) -> int:
+        async with self._flush_lock:
+            if not self.pending:
+                return 0
+            batch, self.pending = self.pending, {}
+            now = datetime.utcnow()
+            try:
+                # Counters created by this flush start from their baseline instead of the delta
+                baselines = {
+                    key: await self._baseline(*key)
+                    for key in await self._missing([key for key, (reset, delta) in batch.items() if not reset and delta])
+                }
+                operations: List[Any] = []
+                for (user_id, scope), (reset, delta) in batch.items():
+                    key = {"user_id": user_id, "scope": scope}
+                    if reset:
+                        operations.append(UpdateOne(key, {"$set": {"count": max(0, delta), "updated_at": now}}, upsert=True))
+                    elif delta:
+                        # Pipeline update clamps at zero. A new counter lands on its baseline (the
+                        # delta is already in it); one created meanwhile elsewhere still gets the delta
+                        start = baselines.get((user_id, scope), delta) - delta
+                        operations.append(UpdateOne(key, [{"$set": {
+                            "count": {"$max": [0, {"$add": [{"$ifNull": ["$count", start]}, delta]}]},
+                            "updated_at": now
+                        }}], upsert=True))
+                if not operations:
+                    return 0
+                await self.db.unread_counters.bulk_write(operations, ordered=False)
+            except Exception as e:
+                self.counters["flush_errors"] += 1
+                logger.error(f"Unread counter flush failed ({len(batch)} counters): {e}")
+                self._requeue(batch)
+                return 0
+            self.counters["flushes"] += 1
+            self.counters["flushed"] += len(batch)
+            return len(batch)
+
+    def _requeue(self, batch: Dict[Tuple[str, str], Tuple[bool, int]]):
+        """Merge a failed batch back in front of changes made since"""
+        for key, (reset, delta) in batch.items():
+            newer_reset, newer_delta = self.pending.get(key, (False, 0))
+            self.pending[key] = (True, newer_delta) if newer_reset else (reset, delta + newer_delta)
+
+    async def run_forever(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Unread counter loop error: {e}")
+
+    async def close(self):
+        await self.flush()
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self.counters, "pending": len(self.pending), "flush_interval_seconds": self.flush_interval}
@@ -0,0 +1,52 @@
+import asyncio
+import os
+from datetime import datetime, timedelta
+
+import pytest
+
+# server.py needs the full backend environment, including the private LLM client
+pytest.importorskip("emergentintegrations")
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+
+@pytest.fixture(scope="module")
+def server():
+    import motor.motor_asyncio
+    os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+    original = motor.motor_asyncio.AsyncIOMotorClient
+    motor.motor_asyncio.AsyncIOMotorClient = mongomock_motor.AsyncMongoMockClient
+    try:
+        import server as module
+    finally:
+        motor.motor_asyncio.AsyncIOMotorClient = original
+    return module
+
+
+def test_rest_poll_returns_websocket_era_messages(server):
+    from fastapi.testclient import TestClient
+
+    start = datetime.utcnow() - timedelta(hours=1)
+    asyncio.run(server.db.trips.insert_one({"id": "legacy-trip", "rider_id": "rider", "driver_id": "driver"}))
+    asyncio.run(server.db.trip_messages.insert_many([
+        # Stored by the original WebSocket chat: no created_at, only an ISO timestamp
+        {"id": "b", "trip_id": "legacy-trip", "sender_id": "driver", "message": "on my way",
+         "timestamp": start.isoformat(), "is_read": False},
+        {"id": "a", "trip_id": "legacy-trip", "sender_id": "driver", "message": "arrived",
+         "timestamp": (start + timedelta(minutes=5)).isoformat(), "is_read": False},
+        {"id": "c", "trip_id": "legacy-trip", "sender_id": "rider", "message": "coming",
+         "created_at": start + timedelta(minutes=6), "is_read": False},
+    ]))
+
+    client = TestClient(server.app)
+    page = client.get("/api/chat/messages/legacy-trip", params={"user_id": "rider", "limit": 2}).json()
+    assert "error" not in page
+    assert [m["message"] for m in page["messages"]] == ["on my way", "arrived"]
+    assert page["has_more"] is True
+    # The marker only moves up to the last message returned
+    assert server.chat_persister.pending_reads[("legacy-trip", "rider")] == start + timedelta(minutes=5)
+
+    rest = client.get(
+        "/api/chat/messages/legacy-trip", params={"user_id": "rider", "cursor": page["next_cursor"]}
+    ).json()
+    assert [m["message"] for m in rest["messages"]] == ["coming"]
+    assert rest["has_more"] is False
@@ -0,0 +1,67 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+from chat_persistence import ChatPersister, message_time
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_message_time_prefers_created_at_then_timestamp():
+    sent = datetime(2025, 1, 2, 3, 4, 5)
+    assert message_time({"created_at": sent, "timestamp": "2020-01-01T00:00:00"}) == sent
+    assert message_time({"timestamp": sent.isoformat()}) == sent
+    assert message_time({"timestamp": "2025-01-02T03:04:05Z"}) == sent
+    assert message_time({"timestamp": "not a time"}) is None
+    assert message_time({}) is None
+
+
+def test_ensure_sequence_numbers_legacy_messages_in_send_order():
+    async def scenario():
+        db = mongomock_motor.AsyncMongoMockClient().db
+        start = datetime(2025, 1, 1, 12, 0, 0)
+        await db.trip_messages.insert_many([
+            # Stored by the original WebSocket chat: ISO timestamp only, random ids
+            {"id": "zz", "trip_id": "t1", "message": "first", "timestamp": start.isoformat()},
+            {"id": "aa", "trip_id": "t1", "message": "third", "timestamp": (start + timedelta(seconds=20)).isoformat()},
+            {"id": "mm", "trip_id": "t1", "message": "second", "created_at": start + timedelta(seconds=10)},
+            {"id": "other", "trip_id": "t2", "message": "elsewhere", "created_at": start},
+        ])
+        persister = ChatPersister(db)
+        await persister.ensure_sequence("t1")
+        stored = await db.trip_messages.find({"trip_id": "t1"}, {"_id": 0}).sort("seq", 1).to_list(None)
+        counter = await db.chat_sequences.find_one({"_id": "t1"})
+
+        # A second worker finds the counter and leaves the numbers alone
+        await ChatPersister(db).ensure_sequence("t1")
+        again = await db.trip_messages.find({"trip_id": "t1"}, {"_id": 0}).sort("seq", 1).to_list(None)
+        return stored, counter, again, await db.trip_messages.find_one({"id": "other"})
+
+    stored, counter, again, other = run(scenario())
+    assert [m["message"] for m in stored] == ["first", "second", "third"]
+    assert [m["seq"] for m in stored] == [1, 2, 3]
+    assert counter["seq"] == 3
+    assert [m["seq"] for m in again] == [1, 2, 3]
+    assert "seq" not in other
+
+
+def test_flush_continues_the_sequence_after_legacy_messages():
+    async def scenario():
+        db = mongomock_motor.AsyncMongoMockClient().db
+        await db.trip_messages.insert_one(
+            {"id": "legacy", "trip_id": "t1", "message": "old", "timestamp": "2025-01-01T12:00:00"}
+        )
+        persister = ChatPersister(db)
+        now = datetime.utcnow()
+        await persister.submit({"id": "b", "trip_id": "t1", "message": "new 2", "created_at": now + timedelta(seconds=1)})
+        await persister.submit({"id": "a", "trip_id": "t1", "message": "new 1", "created_at": now})
+        await persister.flush()
+        return await db.trip_messages.find({"trip_id": "t1"}, {"_id": 0}).sort("seq", 1).to_list(None)
+
+    stored = run(scenario())
+    assert [(m["message"], m["seq"]) for m in stored] == [("old", 1), ("new 1", 2), ("new 2", 3)]
@@ -0,0 +1,137 @@
+import asyncio
+import itertools
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+from dispatcher import NO_EDGE_COST, assign_sparse, solve_min_cost_assignment
+
+
+def brute_force_cost(costs):
+    n, m = len(costs), len(costs[0])
+    return min(sum(costs[i][cols[i]] for i in range(n)) for cols in itertools.permutations(range(m), n))
+
+
+def test_solve_min_cost_assignment_matches_brute_force():
+    rng = random.Random(7)
+    for n, m in [(1, 1), (2, 3), (3, 3), (4, 6), (5, 5)]:
+        for _ in range(20):
+            costs = [[rng.randint(0, 50) for _ in range(m)] for _ in range(n)]
+            assignment = solve_min_cost_assignment(costs)
+            assert len(set(assignment)) == n
+            assert all(0 <= j < m for j in assignment)
+            assert sum(costs[i][j] for i, j in enumerate(assignment)) == brute_force_cost(costs)
+
+
+def test_solve_min_cost_assignment_empty_matrix():
+    assert solve_min_cost_assignment([]) == []
+
+
+def test_assign_sparse_prefers_the_lower_total_over_greedy_choices():
+    # Greedy would give d1 to t1 (1.0) and leave t2 with d2 (10.0)
+    edges = {("t1", "d1"): 1.0, ("t1", "d2"): 2.0, ("t2", "d1"): 1.5, ("t2", "d2"): 10.0}
+    assert sorted(assign_sparse(edges)) == [("t1", "d2", 2.0), ("t2", "d1", 1.5)]
+
+
+def test_assign_sparse_solves_components_and_more_trips_than_drivers():
+    edges = {
+        # Three trips competing for two drivers: one goes unmatched
+        ("t1", "d1"): 1.0, ("t2", "d1"): 2.0, ("t2", "d2"): 3.0, ("t3", "d2"): 0.5,
+        # Separate component
+        ("t9", "d9"): 4.0,
+    }
+    matches = assign_sparse(edges)
+    assert sorted(matches) == [("t1", "d1", 1.0), ("t3", "d2", 0.5), ("t9", "d9", 4.0)]
+    # Never offers a pair outside the candidate graph
+    assert all(cost < NO_EDGE_COST for _, _, cost in matches)
+
+
+def test_assign_sparse_empty_graph():
+    assert assign_sparse({}) == []
+
+
+@pytest.fixture
+def db():
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    return mongomock_motor.AsyncMongoMockClient().db
+
+
+def make_dispatcher(db, grid=None):
+    from dispatcher import TripDispatcher
+    from geo_service import SpatialGrid
+
+    return TripDispatcher(db, grid or SpatialGrid(max_age_seconds=600))
+
+
+def test_lease_has_one_holder_until_it_expires_or_is_released(db):
+    from dispatcher import DISPATCH_LEASE_ID
+
+    async def scenario():
+        first, second = make_dispatcher(db), make_dispatcher(db)
+        steps = [await first.acquire_lease(), await second.acquire_lease(), await first.acquire_lease()]
+        # The leader stops renewing; once the lease expires the other worker takes over
+        await db.dispatch_leases.update_one(
+            {"_id": DISPATCH_LEASE_ID}, {"$set": {"expires_at": datetime.utcnow() - timedelta(seconds=1)}}
+        )
+        steps += [await second.acquire_lease(), await first.acquire_lease()]
+        await second.release_lease()
+        steps.append(await first.acquire_lease())
+        return steps, first.stats["lease_acquisitions"], second.stats["lease_acquisitions"]
+
+    steps, first_acquisitions, second_acquisitions = asyncio.run(scenario())
+    assert steps == [True, False, True, True, False, True]
+    assert (first_acquisitions, second_acquisitions) == (2, 1)
+
+
+def test_reserved_drivers_only_counts_live_pending_offers(db):
+    now = datetime.utcnow()
+
+    async def scenario():
+        await db.trips.insert_many([
+            {"id": "t1", "status": "pending", "offered_to": "d1", "offer_expires_at": now + timedelta(seconds=20)},
+            {"id": "t2", "status": "pending", "offered_to": "d2", "offer_expires_at": now - timedelta(seconds=1)},
+            {"id": "t3", "status": "accepted", "offered_to": "d3", "offer_expires_at": now + timedelta(seconds=20)},
+            {"id": "t4", "status": "pending", "offered_to": "d4", "offer_expires_at": now + timedelta(seconds=20)},
+        ])
+        return await make_dispatcher(db).reserved_drivers(["d1", "d2", "d3", None])
+
+    assert asyncio.run(scenario()) == {"d1"}
+
+
+def test_dispatch_once_offers_each_trip_to_one_free_driver(db):
+    from geo_service import SpatialGrid
+
+    grid = SpatialGrid(max_age_seconds=600)
+    grid.upsert("d1", 6.5000, 3.3000)
+    grid.upsert("d2", 6.5100, 3.3100)
+    grid.upsert("busy", 6.5001, 3.3001)
+    now = datetime.utcnow()
+
+    async def scenario():
+        await db.users.insert_many([{"id": "r1"}, {"id": "r2", "blocked_drivers": ["d1"]}])
+        await db.trips.insert_many([
+            {"id": "t1", "rider_id": "r1", "status": "pending", "created_at": now,
+             "pickup_location": {"lat": 6.5000, "lng": 3.3000}},
+            {"id": "t2", "rider_id": "r2", "status": "pending", "created_at": now,
+             "pickup_location": {"lat": 6.5000, "lng": 3.3000}},
+            {"id": "t0", "rider_id": "r1", "driver_id": "busy", "status": "ongoing", "created_at": now},
+        ])
+        offered = []
+
+        async def on_offer(driver_id, trip, distance):
+            offered.append((trip["id"], driver_id))
+
+        dispatcher = make_dispatcher(db, grid)
+        dispatcher.on_offer = on_offer
+        result = await dispatcher.dispatch_once()
+        # Offers are reservations: a second window offers nothing new
+        again = await dispatcher.dispatch_once()
+        docs = await db.trips.find({"id": {"$in": ["t1", "t2"]}}, {"_id": 0, "id": 1, "offered_to": 1}).to_list(2)
+        return result, again, sorted(offered), {d["id"]: d["offered_to"] for d in docs}
+
+    result, again, offered, stored = asyncio.run(scenario())
+    assert result == {"trips": 2, "offers": 2}
+    assert again["offers"] == 0
+    assert offered == [("t1", "d1"), ("t2", "d2")]
+    assert stored == {"t1": "d1", "t2": "d2"}
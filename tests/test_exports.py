@@ -0,0 +1,76 @@
+import asyncio
+import csv
+import io
+import json
+from datetime import datetime
+
+import pytest
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+from exports import field_value, stream_rows
+
+COLUMNS = ["id", "created_at", "pickup_location.address", "fare", "tags"]
+
+TRIPS = [
+    {"id": "t1", "created_at": datetime(2024, 5, 1, 8, 30), "pickup_location": {"address": "Ikeja, Lagos"},
+     "fare": 1500, "tags": ["airport"]},
+    {"id": "t2", "created_at": datetime(2024, 5, 1, 9), "pickup_location": "unknown", "fare": None},
+    {"id": "t3", "created_at": datetime(2024, 5, 1, 10), "pickup_location": {"address": 'Lekki "Phase 1"'}, "fare": 800},
+]
+
+
+def export(fmt, enrich=None, batch_size=2):
+    async def scenario():
+        trips = mongomock_motor.AsyncMongoMockClient().db.trips
+        await trips.insert_many([dict(t) for t in TRIPS])
+        cursor = trips.find({}, {"_id": 0}).sort("created_at", 1)
+        return [chunk async for chunk in stream_rows(cursor, COLUMNS, fmt, enrich=enrich, batch_size=batch_size)]
+
+    return asyncio.run(scenario())
+
+
+def test_field_value_follows_dotted_paths():
+    doc = {"a": {"b": {"c": 1}}, "d": "flat"}
+    assert field_value(doc, "a.b.c") == 1
+    assert field_value(doc, "a.x") is None
+    assert field_value(doc, "d.e") is None
+
+
+def test_csv_export_has_a_header_and_one_chunk_per_batch():
+    chunks = export("csv")
+    # Header, then two batches of at most two rows
+    assert len(chunks) == 3
+    rows = list(csv.reader(io.StringIO("".join(chunks))))
+    assert rows == [
+        COLUMNS,
+        ["t1", "2024-05-01T08:30:00", "Ikeja, Lagos", "1500", '["airport"]'],
+        ["t2", "2024-05-01T09:00:00", "", "", ""],
+        ["t3", "2024-05-01T10:00:00", 'Lekki "Phase 1"', "800", ""],
+    ]
+
+
+def test_ndjson_export_writes_one_object_per_line():
+    chunks = export("ndjson")
+    assert len(chunks) == 2
+    lines = "".join(chunks).splitlines()
+    assert [json.loads(line) for line in lines] == [
+        {"id": "t1", "created_at": "2024-05-01T08:30:00", "pickup_location.address": "Ikeja, Lagos",
+         "fare": 1500, "tags": ["airport"]},
+        {"id": "t2", "created_at": "2024-05-01T09:00:00", "pickup_location.address": None, "fare": None, "tags": None},
+        {"id": "t3", "created_at": "2024-05-01T10:00:00", "pickup_location.address": 'Lekki "Phase 1"',
+         "fare": 800, "tags": None},
+    ]
+
+
+def test_enrich_runs_once_per_batch_before_rows_are_written():
+    batches = []
+
+    async def enrich(batch):
+        batches.append([doc["id"] for doc in batch])
+        for doc in batch:
+            doc["tags"] = "enriched"
+
+    lines = "".join(export("ndjson", enrich=enrich)).splitlines()
+    assert batches == [["t1", "t2"], ["t3"]]
+    assert all(json.loads(line)["tags"] == "enriched" for line in lines)
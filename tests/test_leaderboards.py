@@ -0,0 +1,78 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+from leaderboards import DriverLeaderboards, day_start, rollup_id
+
+
+@pytest.fixture
+def boards():
+    return DriverLeaderboards(mongomock_motor.AsyncMongoMockClient().db)
+
+
+def rollup(boards, driver_id, city, day):
+    return asyncio.run(boards.db.driver_daily_stats.find_one({"_id": rollup_id(driver_id, city, day)}))
+
+
+def test_completed_trips_roll_up_per_driver_city_and_day(boards):
+    completed_at = day_start().replace(hour=9)
+    asyncio.run(boards.record_trip_completed({"id": "t1", "driver_id": "d1", "fare": 1500, "completed_at": completed_at}))
+    asyncio.run(boards.record_trip_completed(
+        {"id": "t2", "driver_id": "d1", "fare": 500, "city": "Abuja", "completed_at": completed_at}
+    ))
+    asyncio.run(boards.record_trip_completed({"id": "t3", "driver_id": "d1", "fare": 700, "completed_at": completed_at}))
+    # Without a driver or a completion time there is nothing to count
+    asyncio.run(boards.record_trip_completed({"id": "t4", "driver_id": "d1", "fare": 900}))
+
+    lagos = rollup(boards, "d1", "lagos", day_start())
+    assert (lagos["trips"], lagos["earnings"]) == (2, 2200)
+    assert rollup(boards, "d1", "abuja", day_start())["trips"] == 1
+    assert boards.counters["rollup_updates"] == 3
+
+
+def test_re_rating_replaces_the_previous_rating(boards):
+    completed_at = datetime(2024, 5, 1, 9)
+    trip = {"id": "t1", "driver_id": "d1", "completed_at": completed_at}
+    asyncio.run(boards.record_rating(trip, 3))
+    asyncio.run(boards.record_rating({**trip, "driver_rating": 3}, 5))
+    asyncio.run(boards.record_rating({**trip, "driver_rating": 5}, 4))
+
+    stored = rollup(boards, "d1", "lagos", day_start(completed_at))
+    assert (stored["rating_sum"], stored["rating_count"]) == (4, 1)
+
+
+def test_build_ranks_by_earnings_per_period_and_city(boards):
+    today = day_start()
+
+    async def scenario():
+        await boards.db.users.insert_many([
+            {"id": "d1", "name": "Adebayo Okafor"}, {"id": "d2", "name": "Bisi"}, {"id": "d3", "name": None}
+        ])
+        for driver_id, city, days_ago, earnings, trips in [
+            ("d1", "lagos", 0, 3000, 2),
+            ("d2", "lagos", 0, 5000, 3),
+            ("d3", "abuja", 0, 4000, 1),
+            ("d1", "lagos", 3, 9000, 6),
+        ]:
+            day = today - timedelta(days=days_ago)
+            await boards.db.driver_daily_stats.insert_one({
+                "_id": rollup_id(driver_id, city, day), "driver_id": driver_id, "city": city, "day": day,
+                "earnings": earnings, "trips": trips, "rating_sum": 9, "rating_count": 2
+            })
+        return (
+            await boards.leaderboard("daily", "Lagos", 10),
+            await boards.leaderboard("weekly", "all", 10),
+            await boards.leaderboard("daily", "all", 1),
+        )
+
+    daily_lagos, weekly_all, daily_top = asyncio.run(scenario())
+    assert [(r["rank"], r["driver_id"], r["earnings"]) for r in daily_lagos] == [(1, "d2", 5000), (2, "d1", 3000)]
+    assert [r["driver_id"] for r in weekly_all] == ["d1", "d2", "d3"]
+    assert weekly_all[0]["earnings"] == 12000
+    assert weekly_all[0]["name"] == "Adebayo Ok..."
+    assert weekly_all[2]["name"] == "Anonymous"
+    assert weekly_all[0]["rating"] == 4.5
+    assert [r["driver_id"] for r in daily_top] == ["d2"]
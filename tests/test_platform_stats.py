@@ -0,0 +1,81 @@
+import asyncio
+
+import pytest
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+from platform_stats import TOTALS_ID, PlatformStats
+
+
+class CountHook:
+    """Collection wrapper running `hook` before each count_documents, as a concurrent write would"""
+
+    def __init__(self, collection, hook):
+        self.collection = collection
+        self.hook = hook
+
+    def __getattr__(self, name):
+        return getattr(self.collection, name)
+
+    async def count_documents(self, *args, **kwargs):
+        await self.hook()
+        return await self.collection.count_documents(*args, **kwargs)
+
+
+class RacingDb:
+    def __init__(self, db, hook):
+        self.db = db
+        self.hook = hook
+
+    def __getattr__(self, name):
+        collection = getattr(self.db, name)
+        return CountHook(collection, self.hook) if name == "subscriptions" else collection
+
+
+def test_record_methods_increment_the_totals():
+    async def scenario():
+        db = mongomock_motor.AsyncMongoMockClient().db
+        stats = PlatformStats(db)
+        await stats.record_signup("rider")
+        await stats.record_signup("driver")
+        await stats.record_role_change("rider", "driver")
+        await stats.record_trip_created()
+        await stats.record_trip_completed(1500)
+        await stats.record_subscription_status(None, "active")
+        await stats.record_subscription_status("active", "expired")
+        return await db.platform_stats.find_one({"_id": TOTALS_ID})
+
+    totals = asyncio.run(scenario())
+    assert totals["total_riders"] == 0
+    assert totals["total_drivers"] == 2
+    assert totals["total_trips"] == 1
+    assert totals["completed_trips"] == 1
+    assert totals["total_revenue"] == 1500
+    assert totals["active_subscriptions"] == 0
+
+
+def test_reconcile_corrects_drift_without_losing_concurrent_increments():
+    async def scenario():
+        db = mongomock_motor.AsyncMongoMockClient().db
+        await db.users.insert_many([{"role": "rider"}, {"role": "rider"}, {"role": "driver"}])
+        await PlatformStats(db).reconcile()
+        # Drift: an increment that never happened
+        await db.platform_stats.update_one({"_id": TOTALS_ID}, {"$inc": {"total_drivers": 5}})
+
+        async def signup_during_recount():
+            await db.users.insert_one({"role": "rider"})
+            await racing.record_signup("rider")
+
+        racing = PlatformStats(RacingDb(db, signup_during_recount))
+        drift = await racing.reconcile()
+        totals = await db.platform_stats.find_one({"_id": TOTALS_ID})
+        settled = await PlatformStats(db).reconcile()
+        return drift, racing.counters["last_unsettled"], totals, settled
+
+    drift, unsettled, totals, settled = asyncio.run(scenario())
+    assert drift == {"total_drivers": -5}
+    # Riders moved while counting, so they are left to the next run
+    assert "total_riders" in unsettled
+    assert totals["total_drivers"] == 1
+    assert totals["total_riders"] == 3
+    assert settled == {}
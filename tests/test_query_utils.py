@@ -0,0 +1,150 @@
+import asyncio
+
+import pytest
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+from query_utils import batch_count, batch_lookup
+
+
+def collection(name="docs"):
+    return getattr(mongomock_motor.AsyncMongoMockClient().db, name)
+
+
+def test_batch_lookup_keys_documents_by_id_with_one_query():
+    async def scenario():
+        users = collection("users")
+        await users.insert_many([{"id": "u1", "name": "Ada"}, {"id": "u2", "name": "Bola"}, {"id": "u3", "name": "Chi"}])
+        return await batch_lookup(users, ["u2", None, "u1", "u2", "missing"], projection={"_id": 0, "name": 1})
+
+    found = asyncio.run(scenario())
+    assert set(found) == {"u1", "u2"}
+    # The key field is added to a narrowing projection so results can be keyed
+    assert found["u1"] == {"id": "u1", "name": "Ada"}
+
+
+def test_batch_lookup_with_sort_keeps_the_first_document_per_key():
+    async def scenario():
+        subscriptions = collection("subscriptions")
+        await subscriptions.insert_many([
+            {"driver_id": "d1", "status": "expired", "created_at": 1},
+            {"driver_id": "d1", "status": "active", "created_at": 2},
+            {"driver_id": "d2", "status": "pending", "created_at": 1},
+        ])
+        return await batch_lookup(
+            subscriptions, ["d1", "d2"], key="driver_id", projection={"_id": 0, "status": 1}, sort=[("created_at", -1)]
+        )
+
+    found = asyncio.run(scenario())
+    assert found["d1"]["status"] == "active"
+    assert found["d2"]["status"] == "pending"
+
+
+def test_batch_count_groups_per_value():
+    async def scenario():
+        trips = collection("trips")
+        await trips.insert_many([
+            {"rider_id": "r1", "status": "completed"},
+            {"rider_id": "r1", "status": "cancelled"},
+            {"rider_id": "r2", "status": "completed"},
+            {"rider_id": "r3", "status": "completed"},
+        ])
+        return (
+            await batch_count(trips, "rider_id", ["r1", "r2"]),
+            await batch_count(trips, "rider_id", ["r1", "r2"], query={"status": "completed"}),
+            await batch_count(trips, "rider_id", []),
+        )
+
+    all_trips, completed, empty = asyncio.run(scenario())
+    assert all_trips == {"r1": 2, "r2": 1}
+    assert completed == {"r1": 1, "r2": 1}
+    assert empty == {}
+
+
+def test_cursor_round_trip_and_invalid_tokens():
+    from datetime import datetime
+
+    from query_utils import decode_cursor, decode_seq_cursor, encode_cursor, encode_seq_cursor
+
+    at = datetime(2024, 5, 1, 12, 30, 0, 123000)
+    assert decode_cursor(encode_cursor(at, "t1")) == (at, "t1")
+    assert decode_cursor(encode_cursor(None, "t1")) == (None, "t1")
+    assert decode_seq_cursor(encode_seq_cursor(42)) == 42
+    with pytest.raises(ValueError):
+        decode_cursor("not-a-cursor")
+    with pytest.raises(ValueError):
+        decode_seq_cursor(encode_cursor(at, "t1"))
+
+
+def test_keyset_filter_descending_includes_documents_missing_the_field():
+    from datetime import datetime
+
+    from query_utils import keyset_filter
+
+    at = datetime(2024, 5, 1)
+    assert keyset_filter((at, "t5"), descending=True) == {"$or": [
+        {"created_at": {"$lt": at}},
+        {"created_at": at, "id": {"$lt": "t5"}},
+        {"created_at": None},
+    ]}
+    assert keyset_filter((None, "t5"), descending=True) == {"created_at": None, "id": {"$lt": "t5"}}
+    assert keyset_filter((None, "t5")) == {"$or": [
+        {"created_at": {"$ne": None}},
+        {"created_at": None, "id": {"$gt": "t5"}},
+    ]}
+
+
+def test_keyset_page_walks_newest_first_then_legacy_documents_by_id():
+    from datetime import datetime, timedelta
+
+    from query_utils import keyset_page
+
+    base = datetime(2024, 5, 1)
+    docs = [{"id": f"t{i}", "created_at": base + timedelta(minutes=i // 2)} for i in range(6)]
+    docs += [{"id": "legacy-a"}, {"id": "legacy-b"}, {"id": "legacy-c", "created_at": None}]
+
+    async def scenario():
+        trips = collection("trips")
+        await trips.insert_many([dict(d) for d in docs])
+        pages, after = [], None
+        while True:
+            page, after = await keyset_page(trips, {}, limit=2, after=after, projection={"_id": 0, "id": 1})
+            pages.append([d["id"] for d in page])
+            if after is None:
+                return pages
+
+    pages = asyncio.run(scenario())
+    # Ties on created_at break by id, and documents missing it come last
+    assert [i for page in pages for i in page] == [
+        "t5", "t4", "t3", "t2", "t1", "t0", "legacy-c", "legacy-b", "legacy-a"
+    ]
+    assert all(len(page) <= 2 for page in pages)
+
+
+def test_keyset_page_skip_is_ignored_once_a_cursor_is_given():
+    from datetime import datetime, timedelta
+
+    from query_utils import keyset_page
+
+    base = datetime(2024, 5, 1)
+
+    async def scenario():
+        trips = collection("trips")
+        await trips.insert_many([{"id": f"t{i}", "created_at": base + timedelta(minutes=i)} for i in range(5)])
+        first, after = await keyset_page(trips, {}, limit=2, skip=1)
+        second, _ = await keyset_page(trips, {}, limit=2, after=after, skip=1)
+        return [d["id"] for d in first], [d["id"] for d in second]
+
+    assert asyncio.run(scenario()) == (["t3", "t2"], ["t1", "t0"])
+
+
+def test_keyset_page_rejects_a_non_datetime_sort_field():
+    from query_utils import keyset_page
+
+    async def scenario():
+        trips = collection("trips")
+        await trips.insert_many([{"id": f"t{i}", "created_at": f"2024-05-0{i + 1}"} for i in range(3)])
+        await keyset_page(trips, {}, limit=2)
+
+    with pytest.raises(TypeError):
+        asyncio.run(scenario())
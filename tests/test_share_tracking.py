@@ -0,0 +1,61 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from realtime import InMemoryBus
+from share_tracking import SharedTripHub
+
+
+def make_hub():
+    bus = InMemoryBus()
+    return bus, SharedTripHub(bus)
+
+
+def test_trip_events_from_the_bus_update_the_view():
+    bus, hub = make_hub()
+    hub.remember("tok", "t1", datetime.utcnow() + timedelta(hours=1), {"trip_id": "t1", "status": "pending"})
+
+    async def publish():
+        await bus.publish("trip:t1", {"event": {"type": "trip_status", "status": "accepted", "driver_id": "d1"}})
+        await bus.publish("trip:t1", {"event": {"type": "location", "lat": 6.5, "lng": 3.3, "timestamp": "x"}})
+        await bus.publish("trip:other", {"event": {"type": "sos"}})
+
+    asyncio.run(publish())
+    view = hub.view("tok")
+    assert view["status"] == "accepted"
+    assert view["driver_id"] == "d1"
+    assert view["driver_location"] == {"lat": 6.5, "lng": 3.3, "timestamp": "x"}
+    assert "sos_triggered" not in view
+    assert hub.driver_trips == {"d1": {"t1"}}
+
+
+def test_driver_pings_move_the_view_only_until_the_trip_starts():
+    _, hub = make_hub()
+    expires_at = datetime.utcnow() + timedelta(hours=1)
+    hub.remember("tok", "t1", expires_at, {"trip_id": "t1", "status": "accepted", "driver_id": "d1"})
+
+    assert hub.apply_driver_position("d1", 6.5, 3.3, "t0") == ["t1"]
+    assert hub.view("tok")["driver_location"]["timestamp"] == "t0"
+    assert hub.apply_driver_position("d2", 6.6, 3.4, "t0") == []
+
+    hub.apply("t1", {"type": "trip_status", "status": "ongoing"})
+    assert hub.apply_driver_position("d1", 6.7, 3.5, "t1") == []
+    assert hub.view("tok")["driver_location"]["timestamp"] == "t0"
+
+
+def test_reassigned_trip_ignores_the_previous_driver():
+    _, hub = make_hub()
+    hub.remember("tok", "t1", datetime.utcnow() + timedelta(hours=1), {"trip_id": "t1", "status": "accepted", "driver_id": "d1"})
+    hub.apply("t1", {"type": "trip_status", "status": "accepted", "driver_id": "d2"})
+    assert hub.apply_driver_position("d1", 6.5, 3.3, None) == []
+    assert hub.apply_driver_position("d2", 6.5, 3.3, None) == ["t1"]
+
+
+def test_expired_links_drop_their_trips_and_driver_index():
+    _, hub = make_hub()
+    now = datetime.utcnow()
+    hub.remember("old", "t1", now - timedelta(seconds=1), {"trip_id": "t1", "driver_id": "d1"})
+    hub.remember("live", "t2", now + timedelta(hours=1), {"trip_id": "t2", "driver_id": "d2"})
+    assert hub.evict_expired(now) == 1
+    assert hub.resolve("old") is None
+    assert hub.view("live") is not None
+    assert hub.driver_trips == {"d2": {"t2"}}
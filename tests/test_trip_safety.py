@@ -0,0 +1,113 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+from trip_safety import SafetyConfig, TripSafetyMonitor, TripSafetyState
+
+START = datetime(2025, 1, 1, 12, 0, 0)
+# A straight north-bound route, about 2.2 km long
+ROUTE = [(6.50, 3.30), (6.51, 3.30), (6.52, 3.30)]
+
+
+def types(anomalies):
+    return [a["check_type"] for a in anomalies]
+
+
+def test_abnormal_stop_is_reported_once_and_rearmed_by_moving():
+    state = TripSafetyState("t1")
+    limit = SafetyConfig.ABNORMAL_STOP_SECONDS
+    assert state.observe(6.5, 3.3, START) == []
+    assert state.observe(6.5, 3.3, START + timedelta(seconds=limit)) == []
+
+    stopped = state.observe(6.5, 3.3, START + timedelta(seconds=limit + 1))
+    assert types(stopped) == ["abnormal_stop"]
+    assert stopped[0]["stationary_since"] == START
+    assert state.observe(6.5, 3.3, START + timedelta(seconds=limit + 60)) == []
+
+    # Moving re-arms detection from the new anchor
+    moved_at = START + timedelta(seconds=limit + 120)
+    assert state.observe(6.51, 3.3, moved_at) == []
+    assert not state.stopped
+    assert types(state.observe(6.51, 3.3, moved_at + timedelta(seconds=limit + 1))) == ["abnormal_stop"]
+
+
+def test_route_deviation_needs_consecutive_off_route_points():
+    state = TripSafetyState("t1", ROUTE)
+    at = START
+    assert state.observe(6.505, 3.30, at) == []
+
+    # About 1.1 km east of the route
+    anomalies = []
+    for i in range(SafetyConfig.DEVIATION_CONFIRM_POINTS):
+        at += timedelta(seconds=10)
+        anomalies.extend(state.observe(6.505 + i * 0.001, 3.31, at))
+    assert types(anomalies) == ["route_deviation"]
+    assert state.off_route
+
+    # Reported once while off route, re-armed once back on it
+    assert state.observe(6.509, 3.31, at + timedelta(seconds=10)) == []
+    assert state.observe(6.51, 3.30, at + timedelta(seconds=20)) == []
+    assert not state.off_route
+
+
+def test_single_off_route_point_is_treated_as_noise():
+    state = TripSafetyState("t1", ROUTE)
+    assert state.observe(6.505, 3.31, START) == []
+    assert state.observe(6.506, 3.30, START + timedelta(seconds=10)) == []
+    assert state.off_route_points == 0
+
+
+def test_traffic_opens_on_a_slow_window_and_closes_on_the_first_fast_reading():
+    state = TripSafetyState("t1")
+    at = START
+    anomalies = []
+    for _ in range(SafetyConfig.TRAFFIC_WINDOW_POINTS + 1):
+        at += timedelta(seconds=10)
+        anomalies.extend(state.observe(6.5, 3.3, at, speed_kmh=4))
+    assert types(anomalies) == ["traffic_started"]
+    assert state.traffic_open
+
+    at += timedelta(seconds=10)
+    assert types(state.observe(6.5, 3.3, at, speed_kmh=SafetyConfig.TRAFFIC_SPEED_KMH)) == ["traffic_ended"]
+
+
+def test_out_of_order_points_are_ignored():
+    state = TripSafetyState("t1")
+    state.observe(6.5, 3.3, START)
+    assert state.observe(6.6, 3.3, START - timedelta(seconds=1)) == []
+    assert state.last_at == START
+    assert state.point_count == 1
+
+
+def test_monitor_catches_up_on_points_stored_by_another_worker():
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    from trip_telemetry import TripTelemetry
+
+    async def scenario():
+        db = mongomock_motor.AsyncMongoMockClient().db
+        telemetry = TripTelemetry(db)
+        here, elsewhere = TripSafetyMonitor(db, telemetry), TripSafetyMonitor(db, telemetry)
+        points = [
+            {"lat": 6.5 + i * 0.001, "lng": 3.3, "timestamp": START + timedelta(minutes=2 * i)} for i in range(8)
+        ]
+
+        async def handle(monitor, batch):
+            trip = await db.trips.find_one({"id": "t1"}) or {"id": "t1"}
+            await monitor.observe("t1", batch, trip=trip)
+            await telemetry.append_many("t1", batch)
+            await db.trips.update_one(
+                {"id": "t1"}, {"$set": {"route_summary": {"last_point": batch[-1]}}}, upsert=True
+            )
+
+        await handle(here, points[:3])
+        await handle(elsewhere, points[3:6])
+        await handle(here, points[6:])
+        return here
+
+    here = asyncio.run(scenario())
+    state = here.states["t1"]
+    assert state.point_count == 8
+    assert state.last_at == START + timedelta(minutes=14)
+    assert here.counters["rebuilds"] == 1
+    assert here.counters["catch_ups"] == 1